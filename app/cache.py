@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+USER_CACHE_SIZE = int(os.environ.get("SOCIAL_MEDIA_USER_CACHE_SIZE", "10000"))
+# other processes' changes to a user are seen after at most this long
+USER_CACHE_TTL = float(os.environ.get("SOCIAL_MEDIA_USER_CACHE_TTL", "5"))
+TOKEN_CACHE_SIZE = int(os.environ.get("SOCIAL_MEDIA_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.environ.get("SOCIAL_MEDIA_TOKEN_CACHE_TTL", "300"))
+
+logger = logging.getLogger("social_media.cache")
+
+
+class TTLCache:
+    # Bounded in-process cache: least recently used entries are evicted once
+    # maxsize is reached, and every entry expires ttl seconds after it was
+    # stored. A size or ttl of 0 turns the cache off. Values are returned
+    # as stored, so callers must not mutate them.
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    @property
+    def generation(self) -> int:
+        # Read before loading a value from its source. A put() given it is
+        # dropped if anything was invalidated in between, since the loaded
+        # value may predate that change.
+        return self._generation
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires = entry
+            if expires <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(
+        self,
+        key,
+        value,
+        ttl: Optional[float] = None,
+        generation: Optional[int] = None,
+    ) -> None:
+        # ttl may only shorten the cache's own lifetime for this entry
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if not self.enabled or ttl <= 0:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# user rows by id, read on every authenticated request
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# verified token payloads by token string, see utils.decode_token
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def log_stats() -> None:
+    for name, cache in (("user", user_cache), ("token", token_cache)):
+        stats = cache.stats()
+        logger.info(
+            "%s cache size=%d hits=%d misses=%d hit_rate=%.2f evictions=%d "
+            "expirations=%d",
+            name,
+            stats["size"],
+            stats["hits"],
+            stats["misses"],
+            stats["hit_rate"],
+            stats["evictions"],
+            stats["expirations"],
+        )
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Optional
+from repositories import open_repositories
+
+logger = logging.getLogger("social_media.change_log")
+
+# seconds between reports of this process's friend graph mark, each followed
+# by a trim of the friendship change log; "0" leaves it to trim calls, e.g.
+# from tests
+INTERVAL = float(os.environ.get("SOCIAL_MEDIA_CHANGE_LOG_TRIM", "60"))
+# a process that has not reported for this many intervals is taken to be
+# gone; should it come back, it finds its changes trimmed and reloads
+MISSED_INTERVALS = 3
+# this process, as a reader of the log
+READER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def trim(interval: float = INTERVAL, reader: str = READER) -> int:
+    # Reports this process's mark and trims what every reader has applied;
+    # returns how many changes were trimmed.
+    now = time.time()
+    async with open_repositories() as repos:
+        return await repos.friends.trim_changes(
+            reader, now, now - MISSED_INTERVALS * interval
+        )
+
+
+class ChangeLogTrimmer:
+    # Runs trim every `interval` seconds, starting at once so the log keeps
+    # what this process's graph still needs. A failed trim is logged and
+    # retried on the next round.
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await trim(self.interval)
+            except Exception:
+                logger.exception("Trimming the friendship change log failed")
+            await asyncio.sleep(self.interval)
+
+
+trimmer = ChangeLogTrimmer()
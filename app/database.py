@@ -1,8 +1,731 @@
+import asyncio
+import contextlib
+import functools
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence
+from urllib.parse import quote
+from fastapi import Request
+from cache import user_cache
+from friend_graph import friend_graph
+from instrumentation import NPlusOneError, QueryStats, current_query_stats
+from revocation import revocations
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DATABASE_PATH = os.environ.get("SOCIAL_MEDIA_DB", "social_media.db")
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+class PooledConnection(sqlite3.Connection):
+    # close() hands the connection back to its pool instead of closing it,
+    # so callers keep the usual get_db_connection() / conn.close() pattern
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        path: str = DATABASE_PATH,
+        uri: bool = False,
+        max_per_thread: int = 4,
+        journal_mode: str = "WAL",
+        synchronous: str = "FULL",
+        cache_size: int = -16000,
+        mmap_size: int = 256 * 1024 * 1024,
+        busy_timeout: int = 5000,
+        read_only: bool = False,
+        attach: Optional[dict] = None,
+    ):
+        journal_mode = journal_mode.upper()
+        synchronous = synchronous.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unsupported journal_mode: {journal_mode}")
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unsupported synchronous mode: {synchronous}")
+        if max_per_thread < 1:
+            raise ValueError("max_per_thread must be at least 1")
+
+        self.path = path
+        self.uri = uri
+        self.read_only = read_only
+        self.attach = dict(attach or {})
+        self.max_per_thread = max_per_thread
+        self.pragmas = {
+            "journal_mode": journal_mode,
+            "synchronous": synchronous,
+            "cache_size": int(cache_size),
+            "mmap_size": int(mmap_size),
+            "busy_timeout": int(busy_timeout),
+            "foreign_keys": "ON",
+        }
+        if read_only:
+            # the journal mode is a property of the file and is set by writers;
+            # query_only also rejects writes the ro open mode would let through
+            del self.pragmas["journal_mode"]
+            self.pragmas["query_only"] = "ON"
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._closed = False
+
+    def _idle(self) -> list:
+        idle = getattr(self._local, "idle", None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def _connect(self) -> PooledConnection:
+        # connections may be released from another worker thread than the
+        # one that acquired them, so same-thread checking is disabled
+        path, uri = self.path, self.uri
+        if self.read_only:
+            if uri:
+                path += ("&" if "?" in path else "?") + "mode=ro"
+            else:
+                path = f"file:{quote(os.path.abspath(path))}?mode=ro"
+            uri = True
+
+        conn = sqlite3.connect(
+            path,
+            uri=uri,
+            factory=PooledConnection,
+            check_same_thread=False,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        for schema, target in self.attach.items():
+            if self.read_only:
+                target = f"file:{quote(os.path.abspath(target))}?mode=ro"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (target,))
+        conn.pool = self
+
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _discard(self, conn: PooledConnection) -> None:
+        with self._lock:
+            self._connections.discard(conn)
+        sqlite3.Connection.close(conn)
+
+    def acquire(self) -> PooledConnection:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        idle = self._idle()
+        conn = idle.pop() if idle else self._connect()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        # uncommitted work is discarded, exactly like closing a plain connection
+        if conn.in_transaction:
+            conn.rollback()
+
+        idle = self._idle()
+        if self._closed or len(idle) >= self.max_per_thread:
+            self._discard(conn)
+        else:
+            idle.append(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            sqlite3.Connection.close(conn)
+
+
+def _fetch(conn: sqlite3.Connection, method: str, sql: str, params: tuple, row_factory):
+    cursor = conn.execute(sql, params)
+    if row_factory is not None:
+        # rows go straight from the cursor into the caller's record type,
+        # without building a sqlite3.Row first
+        cursor.row_factory = row_factory
+    return getattr(cursor, method)()
+
+
+class DatabaseExecutor:
+    # Dedicated threads for database work, so blocking sqlite calls never run
+    # on the event loop or on Starlette's shared threadpool. Reads go to a
+    # bounded reader lane with its own read-only connections; all writes go
+    # through a single writer thread and connection, so write transactions
+    # never contend for the sqlite lock and, under WAL, never block readers.
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        read_pool: ConnectionPool,
+        readers: int = 8,
+        batch_size: int = 256,
+        batch_delay: float = 0.002,
+    ):
+        if readers < 1:
+            raise ValueError("readers must be at least 1")
+
+        self.pool = pool
+        self.read_pool = read_pool
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix="db-reader")
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+        self.queue = GroupCommitQueue(self, batch_size, batch_delay)
+        self._writer_lock = None
+
+    @property
+    def writer_lock(self) -> asyncio.Lock:
+        if self._writer_lock is None:
+            self._writer_lock = asyncio.Lock()
+        return self._writer_lock
+
+    async def _run(self, executor: ThreadPoolExecutor, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+    def _read(self, method: str, sql: str, params: tuple, row_factory=None):
+        conn = self.read_pool.acquire()
+        try:
+            return _fetch(conn, method, sql, params, row_factory)
+        finally:
+            conn.close()
+
+    async def read(self, method: str, sql: str, params: tuple = (), row_factory=None):
+        return await self._run(
+            self.readers, self._read, method, sql, params, row_factory
+        )
+
+    async def run_writer(self, fn, *args):
+        return await self._run(self.writer, fn, *args)
+
+    def shutdown(self) -> None:
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+
+
+class GroupCommitQueue:
+    # Collects single-row writes from concurrent requests and commits them
+    # together, so a burst of inserts pays for one transaction instead of one
+    # each. Every write runs in its own savepoint: a failing row is rolled back
+    # and reported to its caller without affecting the rest of the batch.
+    # Callers are only answered after the batch has been committed.
+    def __init__(
+        self, db_executor: DatabaseExecutor, batch_size: int, batch_delay: float
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self._executor = db_executor
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._pending = []
+        self._loop = None
+        self._flusher = None
+        self._wakeup = None
+        self._full = None
+        self._closing = False
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not self._flusher.done():
+            return
+
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._flusher = loop.create_task(self._flush_forever())
+
+    async def submit(self, sql: str, params: tuple = ()) -> int:
+        self._start()
+
+        future = self._loop.create_future()
+        self._pending.append((sql, params, future))
+        self._wakeup.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        return await future
+
+    async def _flush_forever(self) -> None:
+        while not self._closing:
+            await self._wakeup.wait()
+            # give concurrent requests a few milliseconds to join the batch
+            if not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.batch_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._pending:
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+
+            try:
+                async with self._executor.writer_lock:
+                    results = await self._executor.run_writer(self._apply, batch)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_sql, _params, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _apply(self, batch: list) -> list:
+        conn = self._executor.pool.acquire()
+        results = []
+        try:
+            conn.execute("BEGIN")
+            for sql, params, _future in batch:
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    results.append(conn.execute(sql, params).lastrowid)
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO queued_write")
+                    results.append(e)
+                conn.execute("RELEASE queued_write")
+            conn.commit()
+        finally:
+            conn.close()
+        return results
+
+    async def close(self) -> None:
+        # answers everything still queued before returning
+        if self._flusher is None or self._loop is not asyncio.get_running_loop():
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        await self._flusher
+        await self.flush()
+        self._flusher = None
+        self._loop = None
+
+
+class AsyncSession:
+    # Request-scoped unit of work. Reads run on the reader lane until the
+    # first write; from then on the session owns the writer connection and
+    # every statement runs inside one transaction on the writer thread.
+    # Read-only sessions (GET requests) never touch the writer at all.
+    # Every statement is counted and timed in stats.
+    #
+    # The session itself talks to shard 0, the directory database; shard(k)
+    # returns a child session for shard file k with its own transaction.
+    # Writers are always taken directory first and then in ascending shard
+    # order, so two requests can never wait on each other's shards.
+    def __init__(
+        self,
+        db_executor: DatabaseExecutor,
+        read_only: bool = False,
+        stats: Optional[QueryStats] = None,
+        shard_executors: Sequence[DatabaseExecutor] = (),
+    ):
+        self._executor = db_executor
+        self.read_only = read_only
+        self.stats = stats if stats is not None else QueryStats()
+        self.index = 0
+        self._conn = None
+        self._root = self
+        self._label = ""
+        self._shard_executors = list(shard_executors)
+        self._children = {}
+        self._after_commit = []
+
+    @property
+    def in_write(self) -> bool:
+        return self._conn is not None
+
+    @property
+    def shard_count(self) -> int:
+        return len(self._root._shard_executors) + 1
+
+    def shard(self, index: int) -> "AsyncSession":
+        root = self._root
+        if index == 0:
+            return root
+        if not 0 < index < root.shard_count:
+            raise ValueError(f"No such shard: {index}")
+
+        child = root._children.get(index)
+        if child is None:
+            child = AsyncSession(
+                root._shard_executors[index - 1], root.read_only, root.stats
+            )
+            child.index = index
+            child._root = root
+            # the same statement on two shards is a scatter, not an N+1
+            child._label = f"/* shard {index} */ "
+            root._children[index] = child
+        return child
+
+    def after_commit(self, callback) -> None:
+        # runs once the request's writes are committed, and never if they
+        # are rolled back; used to drop cached copies of changed rows
+        self._root._after_commit.append(callback)
+
+    async def take_writer(self, immediate: bool = False) -> None:
+        # For a request that writes this database only after writing a
+        # later shard: the writer is taken now, so the order still holds.
+        # immediate also begins the transaction, taking the file's write
+        # lock from other processes too, so checks read next stay true
+        # until the commit. Only the directory may do so: a shard's
+        # transaction would also lock the attached directory.
+        if self._conn is None:
+            await self._begin_write()
+        if immediate and not self._conn.in_transaction:
+            await self._executor.run_writer(self._conn.execute, "BEGIN IMMEDIATE")
+
+    async def _begin_write(self) -> None:
+        if self.read_only:
+            raise RuntimeError("Read-only sessions cannot write")
+
+        root = self._root
+        for session in (root, *root._children.values()):
+            if session.in_write and session.index > self.index:
+                raise RuntimeError(
+                    f"Shard {self.index} written after shard {session.index}; "
+                    "write the directory first and shards in ascending order"
+                )
+
+        await self._executor.writer_lock.acquire()
+        try:
+            self._conn = await self._executor.run_writer(self._executor.pool.acquire)
+        except BaseException:
+            self._executor.writer_lock.release()
+            raise
+
+    async def _timed(self, sql: str, awaitable):
+        started = time.perf_counter()
+        try:
+            result = await awaitable
+        except BaseException:
+            # a failed statement is still counted, but an N+1 report must
+            # not replace the error it failed with
+            with contextlib.suppress(NPlusOneError):
+                self.stats.record(self._label + sql, time.perf_counter() - started)
+            raise
+        self.stats.record(self._label + sql, time.perf_counter() - started)
+        return result
+
+    async def _query(self, method: str, sql: str, params: tuple, row_factory):
+        if self._conn is None:
+            return await self._timed(
+                sql, self._executor.read(method, sql, params, row_factory)
+            )
+
+        return await self._timed(
+            sql,
+            self._executor.run_writer(
+                _fetch, self._conn, method, sql, params, row_factory
+            ),
+        )
+
+    async def fetchone(self, sql: str, params: tuple = (), row_factory=None):
+        return await self._query("fetchone", sql, params, row_factory)
+
+    async def fetchall(self, sql: str, params: tuple = (), row_factory=None):
+        return await self._query("fetchall", sql, params, row_factory)
+
+    async def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        if self._conn is None:
+            await self._begin_write()
+        return await self._timed(
+            sql, self._executor.run_writer(self._conn.execute, sql, params)
+        )
+
+    async def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        # one statement for many rows: counted once, run in one call
+        if self._conn is None:
+            await self._begin_write()
+        return await self._timed(
+            sql,
+            self._executor.run_writer(self._conn.executemany, sql, list(seq_of_params)),
+        )
+
+    async def execute_batched(self, sql: str, params: tuple = ()) -> int:
+        # Hands a single-row write to the group-commit queue and returns its
+        # lastrowid. The row is committed with the batch, independently of
+        # this session, so use it only for the last write of a request.
+        if self.read_only:
+            raise RuntimeError("Read-only sessions cannot write")
+        if self._conn is not None:
+            return (await self.execute(sql, params)).lastrowid
+        return await self._timed(sql, self._executor.queue.submit(sql, params))
+
+    async def close(self, commit: bool = True) -> None:
+        # the directory commits first, then the shards in order; once one
+        # commit fails everything after it is rolled back
+        sessions = [self, *(self._children[k] for k in sorted(self._children))]
+        failure = None
+        for session in sessions:
+            try:
+                await session._finish(commit)
+            except BaseException as e:
+                commit = False
+                failure = failure or e
+        if failure is not None:
+            raise failure
+
+        callbacks, self._after_commit = self._after_commit, []
+        if commit:
+            for callback in callbacks:
+                callback()
+
+    async def _finish(self, commit: bool) -> None:
+        if self._conn is None:
+            return
+
+        conn = self._conn
+        self._conn = None
+
+        def finish():
+            try:
+                if commit:
+                    conn.commit()
+            finally:
+                conn.close()
+
+        try:
+            await self._executor.run_writer(finish)
+        finally:
+            self._executor.writer_lock.release()
+
+
+def _settings_from_env() -> dict:
+    settings = {}
+    for option in ("journal_mode", "synchronous"):
+        value = os.environ.get(f"SOCIAL_MEDIA_DB_{option.upper()}")
+        if value:
+            settings[option] = value
+    for option in ("max_per_thread", "cache_size", "mmap_size", "busy_timeout"):
+        value = os.environ.get(f"SOCIAL_MEDIA_DB_{option.upper()}")
+        if value:
+            settings[option] = int(value)
+    return settings
+
+
+READERS = int(os.environ.get("SOCIAL_MEDIA_DB_READERS", "8"))
+READ_POOL_SIZE = int(os.environ.get("SOCIAL_MEDIA_DB_READ_POOL_SIZE", "2"))
+BATCH_SIZE = int(os.environ.get("SOCIAL_MEDIA_DB_BATCH_SIZE", "256"))
+BATCH_DELAY = float(os.environ.get("SOCIAL_MEDIA_DB_BATCH_DELAY_MS", "2")) / 1000
+
+READ_ONLY_METHODS = {"GET", "HEAD"}
+
+# Number of database files user-owned rows are spread over. Shard 0 is the
+# main database file, which also holds the global tables (the directory);
+# shard k > 0 lives next to it as <name>.shard<k>.db.
+SHARDS = int(os.environ.get("SOCIAL_MEDIA_DB_SHARDS", "1"))
+
+
+def shard_path(path: str, index: int) -> str:
+    if index == 0:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.shard{index}{ext}"
+
+
+def _create(path: str, read_pool_size: int, **options) -> tuple:
+    settings = {**_settings_from_env(), **options}
+    write_pool = ConnectionPool(path, **settings)
+    read_pool = ConnectionPool(
+        path, **{**settings, "max_per_thread": read_pool_size, "read_only": True}
+    )
+    return write_pool, read_pool
+
+
+def _create_executors(
+    path: str,
+    shards: int,
+    readers: int,
+    read_pool_size: int,
+    batch_size: int,
+    batch_delay: float,
+    **options,
+) -> list:
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+
+    executors = []
+    for index in range(shards):
+        # shard files see the directory tables (users, friends, groups,
+        # tags) through an attached schema, so queries joining them run
+        # unchanged on every shard
+        attach = {"directory": path} if index else None
+        write_pool, read_pool = _create(
+            shard_path(path, index), read_pool_size, attach=attach, **options
+        )
+        executors.append(
+            DatabaseExecutor(
+                write_pool,
+                read_pool,
+                readers=readers,
+                batch_size=batch_size,
+                batch_delay=batch_delay,
+            )
+        )
+    return executors
+
+
+executors = _create_executors(
+    DATABASE_PATH, SHARDS, READERS, READ_POOL_SIZE, BATCH_SIZE, BATCH_DELAY
+)
+executor = executors[0]
+pool, read_pool = executor.pool, executor.read_pool
+
+
+def configure(
+    path: str = DATABASE_PATH,
+    shards: int = SHARDS,
+    readers: int = READERS,
+    read_pool_size: int = READ_POOL_SIZE,
+    batch_size: int = BATCH_SIZE,
+    batch_delay: float = BATCH_DELAY,
+    **options,
+) -> ConnectionPool:
+    global pool, read_pool, executor, executors
+
+    close()
+    # cached rows belong to the database that is being replaced
+    user_cache.clear()
+    revocations.clear()
+    friend_graph.clear()
+    executors = _create_executors(
+        path, shards, readers, read_pool_size, batch_size, batch_delay, **options
+    )
+    executor = executors[0]
+    pool, read_pool = executor.pool, executor.read_pool
+    return pool
+
+
+def close() -> None:
+    for shard_executor in executors:
+        shard_executor.shutdown()
+        shard_executor.read_pool.close()
+        shard_executor.pool.close()
+
+
+def lock_path(path: str) -> str:
+    return f"{path}.lock"
+
+
+# msvcrt locks are exclusive byte ranges only. There, byte 0 of the lock file
+# stands for maintenance, and each app process also holds one byte of its
+# own past it, so maintenance finds every one of them in a single range.
+_PROCESS_BYTES = 2**31 - 2
+
+
+def _lock_bytes(lock, offset: int, count: int, wait: bool) -> None:
+    lock.seek(offset)
+    while True:
+        try:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, count)
+            return
+        except OSError:
+            if not wait:
+                raise BlockingIOError(f"{lock.name} is locked") from None
+        time.sleep(0.1)
+
+
+def _unlock_bytes(lock, offset: int, count: int) -> None:
+    lock.seek(offset)
+    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, count)
+
+
+def lock_shared(lock) -> None:
+    # held by serving processes; waits while maintenance holds the file
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        return
+    _lock_bytes(lock, 0, 1, wait=True)
+    try:
+        _lock_bytes(lock, 1 + os.getpid() % _PROCESS_BYTES, 1, wait=True)
+    finally:
+        _unlock_bytes(lock, 0, 1)
+
+
+def lock_exclusive(lock) -> None:
+    # held by maintenance; BlockingIOError while any process holds the file
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    _lock_bytes(lock, 0, 1, wait=False)
+    try:
+        _lock_bytes(lock, 1, _PROCESS_BYTES, wait=False)
+    except BlockingIOError:
+        _unlock_bytes(lock, 0, 1)
+        raise
+    _unlock_bytes(lock, 1, _PROCESS_BYTES)
+
+
+_app_lock = None
+
+
+def hold_app_lock() -> None:
+    # Every serving app process holds a shared lock on a file next to the
+    # database, so offline maintenance (app/sharding.py) can refuse to run
+    # beside it. Waits while such maintenance holds it exclusively.
+    global _app_lock
+
+    release_app_lock()
+    _app_lock = open(lock_path(pool.path), "a")
+    lock_shared(_app_lock)
+
+
+def release_app_lock() -> None:
+    global _app_lock
+
+    if _app_lock is not None:
+        _app_lock.close()
+        _app_lock = None
 
 
 def get_db_connection():
-    conn = sqlite3.connect("social_media.db")
-    conn.execute("PRAGMA foreign_keys = ON")
-    conn.row_factory = sqlite3.Row
-    return conn
+    return pool.acquire()
+
+
+def get_shard_connections() -> list:
+    # writer connections to every shard, the directory first
+    return [shard_executor.pool.acquire() for shard_executor in executors]
+
+
+async def get_db(request: Request):
+    # one session and one transaction per request: the auth dependency and
+    # the handler share it, and it is committed or rolled back here only.
+    # Declare it as Depends(get_db, scope="function") so the commit happens
+    # before the response is sent. GET requests only get a read-only session.
+    # Statements are counted into the request's QueryStats when the
+    # instrumentation middleware is installed.
+    session = AsyncSession(
+        executor,
+        read_only=request.method in READ_ONLY_METHODS,
+        stats=current_query_stats.get(),
+        shard_executors=executors[1:],
+    )
+    try:
+        yield session
+    except BaseException:
+        await session.close(commit=False)
+        raise
+    await session.close(commit=True)
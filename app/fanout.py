@@ -0,0 +1,32 @@
+import heapq
+import os
+from operator import attrgetter
+from typing import Iterable, Optional
+
+# Feed delivery mode. A post is pushed into every reader's timeline when it
+# is created, unless its audience (the author's friends, or the members of
+# its group) is larger than this; then only the author's timeline gets it,
+# the author or group is marked as pulled, and readers' feeds fetch its
+# posts when read. A mark stays, so posts pulled once are never missed.
+PUSH_LIMIT = int(os.environ.get("SOCIAL_MEDIA_FEED_PUSH_LIMIT", "1000"))
+
+
+def pushed(audience: int) -> bool:
+    return audience <= PUSH_LIMIT
+
+
+def merge(streams: Iterable, limit: Optional[int]) -> list:
+    # k-way merge of newest-first streams of posts, stopping once the page
+    # is full. A post can be in two streams (pushed to the timeline before
+    # its author was marked as pulled); equal ids come out next to each
+    # other, and the copy is skipped.
+    page = []
+    last_id = None
+    for post in heapq.merge(*streams, key=attrgetter("id"), reverse=True):
+        if post.id == last_id:
+            continue
+        page.append(post)
+        last_id = post.id
+        if len(page) == limit:
+            break
+    return page
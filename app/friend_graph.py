@@ -0,0 +1,260 @@
+import os
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+REFRESH_INTERVAL = float(os.environ.get("SOCIAL_MEDIA_GRAPH_REFRESH", "5"))
+
+
+def shortest_path(
+    neighbours: Callable[[int], Iterable[int]],
+    source: int,
+    target: int,
+    max_depth: int,
+) -> Optional[list[int]]:
+    # Bidirectional breadth-first search: each round expands the smaller
+    # of the two frontiers by one level, so a path of length d costs about
+    # two searches of depth d/2. The first node reached from both sides
+    # closes a shortest path. None when the two are more than max_depth
+    # steps apart.
+    if source == target:
+        return [source]
+    parents = ({source: None}, {target: None})
+    frontiers = ([source], [target])
+    depth = 0
+    while depth < max_depth and frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        seen, other = parents[side], parents[1 - side]
+        frontier = []
+        for node in frontiers[side]:
+            for neighbour in neighbours(node):
+                if neighbour in seen:
+                    continue
+                seen[neighbour] = node
+                if neighbour in other:
+                    return _join(parents, neighbour)
+                frontier.append(neighbour)
+        frontiers[side][:] = frontier
+        depth += 1
+    return None
+
+
+def _join(parents: tuple, meeting: int) -> list[int]:
+    path = []
+    node = meeting
+    while node is not None:
+        path.append(node)
+        node = parents[0][node]
+    path.reverse()
+    node = parents[1][meeting]
+    while node is not None:
+        path.append(node)
+        node = parents[1][node]
+    return path
+
+
+class FriendGraph:
+    # Accepted friendships as an adjacency map, so "are these two friends"
+    # is a set lookup instead of a query. The sqlite repositories load it
+    # once (at startup, or on first use) and apply every accepted or removed
+    # friendship after its transaction commits. Changes that arrive while a
+    # load is running are replayed over the loaded rows; add and remove are
+    # idempotent, so replaying one the rows already reflect is harmless.
+    # The graph is per process. Other workers' changes come from the
+    # friend_changes log: the graph keeps the mark of the last change it
+    # reflects and applies the ones after it at most once per refresh
+    # interval, and before every permission check.
+    #
+    # Loaded from a snapshot (see graph_snapshot), the friendships live in
+    # the snapshot's read-only sorted neighbour arrays, shared with every
+    # process that maps the same file, and only the changes made since are
+    # held here: friendships added on top of it and ones removed from it.
+    # Loaded from rows, there is no snapshot and everything is "added".
+    def __init__(
+        self, refresh_interval: float = REFRESH_INTERVAL, clock=time.monotonic
+    ):
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._base = None
+        self._added = defaultdict(set)
+        self._removed = defaultdict(set)
+        self.loaded = False
+        self.mark = 0
+        self._loaded_at = None
+        self._pending: Optional[list] = None
+
+    def refresh_due(self) -> bool:
+        # True at most once per refresh interval; the time is claimed before
+        # the log is read, so concurrent requests do not all read it at once
+        now = self._clock()
+        if not self.loaded or now - self._loaded_at < self.refresh_interval:
+            return False
+        self._loaded_at = now
+        return True
+
+    def begin_load(self) -> None:
+        if self._pending is None:
+            self._pending = []
+
+    def load(self, pairs: Iterable[tuple[int, int]], mark: int = 0) -> None:
+        # mark is the last change id read before the pairs were: a change
+        # the pairs already reflect is applied again by the next catch-up,
+        # which is harmless since the log is replayed in order
+        if self.loaded and self._pending is None:
+            # another load got there first and already replayed the changes;
+            # a reload of a loaded graph starts with begin_load
+            return
+
+        self._base = None
+        self._added = defaultdict(set)
+        self._removed = defaultdict(set)
+        self.mark = mark
+        for user_id, friend_id in pairs:
+            self._added[user_id].add(friend_id)
+            self._added[friend_id].add(user_id)
+        self._loaded()
+
+    def load_snapshot(
+        self, snapshot, changes: Iterable[tuple[int, int, int, bool]]
+    ) -> None:
+        # snapshot is a CSRSnapshot; changes are the log rows made since it
+        # was written
+        if self.loaded and self._pending is None:
+            return
+
+        self._base = snapshot
+        self._added = defaultdict(set)
+        self._removed = defaultdict(set)
+        self.mark = snapshot.mark
+        self.apply(changes)
+        self._loaded()
+
+    def apply(self, changes: Iterable[tuple[int, int, int, bool]]) -> None:
+        # (id, user_id, friend_id, accepted) rows of the change log, oldest
+        # first
+        for change_id, user_id, friend_id, accepted in changes:
+            change = self._link if accepted else self._unlink
+            change(user_id, friend_id)
+            change(friend_id, user_id)
+            self.mark = change_id
+
+    def _loaded(self) -> None:
+        self.loaded = True
+        self._loaded_at = self._clock()
+        pending, self._pending = self._pending or [], None
+        for change, args in pending:
+            change(*args)
+
+    def clear(self) -> None:
+        self._base = None
+        self._added = defaultdict(set)
+        self._removed = defaultdict(set)
+        self.loaded = False
+        self.mark = 0
+        self._loaded_at = None
+        self._pending = None
+
+    def _record(self, change, *args) -> bool:
+        # True when the change should be applied now
+        if self._pending is not None:
+            self._pending.append((change, args))
+        return self.loaded
+
+    def add(self, user_id: int, friend_id: int) -> None:
+        if self._record(self.add, user_id, friend_id):
+            self._link(user_id, friend_id)
+            self._link(friend_id, user_id)
+
+    def remove(self, user_id: int, friend_id: int) -> None:
+        if self._record(self.remove, user_id, friend_id):
+            self._unlink(user_id, friend_id)
+            self._unlink(friend_id, user_id)
+
+    def remove_users(self, user_ids: list[int]) -> None:
+        if self._record(self.remove_users, user_ids):
+            for user_id in user_ids:
+                for friend_id in list(self._neighbours(user_id)):
+                    self._unlink(user_id, friend_id)
+                    self._unlink(friend_id, user_id)
+
+    def _in_base(self, user_id: int, friend_id: int) -> bool:
+        return self._base is not None and self._base.has_edge(user_id, friend_id)
+
+    def _link(self, user_id: int, friend_id: int) -> None:
+        removed = self._removed.get(user_id)
+        if removed is not None and friend_id in removed:
+            _discard(self._removed, user_id, friend_id)
+        elif not self._in_base(user_id, friend_id):
+            self._added[user_id].add(friend_id)
+
+    def _unlink(self, user_id: int, friend_id: int) -> None:
+        added = self._added.get(user_id)
+        if added is not None and friend_id in added:
+            _discard(self._added, user_id, friend_id)
+        elif self._in_base(user_id, friend_id):
+            self._removed[user_id].add(friend_id)
+
+    def _neighbours(self, user_id: int):
+        # a set, or the snapshot's sorted array when nothing changed since
+        added = self._added.get(user_id, ())
+        if self._base is None:
+            return added
+        base = self._base.neighbours(user_id)
+        removed = self._removed.get(user_id)
+        if not added and not removed:
+            return base
+        neighbours = set(base)
+        neighbours.update(added)
+        if removed:
+            neighbours -= removed
+        return neighbours
+
+    def are_friends(self, user_id: int, other_id: int) -> bool:
+        added = self._added.get(user_id)
+        if added is not None and other_id in added:
+            return True
+        removed = self._removed.get(user_id)
+        if removed is not None and other_id in removed:
+            return False
+        return self._in_base(user_id, other_id)
+
+    def count(self, user_id: int) -> int:
+        count = len(self._added.get(user_id, ())) - len(self._removed.get(user_id, ()))
+        if self._base is not None:
+            count += self._base.degree(user_id)
+        return count
+
+    def friends_of(self, user_id: int) -> frozenset:
+        return frozenset(self._neighbours(user_id))
+
+    def mutual_friends(self, user_id: int, other_id: int) -> list[int]:
+        # each friend of the one with fewer is looked up among the other's:
+        # a set probe, or a binary search of a snapshot array
+        if self.count(other_id) < self.count(user_id):
+            user_id, other_id = other_id, user_id
+        return sorted(
+            friend_id
+            for friend_id in self._neighbours(user_id)
+            if self.are_friends(other_id, friend_id)
+        )
+
+    def path(self, source: int, target: int, max_depth: int) -> Optional[list[int]]:
+        return shortest_path(self._neighbours, source, target, max_depth)
+
+    def __len__(self) -> int:
+        # friendships, not users
+        entries = self._base.edges if self._base is not None else 0
+        entries += sum(len(friends) for friends in self._added.values())
+        entries -= sum(len(friends) for friends in self._removed.values())
+        return entries // 2
+
+
+def _discard(adjacent: defaultdict, user_id: int, friend_id: int) -> None:
+    friends = adjacent.get(user_id)
+    if friends is not None:
+        friends.discard(friend_id)
+        if not friends:
+            del adjacent[user_id]
+
+
+friend_graph = FriendGraph()
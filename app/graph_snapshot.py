@@ -0,0 +1,175 @@
+import argparse
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Optional
+import database
+from database import DATABASE_PATH
+from migrations import migrate
+
+logger = logging.getLogger("social_media.graph")
+
+# file the workers map at startup; unset, the graph is loaded from the
+# friends table
+SNAPSHOT_PATH = os.environ.get("SOCIAL_MEDIA_GRAPH_SNAPSHOT") or None
+
+# Layout, in native byte order (recorded in the magic):
+#   header: magic, users (largest id + 1), neighbour entries, change mark
+#   offsets: users + 1 unsigned 64-bit, where each user's neighbours start
+#   neighbours: unsigned 32-bit user ids, each user's in ascending order
+# Both directions of every friendship are stored. The change mark is the
+# last friend_changes id the snapshot includes.
+MAGIC = b"FGCSR1" + (b"LE" if sys.byteorder == "little" else b"BE")
+HEADER = struct.Struct("=8sQQQ")
+MAX_USER_ID = 2**32 - 1
+
+SNAPSHOT_PAIRS = """
+    SELECT user_low, user_high FROM friends WHERE status = 'accepted'
+    UNION ALL
+    SELECT user_high, user_low FROM friends WHERE status = 'accepted'
+    ORDER BY 1, 2
+"""
+CHANGES_SINCE = """
+    SELECT id, user_low, user_high, accepted FROM friend_changes
+    WHERE id > ?
+    ORDER BY id
+"""
+# the last change id handed out, even when the log has been trimmed empty;
+# ids are AUTOINCREMENT and a rolled back change gives its id back, so the
+# ids in the log have no gaps
+LAST_CHANGE = """
+    SELECT COALESCE(MAX(seq), 0) AS last FROM sqlite_sequence
+    WHERE name = 'friend_changes'
+"""
+
+# the lowest mark a running process's friend graph has reported, or NULL
+# when none has
+LOWEST_READER = "SELECT MIN(mark) AS mark FROM friend_graph_readers"
+TRIM_CHANGES = "DELETE FROM friend_changes WHERE id <= ?"
+
+
+class CSRSnapshot:
+    # A snapshot file mapped read-only. The pages belong to the OS page
+    # cache, so every worker that maps the same file shares one copy, and
+    # nothing is read until a user's neighbours are first looked at.
+    def __init__(self, path: str):
+        with open(path, "rb") as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, users, edges, mark = HEADER.unpack_from(self._map)
+        size = HEADER.size + (users + 1) * 8 + edges * 4
+        if magic != MAGIC or len(self._map) != size:
+            self._map.close()
+            raise ValueError(f"Not a graph snapshot for this machine: {path}")
+
+        self.users = users
+        self.edges = edges
+        self.mark = mark
+        view = memoryview(self._map)
+        start = HEADER.size + (users + 1) * 8
+        self._offsets = view[HEADER.size : start].cast("Q")
+        self._neighbours = view[start:].cast("I")
+
+    def neighbours(self, user_id: int):
+        if not 0 <= user_id < self.users:
+            return ()
+        return self._neighbours[self._offsets[user_id] : self._offsets[user_id + 1]]
+
+    def degree(self, user_id: int) -> int:
+        if not 0 <= user_id < self.users:
+            return 0
+        return self._offsets[user_id + 1] - self._offsets[user_id]
+
+    def has_edge(self, user_id: int, friend_id: int) -> bool:
+        neighbours = self.neighbours(user_id)
+        i = bisect_left(neighbours, friend_id)
+        return i < len(neighbours) and neighbours[i] == friend_id
+
+
+def open_snapshot(path: Optional[str] = SNAPSHOT_PATH) -> Optional[CSRSnapshot]:
+    if path is None:
+        return None
+    try:
+        return CSRSnapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning("Loading the friend graph from the database: %s", e)
+        return None
+
+
+def changes_since(
+    conn: sqlite3.Connection, mark: int
+) -> list[tuple[int, int, int, bool]]:
+    return conn.execute(CHANGES_SINCE, (mark,)).fetchall()
+
+
+def last_change(conn: sqlite3.Connection) -> int:
+    return conn.execute(LAST_CHANGE).fetchone()[0]
+
+
+def write_snapshot(conn: sqlite3.Connection, path: str) -> CSRSnapshot:
+    # Reads every accepted friendship and the change mark in one read
+    # transaction, writes them next to path and renames the file into
+    # place, so a worker maps either the old snapshot or the new one. The
+    # change log is then trimmed to what the new snapshot, the previous one
+    # and the running processes' graphs still need.
+    previous = open_snapshot(path) if os.path.exists(path) else None
+    offsets = array("Q", [0])
+    neighbours = array("I")
+    conn.execute("BEGIN")
+    try:
+        mark = last_change(conn)
+        for user_id, friend_id in conn.execute(SNAPSHOT_PAIRS):
+            if friend_id > MAX_USER_ID:
+                raise ValueError(f"User id {friend_id} does not fit a snapshot")
+            while len(offsets) <= user_id:
+                offsets.append(len(neighbours))
+            neighbours.append(friend_id)
+    finally:
+        conn.rollback()
+    offsets.append(len(neighbours))
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as target:
+        target.write(HEADER.pack(MAGIC, len(offsets) - 1, len(neighbours), mark))
+        offsets.tofile(target)
+        neighbours.tofile(target)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(temporary, path)
+
+    floors = [mark, conn.execute(LOWEST_READER).fetchone()[0]]
+    if previous is not None:
+        floors.append(previous.mark)
+    conn.execute(TRIM_CHANGES, (min(f for f in floors if f is not None),))
+    conn.commit()
+    return CSRSnapshot(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Write the accepted friendships to a graph snapshot file"
+    )
+    parser.add_argument("--db", default=DATABASE_PATH)
+    parser.add_argument("--out", default=SNAPSHOT_PATH, required=SNAPSHOT_PATH is None)
+    args = parser.parse_args()
+
+    database.configure(args.db)
+    conn = database.get_db_connection()
+    try:
+        migrate(conn)
+        snapshot = write_snapshot(conn, args.out)
+    finally:
+        conn.close()
+        database.close()
+    print(
+        f"wrote {snapshot.edges // 2} friendships of {snapshot.users} user ids "
+        f"to {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger("social_media.queries")
+
+# A statement executed more than REPEAT_LIMIT times by one request is reported
+# as a likely N+1 query. In strict mode (the test suite) it raises instead.
+REPEAT_LIMIT = int(os.environ.get("SOCIAL_MEDIA_QUERY_REPEAT_LIMIT", "3"))
+STRICT = os.environ.get("SOCIAL_MEDIA_QUERY_STRICT", "") not in ("", "0")
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+QUERY_TIME_HEADER = "X-Query-Time-Ms"
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+class QueryStats:
+    def __init__(self, repeat_limit: int = REPEAT_LIMIT, strict: bool = False):
+        self.repeat_limit = repeat_limit
+        self.strict = strict
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, sql: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        key = " ".join(sql.split())
+        self.statements[key] += 1
+        if self.strict and self.statements[key] > self.repeat_limit:
+            raise NPlusOneError(
+                f"Statement ran {self.statements[key]} times in one request: {key}"
+            )
+
+    @property
+    def repeated(self) -> dict[str, int]:
+        return {
+            sql: count
+            for sql, count in self.statements.items()
+            if count > self.repeat_limit
+        }
+
+    @property
+    def milliseconds(self) -> float:
+        return self.seconds * 1000
+
+
+# set by QueryStatsMiddleware for the duration of each request and picked up
+# by database.get_db
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_query_stats", default=None
+)
+
+
+class QueryStatsMiddleware:
+    # Counts the SQL statements of each HTTP request and the time spent
+    # waiting for them, reports both as response headers and logs one line
+    # per request. Pure ASGI so the body is streamed through untouched.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(strict=STRICT)
+        token = current_query_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers[QUERY_COUNT_HEADER] = str(stats.count)
+                headers[QUERY_TIME_HEADER] = f"{stats.milliseconds:.2f}"
+                _log(scope, message["status"], stats, time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_query_stats.reset(token)
+
+
+def _log(scope, status: int, stats: QueryStats, seconds: float) -> None:
+    logger.info(
+        "%s %s status=%d queries=%d sql_ms=%.2f total_ms=%.2f",
+        scope["method"],
+        scope["path"],
+        status,
+        stats.count,
+        stats.milliseconds,
+        seconds * 1000,
+    )
+    for sql, count in stats.repeated.items():
+        logger.warning(
+            "possible N+1 in %s %s: statement ran %d times: %s",
+            scope["method"],
+            scope["path"],
+            count,
+            sql,
+        )
@@ -1,7 +1,46 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+import cache
+import database
+import repositories
+from change_log import trimmer as change_log_trimmer
+from database import get_shard_connections
+from graph_snapshot import open_snapshot
+from instrumentation import QueryStatsMiddleware
+from migrations import migrate_shards
+from passwords import hasher
+from repositories.sqlite import load_friend_graph
 from routers import friends, groups, posts, chat, stories, auth
+from suggestions import worker as suggestion_worker
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # bring the schema up to date before serving any request
+    if repositories.BACKEND == "sqlite":
+        database.hold_app_lock()
+        connections = get_shard_connections()
+        try:
+            migrate_shards(connections)
+            load_friend_graph(connections[0], open_snapshot())
+        finally:
+            for conn in connections:
+                conn.close()
+    suggestion_worker.start()
+    change_log_trimmer.start()
+    yield
+    await change_log_trimmer.stop()
+    await suggestion_worker.stop()
+    # answer any writes still waiting for a group commit
+    for shard_executor in database.executors:
+        await shard_executor.queue.close()
+    hasher.shutdown()
+    cache.log_stats()
+    database.release_app_lock()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(QueryStatsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(friends.router)
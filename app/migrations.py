@@ -0,0 +1,747 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+def _rebuild_table(name: str, create_new: str, columns: str) -> list[str]:
+    # SQLite cannot change a column type in place: copy the rows into a new
+    # table, carry the AUTOINCREMENT counter over and swap the tables
+    return [
+        create_new,
+        f"INSERT INTO {name}_new ({columns}) SELECT {columns} FROM {name}",
+        f"DELETE FROM sqlite_sequence WHERE name = '{name}_new'",
+        f"UPDATE sqlite_sequence SET name = '{name}_new' WHERE name = '{name}'",
+        f"DROP TABLE {name}",
+        f"ALTER TABLE {name}_new RENAME TO {name}",
+    ]
+
+
+# Numbered schema migrations. The database records the last applied number in
+# PRAGMA user_version, so each migration runs exactly once per database file.
+# Never edit a migration that has shipped; append a new one instead.
+MIGRATIONS = [
+    (
+        1,
+        "initial schema",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS users(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                password TEXT NOT NULL,
+                role TEXT NOT NULL CHECK(role IN ('user', 'admin', 'guest')),
+                profile_image TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS friends(
+                user_id REFERENCES users(id) ON DELETE CASCADE,
+                friend_id REFERENCES users(id) ON DELETE CASCADE,
+                status TEXT DEFAULT 'PENDING',
+                PRIMARY KEY (user_id, friend_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS groups(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                owner_id REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS groups_users(
+                group_id REFERENCES groups(id) ON DELETE CASCADE,
+                user_id REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS posts(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                post_type TEXT NOT NULL CHECK(post_type IN ('text', 'picture')),
+                content TEXT NOT NULL,
+                visibility TEXT NOT NULL
+                    CHECK(visibility IN ('public', 'friends', 'group')),
+                group_id INTEGER REFERENCES groups(id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS likes(
+                user_id REFERENCES users(id) ON DELETE CASCADE,
+                post_id REFERENCES posts(id) ON DELETE CASCADE,
+                PRIMARY KEY (user_id, post_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS comments(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id REFERENCES users(id) ON DELETE CASCADE,
+                post_id REFERENCES posts(id) ON DELETE CASCADE,
+                content TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS tags(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS posts_tags(
+                post_id REFERENCES posts(id) ON DELETE CASCADE,
+                tags_id REFERENCES tags(id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS messages(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                receiver_id INTEGER NOT NULL
+                    REFERENCES users(id) ON DELETE CASCADE,
+                content TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stories(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uploader_id INTEGER NOT NULL
+                    REFERENCES users(id) ON DELETE CASCADE,
+                content TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                visibility TEXT NOT NULL
+                    CHECK(visibility IN ('public', 'friends', 'group')),
+                group_id INTEGER REFERENCES groups(id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stories_reaction(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                story_id INTEGER NOT NULL
+                    REFERENCES stories(id) ON DELETE CASCADE,
+                emoji TEXT CHECK(emoji IN ('😲', '❤️', '🔥', '😂', '👏'))
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "integer typed link columns",
+        # the link tables were declared without column types, so their
+        # columns have no affinity and foreign key lookups from the integer
+        # parent keys could not use an index
+        _rebuild_table(
+            "friends",
+            """
+            CREATE TABLE friends_new(
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                friend_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                status TEXT DEFAULT 'PENDING',
+                PRIMARY KEY (user_id, friend_id)
+            )
+            """,
+            "user_id, friend_id, status",
+        )
+        + _rebuild_table(
+            "groups",
+            """
+            CREATE TABLE groups_new(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+            "id, name, owner_id",
+        )
+        + _rebuild_table(
+            "groups_users",
+            """
+            CREATE TABLE groups_users_new(
+                group_id INTEGER REFERENCES groups(id) ON DELETE CASCADE,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+            "group_id, user_id",
+        )
+        + _rebuild_table(
+            "likes",
+            """
+            CREATE TABLE likes_new(
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+                PRIMARY KEY (user_id, post_id)
+            )
+            """,
+            "user_id, post_id",
+        )
+        + _rebuild_table(
+            "comments",
+            """
+            CREATE TABLE comments_new(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+                content TEXT NOT NULL
+            )
+            """,
+            "id, user_id, post_id, content",
+        )
+        + _rebuild_table(
+            "posts_tags",
+            """
+            CREATE TABLE posts_tags_new(
+                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+                tags_id INTEGER REFERENCES tags(id) ON DELETE CASCADE
+            )
+            """,
+            "post_id, tags_id",
+        ),
+    ),
+    (
+        3,
+        "hot path indexes",
+        [
+            # login, registration and admin checks
+            "CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)",
+            "CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)",
+            # reverse direction of the (user_id, friend_id) primary key
+            "CREATE INDEX IF NOT EXISTS idx_friends_friend ON friends(friend_id, user_id)",
+            # membership checks and member cleanup
+            "CREATE INDEX IF NOT EXISTS idx_groups_users_group "
+            "ON groups_users(group_id, user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_groups_users_user ON groups_users(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_groups_owner ON groups(owner_id)",
+            # tags of a post and tag lookup by text
+            "CREATE INDEX IF NOT EXISTS idx_posts_tags_post ON posts_tags(post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_posts_tags_tag ON posts_tags(tags_id)",
+            "CREATE INDEX IF NOT EXISTS idx_tags_content ON tags(content)",
+            "CREATE INDEX IF NOT EXISTS idx_posts_user ON posts(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_posts_group ON posts(group_id)",
+            # chat history between two users, already in timestamp order
+            "CREATE INDEX IF NOT EXISTS idx_messages_conversation "
+            "ON messages(sender_id, receiver_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id)",
+            # stories of the last 24 hours
+            "CREATE INDEX IF NOT EXISTS idx_stories_timestamp ON stories(timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_uploader ON stories(uploader_id)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_group ON stories(group_id)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_reaction_story "
+            "ON stories_reaction(story_id, emoji)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_reaction_user "
+            "ON stories_reaction(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_likes_post ON likes(post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_comments_post ON comments(post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(user_id)",
+        ],
+    ),
+    (
+        4,
+        "shard directory",
+        [
+            # home shard of each user; everything stored before sharding
+            # lives in this file, which is shard 0
+            "ALTER TABLE users ADD COLUMN shard INTEGER NOT NULL DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_users_shard ON users(shard)",
+            # per-shard id counters for rows addressed by id across shards
+            """
+            CREATE TABLE IF NOT EXISTS id_sequence(
+                name TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        5,
+        "token revocations",
+        [
+            # users whose tokens must be rejected without loading the user;
+            # rows outlive the user they name
+            """
+            CREATE TABLE IF NOT EXISTS revoked_users(
+                user_id INTEGER PRIMARY KEY,
+                revoked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ],
+    ),
+    (
+        6,
+        "canonical friendships",
+        [
+            # one row per pair of users, stored lower id first, so a pair is
+            # found with one primary key seek whichever side asks and a
+            # request in the opposite direction collides with the first;
+            # requester_id records who sent the request
+            """
+            CREATE TABLE friends_new(
+                user_low INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                user_high INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                requester_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending'
+                    CHECK(status IN ('pending', 'accepted')),
+                PRIMARY KEY (user_low, user_high),
+                CHECK(user_low < user_high),
+                CHECK(requester_id IN (user_low, user_high))
+            ) WITHOUT ROWID
+            """,
+            # both directions of a pair fold into one row, the accepted one
+            # if either was accepted
+            """
+            INSERT INTO friends_new (user_low, user_high, requester_id, status)
+            SELECT
+                MIN(user_id, friend_id),
+                MAX(user_id, friend_id),
+                user_id,
+                CASE WHEN LOWER(status) = 'accepted' THEN 'accepted' ELSE 'pending' END
+            FROM friends
+            WHERE user_id != friend_id
+            ORDER BY LOWER(status) = 'accepted' DESC
+            ON CONFLICT DO NOTHING
+            """,
+            "DROP TABLE friends",
+            "ALTER TABLE friends_new RENAME TO friends",
+            "CREATE INDEX IF NOT EXISTS idx_friends_high ON friends(user_high, user_low)",
+        ],
+    ),
+    (
+        7,
+        "friend list indexes",
+        [
+            # Secondary indexes of a WITHOUT ROWID table end in its primary
+            # key, so these are (side, status, other side): one covering
+            # range per side yields a user's accepted friends in id order,
+            # which is what the keyset-paginated friend list reads
+            "DROP INDEX IF EXISTS idx_friends_high",
+            "CREATE INDEX IF NOT EXISTS idx_friends_high ON friends(user_high, status)",
+            "CREATE INDEX IF NOT EXISTS idx_friends_low ON friends(user_low, status)",
+        ],
+    ),
+    (
+        8,
+        "friend suggestions",
+        [
+            # each user's top suggestions in rank order, so serving them is
+            # one primary key range
+            """
+            CREATE TABLE IF NOT EXISTS friend_suggestions(
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                rank INTEGER NOT NULL,
+                candidate_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                mutual_friends INTEGER NOT NULL,
+                shared_groups INTEGER NOT NULL,
+                PRIMARY KEY (user_id, rank)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_friend_suggestions_candidate "
+            "ON friend_suggestions(candidate_id)",
+            # users whose suggestions must be recomputed; a user marked again
+            # gets a new id, which AUTOINCREMENT never hands out twice
+            """
+            CREATE TABLE IF NOT EXISTS suggestion_queue(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+            # everyone with a friend or a group gets a first ranking
+            """
+            INSERT OR IGNORE INTO suggestion_queue (user_id)
+            SELECT user_low FROM friends WHERE status = 'accepted'
+            UNION SELECT user_high FROM friends WHERE status = 'accepted'
+            UNION SELECT user_id FROM groups_users
+            ORDER BY 1
+            """,
+        ],
+    ),
+    (
+        9,
+        "pending request indexes",
+        [
+            # Pending rows only, as (side, requester, other side). A request
+            # the user sent has requester_id = the user; one they received
+            # has requester_id = the other side, so on either side both
+            # lists are one index range already in the other user's id order
+            "CREATE INDEX IF NOT EXISTS idx_friends_pending_low "
+            "ON friends(user_low, requester_id) WHERE status = 'pending'",
+            "CREATE INDEX IF NOT EXISTS idx_friends_pending_high "
+            "ON friends(user_high, requester_id) WHERE status = 'pending'",
+        ],
+    ),
+    (
+        10,
+        "friendship change log",
+        [
+            # Every friendship accepted or ended, including by a cascade
+            # from a deleted user, in order. A graph snapshot records the
+            # last id it includes, so a worker that maps it replays only the
+            # rows after that. Rows outlive the users they name; they are
+            # trimmed once every running process has applied them (see
+            # migration 14) and when a snapshot is written. A rebuild of
+            # friends must recreate the triggers.
+            """
+            CREATE TABLE IF NOT EXISTS friend_changes(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_low INTEGER NOT NULL,
+                user_high INTEGER NOT NULL,
+                accepted INTEGER NOT NULL
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS friends_log_insert
+            AFTER INSERT ON friends WHEN new.status = 'accepted'
+            BEGIN
+                INSERT INTO friend_changes (user_low, user_high, accepted)
+                VALUES (new.user_low, new.user_high, 1);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS friends_log_accept
+            AFTER UPDATE OF status ON friends
+            WHEN new.status = 'accepted' AND old.status != 'accepted'
+            BEGIN
+                INSERT INTO friend_changes (user_low, user_high, accepted)
+                VALUES (new.user_low, new.user_high, 1);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS friends_log_delete
+            AFTER DELETE ON friends WHEN old.status = 'accepted'
+            BEGIN
+                INSERT INTO friend_changes (user_low, user_high, accepted)
+                VALUES (old.user_low, old.user_high, 0);
+            END
+            """,
+        ],
+    ),
+    (
+        11,
+        "home timelines",
+        [
+            # One row per post delivered to a user's feed, so a feed page is
+            # one primary key range in post id order. group_id is the post's
+            # group, which takes the rows along when the group is deleted;
+            # via_group marks the deliveries to its members, as opposed to
+            # the author's friends. Posts live on their author's shard, so
+            # post_id has no foreign key; deleting a post deletes its rows
+            # by (author_id, post_id).
+            """
+            CREATE TABLE IF NOT EXISTS timelines(
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                post_id INTEGER NOT NULL,
+                author_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                group_id INTEGER REFERENCES groups(id) ON DELETE CASCADE,
+                via_group INTEGER NOT NULL,
+                PRIMARY KEY (user_id, post_id)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_timelines_author "
+            "ON timelines(author_id, post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_timelines_group "
+            "ON timelines(group_id) WHERE group_id IS NOT NULL",
+            # Delivers the posts already in this file. The posts on the other
+            # shard files are delivered by shard migration 2.
+            """
+            INSERT OR IGNORE INTO timelines
+                (user_id, post_id, author_id, group_id, via_group)
+            SELECT user_id, id, user_id, group_id, visibility = 'group'
+            FROM posts
+            UNION ALL
+            SELECT f.user_high, p.id, p.user_id, p.group_id, 0
+            FROM posts p JOIN friends f ON f.user_low = p.user_id
+            WHERE p.visibility != 'group' AND f.status = 'accepted'
+            UNION ALL
+            SELECT f.user_low, p.id, p.user_id, p.group_id, 0
+            FROM posts p JOIN friends f ON f.user_high = p.user_id
+            WHERE p.visibility != 'group' AND f.status = 'accepted'
+            UNION ALL
+            SELECT m.user_id, p.id, p.user_id, p.group_id, 1
+            FROM posts p JOIN groups_users m ON m.group_id = p.group_id
+            WHERE p.visibility = 'group'
+            """,
+        ],
+    ),
+    (
+        12,
+        "pulled feed sources",
+        [
+            # Authors and groups whose posts outgrew fan-out on write (see
+            # fanout.PUSH_LIMIT). Their newer posts are in no reader's
+            # timeline; feeds read them from the posts when assembled.
+            """
+            CREATE TABLE IF NOT EXISTS pulled_authors(
+                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS pulled_groups(
+                group_id INTEGER PRIMARY KEY REFERENCES groups(id) ON DELETE CASCADE
+            )
+            """,
+        ],
+    ),
+    (
+        13,
+        "unique user names and group members",
+        [
+            # Both were only checked before inserting, a check concurrent
+            # requests can all pass. Repeated memberships are dropped; users
+            # sharing a name must be renamed by hand, or this fails.
+            """
+            DELETE FROM groups_users WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM groups_users GROUP BY group_id, user_id
+            )
+            """,
+            "DROP INDEX IF EXISTS idx_users_name",
+            "CREATE UNIQUE INDEX idx_users_name ON users(name)",
+            "DROP INDEX IF EXISTS idx_groups_users_group",
+            "CREATE UNIQUE INDEX idx_groups_users_group "
+            "ON groups_users(group_id, user_id)",
+        ],
+    ),
+    (
+        14,
+        "friend graph readers",
+        [
+            # The last friend_changes id each running process's friend graph
+            # has applied, reported every trim interval (see change_log). The
+            # log is trimmed up to the lowest mark; a process not heard from
+            # for a while is dropped and reloads its graph if it returns.
+            """
+            CREATE TABLE IF NOT EXISTS friend_graph_readers(
+                reader TEXT PRIMARY KEY,
+                mark INTEGER NOT NULL,
+                seen_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """,
+        ],
+    ),
+]
+
+# Schema of the shard files 1..N-1. They hold the user-owned tables with the
+# same columns as the directory, but users, groups and tags live in the
+# directory, so only references between rows of the same file are enforced.
+# Versioned separately from MIGRATIONS, in the same PRAGMA user_version.
+SHARD_MIGRATIONS = [
+    (
+        1,
+        "shard schema",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS posts(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                post_type TEXT NOT NULL CHECK(post_type IN ('text', 'picture')),
+                content TEXT NOT NULL,
+                visibility TEXT NOT NULL
+                    CHECK(visibility IN ('public', 'friends', 'group')),
+                group_id INTEGER
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS likes(
+                user_id INTEGER,
+                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+                PRIMARY KEY (user_id, post_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS comments(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+                content TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS posts_tags(
+                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+                tags_id INTEGER
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS messages(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER NOT NULL,
+                receiver_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stories(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uploader_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                visibility TEXT NOT NULL
+                    CHECK(visibility IN ('public', 'friends', 'group')),
+                group_id INTEGER
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stories_reaction(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                story_id INTEGER NOT NULL
+                    REFERENCES stories(id) ON DELETE CASCADE,
+                emoji TEXT CHECK(emoji IN ('😲', '❤️', '🔥', '😂', '👏'))
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS id_sequence(
+                name TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_posts_tags_post ON posts_tags(post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_posts_user ON posts(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_posts_group ON posts(group_id)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_conversation "
+            "ON messages(sender_id, receiver_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_timestamp ON stories(timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_uploader ON stories(uploader_id)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_group ON stories(group_id)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_reaction_story "
+            "ON stories_reaction(story_id, emoji)",
+            "CREATE INDEX IF NOT EXISTS idx_stories_reaction_user "
+            "ON stories_reaction(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_likes_post ON likes(post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_comments_post ON comments(post_id)",
+            "CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(user_id)",
+        ],
+    ),
+    (
+        2,
+        "home timelines",
+        [
+            # Delivers the posts already on this shard to the timelines in
+            # the directory, which migrate_shards attaches, as directory
+            # migration 11 does for the directory's own posts. Posts of
+            # pulled authors and groups stay with their authors; feeds read
+            # them when assembled.
+            """
+            INSERT OR IGNORE INTO directory.timelines
+                (user_id, post_id, author_id, group_id, via_group)
+            SELECT user_id, id, user_id, group_id, visibility = 'group'
+            FROM main.posts
+            UNION ALL
+            SELECT f.user_high, p.id, p.user_id, p.group_id, 0
+            FROM main.posts p JOIN directory.friends f ON f.user_low = p.user_id
+            WHERE p.visibility != 'group' AND f.status = 'accepted'
+              AND p.user_id NOT IN (SELECT user_id FROM directory.pulled_authors)
+            UNION ALL
+            SELECT f.user_low, p.id, p.user_id, p.group_id, 0
+            FROM main.posts p JOIN directory.friends f ON f.user_high = p.user_id
+            WHERE p.visibility != 'group' AND f.status = 'accepted'
+              AND p.user_id NOT IN (SELECT user_id FROM directory.pulled_authors)
+            UNION ALL
+            SELECT m.user_id, p.id, p.user_id, p.group_id, 1
+            FROM main.posts p
+            JOIN directory.groups_users m ON m.group_id = p.group_id
+            WHERE p.visibility = 'group'
+              AND p.group_id NOT IN (SELECT group_id FROM directory.pulled_groups)
+            """,
+        ],
+    ),
+]
+
+# tables whose ids are global across shards, see raise_id_floors
+SHARDED_ID_TABLES = ("posts", "stories")
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, migrations: list = MIGRATIONS) -> int:
+    current = get_schema_version(conn)
+    if current >= migrations[-1][0]:
+        return current
+
+    # table rebuilds must not fire ON DELETE CASCADE, so foreign keys are
+    # switched off while migrating and verified before every commit
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, _description, statements in migrations:
+            if version <= current:
+                continue
+
+            # each migration is applied atomically together with its version
+            # bump; the version is re-read under the write lock in case
+            # another worker migrated the same file in the meantime
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = get_schema_version(conn)
+                if version <= current:
+                    conn.rollback()
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                if conn.execute("PRAGMA foreign_key_check").fetchone():
+                    raise sqlite3.IntegrityError(
+                        f"Migration {version} left foreign key violations"
+                    )
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            current = version
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+
+    return current
+
+
+def raise_id_floors(connections: list) -> None:
+    # With N shards, shard k hands out the ids seq * N + k from its own
+    # id_sequence row, so ids never collide without any cross-shard lock.
+    # Every counter starts above the largest id in any shard, which keeps
+    # ids unique when a single database is split or the shard count changes.
+    shards = len(connections)
+    for table in SHARDED_ID_TABLES:
+        highest = max(
+            conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM main.{table}").fetchone()[0]
+            for conn in connections
+        )
+        for conn in connections:
+            conn.execute(
+                """
+                INSERT INTO main.id_sequence (name, seq) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET seq = MAX(seq, excluded.seq)
+                """,
+                (table, highest // shards + 1),
+            )
+            conn.commit()
+
+
+@contextmanager
+def _directory_attached(conn: sqlite3.Connection, directory: sqlite3.Connection):
+    # the app's shard connections attach the directory already; others, such
+    # as the sharding tool's, get it for the duration of the migration
+    if any(row[1] == "directory" for row in conn.execute("PRAGMA database_list")):
+        yield
+        return
+
+    path = next(
+        row[2] for row in directory.execute("PRAGMA database_list") if row[1] == "main"
+    )
+    conn.execute("ATTACH DATABASE ? AS directory", (path,))
+    try:
+        yield
+    finally:
+        conn.execute("DETACH DATABASE directory")
+
+
+def migrate_shards(connections: list) -> int:
+    # connections[0] is the directory database, the rest are shard files;
+    # the directory is migrated first, since shard migrations write to it
+    version = migrate(connections[0])
+    for conn in connections[1:]:
+        with _directory_attached(conn, connections[0]):
+            migrate(conn, SHARD_MIGRATIONS)
+    if len(connections) > 1:
+        raise_id_floors(connections)
+    return version
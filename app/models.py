@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Optional
 from pydantic import BaseModel
 
 
@@ -23,6 +24,11 @@ class FriendRequestAction(Enum):
     DECLINE = "decline"
 
 
+class FriendRequestDirection(Enum):
+    INCOMING = "incoming"
+    OUTGOING = "outgoing"
+
+
 class ReactionType(str, Enum):
     WOW = "😲"
     LOVE = "❤️"
@@ -35,3 +41,17 @@ class UserRegister(BaseModel):
     name: str
     password: str
     role: Role
+
+
+# one line of a bulk import: a plaintext password, or a hash in the format
+# passwords.hash_password writes
+class UserImport(BaseModel):
+    name: str
+    password: Optional[str] = None
+    password_hash: Optional[str] = None
+    role: Role = Role.USER
+
+
+class FriendRequestDecision(BaseModel):
+    sender_id: int
+    action: FriendRequestAction
@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# scrypt work factor as log2(N): every step doubles CPU time and memory
+# (N * r * 128 bytes, 16 MiB at the default 14 with r = 8)
+COST = int(os.environ.get("SOCIAL_MEDIA_PASSWORD_COST", "14"))
+# worker processes hashing passwords; 0 hashes on a thread of this process
+WORKERS = int(
+    os.environ.get("SOCIAL_MEDIA_PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+# hashes allowed to wait for a worker before new ones are refused
+QUEUE = int(os.environ.get("SOCIAL_MEDIA_PASSWORD_QUEUE", str(max(WORKERS, 1) * 4)))
+
+# passwords per pool task when hashing in bulk; a login queued behind a bulk
+# job waits for at most one chunk per worker
+BULK_CHUNK = 16
+
+SCHEME = "scrypt"
+BLOCK_SIZE = 8
+PARALLELISM = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, cost: int, r: int, p: int) -> bytes:
+    n = 1 << cost
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=2 * 128 * n * r * p,
+        dklen=KEY_BYTES,
+    )
+
+
+def hash_password(password: str, cost: int = COST) -> str:
+    # scrypt$<cost>$<r>$<p>$<salt>$<key>, so parameters can change later
+    # without breaking stored hashes
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, cost, BLOCK_SIZE, PARALLELISM)
+    return (
+        f"{SCHEME}${cost}${BLOCK_SIZE}${PARALLELISM}$"
+        f"{_b64encode(salt)}${_b64encode(key)}"
+    )
+
+
+def hash_passwords(passwords: list[str], cost: int = COST) -> list[str]:
+    return [hash_password(password, cost) for password in passwords]
+
+
+def _parse(stored: str) -> Optional[tuple]:
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        return (
+            int(parts[1]),
+            int(parts[2]),
+            int(parts[3]),
+            _b64decode(parts[4]),
+            _b64decode(parts[5]),
+        )
+    except ValueError:
+        return None
+
+
+def is_hashed(stored: str) -> bool:
+    return _parse(stored) is not None
+
+
+def verify_password(password: str, stored: str) -> bool:
+    parsed = _parse(stored)
+    if parsed is None:
+        # rows written before hashing hold the plaintext
+        return hmac.compare_digest(password.encode(), stored.encode())
+
+    cost, r, p, salt, key = parsed
+    return hmac.compare_digest(_scrypt(password, salt, cost, r, p), key)
+
+
+class PasswordHasher:
+    # Runs hash_password / verify_password off the event loop on a bounded
+    # process pool, so slow hashing never stalls request handling. At most
+    # workers + queue calls are in flight; beyond that calls fail at once
+    # with PasswordHasherBusy instead of piling up behind the pool.
+    def __init__(self, cost: int = COST, workers: int = WORKERS, queue: int = QUEUE):
+        if workers < 0 or queue < 0:
+            raise ValueError("workers and queue must not be negative")
+
+        self.cost = cost
+        self.workers = workers
+        self.limit = max(workers, 1) + queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._pool = None
+        self._dummy: Optional[str] = None
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers == 0:
+            return None
+        if self._pool is None:
+            # spawned, not forked: the server process runs database threads
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise PasswordHasherBusy("Password hashing is saturated")
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.cost)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        # Bulk jobs hash in small chunks, one per worker at a time, and wait
+        # out saturation instead of failing: a slow import is fine, a
+        # refused one is not.
+        chunks = [
+            passwords[i : i + BULK_CHUNK] for i in range(0, len(passwords), BULK_CHUNK)
+        ]
+        hashed = [None] * len(chunks)
+        pending = iter(range(len(chunks)))
+
+        async def work():
+            for index in pending:
+                while True:
+                    try:
+                        hashed[index] = await self._run(
+                            hash_passwords, chunks[index], self.cost
+                        )
+                        break
+                    except PasswordHasherBusy:
+                        await asyncio.sleep(0.05)
+
+        await asyncio.gather(*(work() for _ in range(max(self.workers, 1))))
+        return [stored for chunk in hashed for stored in chunk]
+
+    async def verify(self, password: str, stored: str) -> bool:
+        if not is_hashed(stored):
+            return verify_password(password, stored)
+        return await self._run(verify_password, password, stored)
+
+    async def dummy_hash(self) -> str:
+        # A hash of a random password at the current cost, made once. Logins
+        # for unknown names verify against it, so they take as long as
+        # logins with a wrong password and do not reveal which names exist.
+        if self._dummy is None:
+            self._dummy = await self.hash(os.urandom(SALT_BYTES).hex())
+        return self._dummy
+
+    def needs_rehash(self, stored: str) -> bool:
+        parsed = _parse(stored)
+        return parsed is None or parsed[:3] != (self.cost, BLOCK_SIZE, PARALLELISM)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,175 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from utils import get_current_user
+
+# "0" turns every limit off, e.g. for benchmarks that replay one user's load
+ENABLED = os.environ.get("SOCIAL_MEDIA_RATE_LIMIT", "1") not in ("", "0")
+# buckets kept per limiter; past this the least recently used one is dropped
+MAX_KEYS = int(os.environ.get("SOCIAL_MEDIA_RATE_LIMIT_MAX_KEYS", "500000"))
+SHARDS = 16
+
+# route: (per user, per client IP), as "requests/seconds"; each can be
+# overridden with SOCIAL_MEDIA_RATE_LIMIT_<ROUTE>_USER / _IP, "0" for none
+DEFAULT_LIMITS = {
+    "login": ("10/60", "30/60"),
+    "send_message": ("60/60", "300/60"),
+    "send_friend_request": ("20/60", "100/60"),
+}
+
+
+def parse_limit(spec: str) -> Optional[tuple[int, float]]:
+    if spec.strip() in ("", "0"):
+        return None
+    count, _, seconds = spec.partition("/")
+    count, seconds = int(count), float(seconds or 1)
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return count, seconds
+
+
+class RateLimiter:
+    # Token buckets of `count` tokens refilled at count/seconds per second,
+    # one per key. A bucket is stored as a single float, the time at which
+    # it will be full again, so refilling is lazy: it is worked out from the
+    # clock when the key is next seen. A bucket whose full time has passed
+    # holds nothing a fresh bucket would not, and is dropped whenever it is
+    # found at the old end of its shard.
+    #
+    # Keys are spread over shards, each an LRU dict behind its own lock, so
+    # callers on different threads rarely meet. At most max_keys buckets are
+    # kept; when a shard is full its least recently used bucket is dropped
+    # even if not yet full, which lets that key start over.
+    def __init__(
+        self,
+        count: int,
+        seconds: float,
+        max_keys: int = MAX_KEYS,
+        shards: int = SHARDS,
+        clock=time.monotonic,
+    ):
+        self.count = count
+        self.interval = seconds / count
+        self.capacity = count * self.interval
+        self.shard_size = max(1, max_keys // shards)
+        self._clock = clock
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self.rejected = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets in self._shards)
+
+    def wait(self, key) -> float:
+        # the seconds until the key has a token, 0 if it has one now; takes
+        # nothing
+        index = hash(key) % len(self._shards)
+        with self._locks[index]:
+            now = self._clock()
+            full_at = max(self._shards[index].get(key, now), now)
+            return max(full_at + self.interval - now - self.capacity, 0.0)
+
+    def acquire(self, key) -> float:
+        # takes a token; returns 0 when one was available, otherwise the
+        # seconds until one will be
+        index = hash(key) % len(self._shards)
+        buckets = self._shards[index]
+        with self._locks[index]:
+            now = self._clock()
+            full_at = max(buckets.pop(key, now), now)
+            wait = full_at + self.interval - now - self.capacity
+            if wait > 0:
+                buckets[key] = full_at
+                self.rejected += 1
+                return wait
+
+            buckets[key] = full_at + self.interval
+            self._sweep(buckets, now)
+            return 0.0
+
+    def _sweep(self, buckets: OrderedDict, now: float) -> None:
+        # the key just used went to the young end; look at the old end
+        while len(buckets) > 1:
+            key, full_at = next(iter(buckets.items()))
+            if full_at <= now:
+                del buckets[key]
+            elif len(buckets) > self.shard_size:
+                del buckets[key]
+                self.evictions += 1
+            else:
+                return
+
+    def clear(self) -> None:
+        for buckets, lock in zip(self._shards, self._locks):
+            with lock:
+                buckets.clear()
+
+
+def _limiter(route: str, scope: str, default: str) -> Optional[RateLimiter]:
+    spec = os.environ.get(f"SOCIAL_MEDIA_RATE_LIMIT_{route.upper()}_{scope}", default)
+    limit = parse_limit(spec)
+    return RateLimiter(*limit) if ENABLED and limit is not None else None
+
+
+limiters = {
+    route: {
+        "user": _limiter(route, "USER", user_spec),
+        "ip": _limiter(route, "IP", ip_spec),
+    }
+    for route, (user_spec, ip_spec) in DEFAULT_LIMITS.items()
+}
+
+
+def reset() -> None:
+    for route_limiters in limiters.values():
+        for limiter in route_limiters.values():
+            if limiter is not None:
+                limiter.clear()
+
+
+def check(route: str, request: Request, user_key) -> None:
+    # A request takes a token from the client's IP bucket and the user's,
+    # or from neither: both are looked at before either is charged, so a
+    # request one bucket refuses costs nothing from the other. Called on the
+    # event loop, so no other request is checked in between.
+    keys = {"ip": request.client.host if request.client else None, "user": user_key}
+    buckets = [
+        (limiters[route][scope], key)
+        for scope, key in keys.items()
+        if limiters[route][scope] is not None and key is not None
+    ]
+    waits = [limiter.wait(key) for limiter, key in buckets]
+    if max(waits, default=0) > 0:
+        for (limiter, _), wait in zip(buckets, waits):
+            if wait > 0:
+                limiter.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, slow down",
+            headers={"Retry-After": str(math.ceil(max(waits)))},
+        )
+    for limiter, key in buckets:
+        limiter.acquire(key)
+
+
+def limit_user(route: str):
+    # dependency for authenticated routes: per caller and per client IP
+    async def dependency(request: Request, current_user=Depends(get_current_user)):
+        check(route, request, current_user["id"])
+
+    return dependency
+
+
+async def limit_login(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+):
+    # per client IP and attempted username: guessing one account's password
+    # is slow, yet other addresses cannot lock the account's owner out
+    client = request.client.host if request.client else None
+    check("login", request, (client, form_data.username))
@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+from typing import Optional
+
+# Compact row types for the large list responses. Each record has __slots__
+# (no per-row __dict__), is built straight from a cursor row with from_row,
+# and is serialized by responses.FastJSONResponse without going through an
+# intermediate dict. Field order is the column order of the query and the
+# key order of the JSON object.
+
+
+class Record:
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple):
+        return cls(*row)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+@dataclass
+class Friend(Record):
+    __slots__ = ("id", "name")
+    id: int
+    name: str
+
+
+@dataclass
+class Suggestion(Record):
+    __slots__ = ("id", "name", "mutual_friends", "shared_groups")
+    id: int
+    name: str
+    mutual_friends: int
+    shared_groups: int
+
+
+@dataclass
+class FeedPost(Record):
+    __slots__ = ("id", "user_id", "post_type", "content", "visibility", "group_id")
+    id: int
+    user_id: int
+    post_type: str
+    content: str
+    visibility: str
+    group_id: Optional[int]
+
+
+@dataclass
+class ChatMessage(Record):
+    __slots__ = ("content", "timestamp", "sender_name")
+    content: str
+    timestamp: str
+    sender_name: str
+
+
+@dataclass
+class ReactionCount(Record):
+    __slots__ = ("emoji", "count")
+    emoji: str
+    count: int
+
+
+@dataclass
+class Story(Record):
+    __slots__ = (
+        "id",
+        "content",
+        "timestamp",
+        "visibility",
+        "uploader_id",
+        "uploader_name",
+        "profile_image",
+        "reactions",
+    )
+    id: int
+    content: str
+    timestamp: str
+    visibility: str
+    uploader_id: int
+    uploader_name: str
+    profile_image: Optional[str]
+    reactions: list
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple):
+        return cls(*row, [])
@@ -0,0 +1,63 @@
+import os
+from contextlib import asynccontextmanager
+from fastapi import Depends
+import database
+from database import AsyncSession, get_db
+from repositories.base import (
+    ConflictError,
+    FriendRepository,
+    GroupRepository,
+    MessageRepository,
+    PostRepository,
+    ReactionRepository,
+    Repositories,
+    StorageError,
+    StoryRepository,
+    SuggestionRepository,
+    TagRepository,
+    UserRepository,
+)
+from repositories.memory import MemoryRepositories, MemoryStore
+from repositories.sqlite import SqliteRepositories
+
+BACKENDS = ("sqlite", "memory")
+
+BACKEND = os.environ.get("SOCIAL_MEDIA_STORAGE", "sqlite")
+store = MemoryStore()
+
+
+def configure(backend: str = BACKEND) -> None:
+    global BACKEND, store
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported storage backend: {backend}")
+    BACKEND = backend
+    store = MemoryStore()
+
+
+def get_repositories(
+    db: AsyncSession = Depends(get_db, scope="function"),
+) -> Repositories:
+    # the sqlite session is only opened on first use, so the memory backend
+    # never touches the database
+    if BACKEND == "memory":
+        return MemoryRepositories(store)
+    return SqliteRepositories(db)
+
+
+@asynccontextmanager
+async def open_repositories():
+    # A unit of work outside any request's session, for bulk jobs that
+    # commit in batches: committed when the block exits, rolled back on an
+    # error. Its statements are not counted into the request's QueryStats.
+    if BACKEND == "memory":
+        yield MemoryRepositories(store)
+        return
+
+    session = AsyncSession(database.executor, shard_executors=database.executors[1:])
+    try:
+        yield SqliteRepositories(session)
+    except BaseException:
+        await session.close(commit=False)
+        raise
+    await session.close(commit=True)
@@ -0,0 +1,293 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+from records import ChatMessage, FeedPost, Friend, ReactionCount, Story, Suggestion
+
+
+class StorageError(Exception):
+    pass
+
+
+# a write refused because another row holds the same unique key, such as a
+# user name
+class ConflictError(StorageError):
+    pass
+
+
+class UserRepository(ABC):
+    @abstractmethod
+    async def get(self, user_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def get_by_name(self, name: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def exists(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def admin_exists(self) -> bool: ...
+
+    # Holds off other writers of users until the unit of work ends, so what
+    # is read after it, such as admin_exists, stays true until the commit
+    @abstractmethod
+    async def lock(self) -> None: ...
+
+    # raises ConflictError when the name is taken
+    @abstractmethod
+    async def create(
+        self, name: str, password: str, role: str, profile_image: Optional[str] = None
+    ) -> int: ...
+
+    # the subset of names that already belong to a user
+    @abstractmethod
+    async def existing_names(self, names: list[str]) -> set[str]: ...
+
+    # (name, password, role) rows inserted together, except those whose
+    # name is taken; returns the names inserted
+    @abstractmethod
+    async def create_many(self, users: list[tuple[str, str, str]]) -> set[str]: ...
+
+    # password holds the stored hash, see passwords.PasswordHasher
+    @abstractmethod
+    async def set_password(self, user_id: int, password: str) -> bool: ...
+
+    # (id, name) of those of the users that exist, in the order given
+    @abstractmethod
+    async def summaries(self, user_ids: list[int]) -> list[Friend]: ...
+
+    @abstractmethod
+    async def delete_by_name(self, name: str) -> int: ...
+
+    # ids whose tokens are no longer accepted; deleted users are revoked
+    @abstractmethod
+    async def revoked_ids(self) -> set[int]: ...
+
+    # how many ids have been revoked; ids are never un-revoked, so a changed
+    # count means new revocations
+    @abstractmethod
+    async def revoked_count(self) -> int: ...
+
+
+def friend_pair(user_id: int, other_id: int) -> tuple[int, int]:
+    # the key a friendship is stored under, whichever side sent the request
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+class FriendRepository(ABC):
+    # One friendship per pair of users, keyed by friend_pair and remembering
+    # who sent the request. Only the requester's pair can be accepted or
+    # declined, and a request back the other way is refused like a repeat.
+
+    @abstractmethod
+    async def send_request(self, sender_id: int, receiver_id: int) -> bool: ...
+
+    @abstractmethod
+    async def accept(self, sender_id: int, receiver_id: int) -> bool: ...
+
+    @abstractmethod
+    async def decline(self, sender_id: int, receiver_id: int) -> bool: ...
+
+    # (sender_id, accept) decisions on requests sent to receiver_id, applied
+    # together; per decision, whether a pending request from that sender
+    # was found. A sender named twice is only answered the first time.
+    @abstractmethod
+    async def respond_many(
+        self, receiver_id: int, decisions: list[tuple[int, bool]]
+    ) -> list[bool]: ...
+
+    # the other users of the user's pending requests, received (incoming)
+    # or sent, in id order, like list_friends
+    @abstractmethod
+    async def list_pending(
+        self,
+        user_id: int,
+        incoming: bool,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> list[Friend]: ...
+
+    @abstractmethod
+    async def are_friends(self, user_id: int, other_id: int) -> bool: ...
+
+    # accepted friends in id order: those after the id `after`, whose name
+    # starts with `prefix`, at most `limit` of them
+    @abstractmethod
+    async def list_friends(
+        self,
+        user_id: int,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> list[Friend]: ...
+
+    @abstractmethod
+    async def count(self, user_id: int) -> int: ...
+
+    @abstractmethod
+    async def friend_ids(self, user_id: int) -> frozenset: ...
+
+    # the friends the two have in common, in id order
+    @abstractmethod
+    async def mutual_ids(self, user_id: int, other_id: int) -> list[int]: ...
+
+    # a shortest chain of friends from user_id to other_id, both ends
+    # included; None when they are more than max_depth friendships apart
+    @abstractmethod
+    async def connection_path(
+        self, user_id: int, other_id: int, max_depth: int
+    ) -> Optional[list[int]]: ...
+
+    # the other side of each pending request, sent or received, per user
+    @abstractmethod
+    async def pending_ids(self, user_ids: list[int]) -> dict[int, set[int]]: ...
+
+    # Reports, as `reader`, how far this process's friend graph has applied
+    # the friendship change log, forgets readers last seen before `expired`
+    # and trims the log up to the lowest mark left; returns the changes
+    # trimmed. Nothing to do without a log.
+    @abstractmethod
+    async def trim_changes(self, reader: str, now: float, expired: float) -> int: ...
+
+    # accept and remove mark both users and all their friends stale in the
+    # suggestion queue, see SuggestionRepository
+    @abstractmethod
+    async def remove(self, user_id: int, friend_id: int) -> bool: ...
+
+
+class GroupRepository(ABC):
+    @abstractmethod
+    async def create(self, name: str, owner_id: int, member_ids: list[int]) -> int: ...
+
+    @abstractmethod
+    async def get_owner(self, group_id: int) -> Optional[int]: ...
+
+    @abstractmethod
+    async def delete(self, group_id: int) -> None: ...
+
+    @abstractmethod
+    async def is_member(self, group_id: int, user_id: int) -> bool: ...
+
+    # False when the user already is a member
+    @abstractmethod
+    async def add_member(self, group_id: int, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def remove_member(self, group_id: int, user_id: int) -> bool: ...
+
+    # per user, the other members of their groups and how many groups each
+    # shares with them
+    @abstractmethod
+    async def shared_counts(self, user_ids: list[int]) -> dict[int, dict[int, int]]: ...
+
+
+class PostRepository(ABC):
+    @abstractmethod
+    async def create(
+        self,
+        user_id: int,
+        post_type: str,
+        content: str,
+        visibility: str,
+        group_id: Optional[int],
+        tags: list[str] = (),
+    ) -> int: ...
+
+    @abstractmethod
+    async def get(self, post_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def update(
+        self,
+        post_id: int,
+        content: Optional[str] = None,
+        visibility: Optional[str] = None,
+    ) -> None: ...
+
+    @abstractmethod
+    async def delete(self, post_id: int) -> None: ...
+
+    # The posts delivered to the user's timeline, newest first, below the
+    # post id `before`. A post is delivered when it is created: to its
+    # author, and to the author's friends, or for group posts to the
+    # group's members. Ending a friendship or leaving a group takes the
+    # posts delivered through it back.
+    @abstractmethod
+    async def feed(
+        self, user_id: int, before: Optional[int] = None, limit: Optional[int] = None
+    ) -> list[FeedPost]: ...
+
+
+class TagRepository(ABC):
+    @abstractmethod
+    async def for_post(self, post_id: int) -> list[str]: ...
+
+
+class MessageRepository(ABC):
+    @abstractmethod
+    async def send(self, sender_id: int, receiver_id: int, content: str) -> None: ...
+
+    @abstractmethod
+    async def conversation(self, user_id: int, other_id: int) -> list[ChatMessage]: ...
+
+
+class StoryRepository(ABC):
+    @abstractmethod
+    async def create(
+        self,
+        uploader_id: int,
+        content: str,
+        visibility: str,
+        group_id: Optional[int],
+    ) -> int: ...
+
+    @abstractmethod
+    async def get_uploader(self, story_id: int) -> Optional[int]: ...
+
+    @abstractmethod
+    async def delete(self, story_id: int) -> None: ...
+
+    @abstractmethod
+    async def visible_to(self, viewer_id: Optional[int]) -> list[Story]: ...
+
+
+class ReactionRepository(ABC):
+    @abstractmethod
+    async def add(self, user_id: int, story_id: int, emoji: str) -> None: ...
+
+    @abstractmethod
+    async def counts(self, story_ids: list[int]) -> dict[int, list[ReactionCount]]: ...
+
+
+class SuggestionRepository(ABC):
+    # Precomputed friend suggestions, ranked from 1, and the queue of users
+    # whose suggestions are stale. Marking a queued user again moves them to
+    # the back of the queue.
+    @abstractmethod
+    async def mark_stale(self, user_ids: list[int]) -> None: ...
+
+    # Takes the oldest queued users off the queue and returns their ids.
+    # The claim is part of the caller's write transaction: no other
+    # transaction can claim the same users, a rollback puts them back, and
+    # a user marked by another transaction is queued again behind it.
+    @abstractmethod
+    async def claim(self, limit: int) -> list[int]: ...
+
+    # user_id -> [(candidate_id, mutual_friends, shared_groups)] best first
+    @abstractmethod
+    async def replace(self, ranked: dict[int, list[tuple[int, int, int]]]) -> None: ...
+
+    # the stored ranking, without candidates who have become friends since
+    @abstractmethod
+    async def for_user(self, user_id: int) -> list[Suggestion]: ...
+
+
+class Repositories:
+    # everything a request needs from storage, bound to that request
+    users: UserRepository
+    friends: FriendRepository
+    groups: GroupRepository
+    posts: PostRepository
+    tags: TagRepository
+    messages: MessageRepository
+    stories: StoryRepository
+    reactions: ReactionRepository
+    suggestions: SuggestionRepository
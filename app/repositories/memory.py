@@ -0,0 +1,801 @@
+import itertools
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import fanout
+from friend_graph import shortest_path
+from records import ChatMessage, FeedPost, Friend, ReactionCount, Story, Suggestion
+from revocation import revocations
+from repositories.base import (
+    ConflictError,
+    FriendRepository,
+    GroupRepository,
+    MessageRepository,
+    PostRepository,
+    ReactionRepository,
+    Repositories,
+    StorageError,
+    StoryRepository,
+    SuggestionRepository,
+    TagRepository,
+    UserRepository,
+    friend_pair,
+)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _timestamp(moment: Optional[datetime] = None) -> str:
+    # same text format as SQLite's CURRENT_TIMESTAMP, so values compare and
+    # serialize exactly like the sqlite backend's
+    return (moment or datetime.now(timezone.utc)).strftime(TIMESTAMP_FORMAT)
+
+
+class MemoryStore:
+    # Tables are dicts keyed by id, next to the secondary indexes the
+    # repositories look rows up by. Every repository method runs without
+    # awaiting, so on the event loop each call is atomic; foreign keys are
+    # checked on insert and ON DELETE CASCADE is applied by the delete_*
+    # helpers. Nothing is persisted.
+
+    def __init__(self):
+        self._ids = defaultdict(lambda: itertools.count(1))
+
+        self.users = {}
+        self.users_by_name = defaultdict(set)
+        self.admins = set()
+        self.revoked = set()
+
+        # friend_pair -> (requester_id, status), plus the other end of every
+        # pair per user
+        self.friends = {}
+        self.friend_links = defaultdict(set)
+
+        self.groups = {}
+        self.groups_by_owner = defaultdict(set)
+        self.group_members = defaultdict(set)
+        self.user_groups = defaultdict(set)
+
+        self.posts = {}
+        self.posts_by_user = defaultdict(set)
+        self.posts_by_group = defaultdict(set)
+        # user_id -> {post_id: via_group} of the posts delivered to the
+        # user's feed, and post_id -> the users it was delivered to
+        self.timelines = defaultdict(dict)
+        self.post_readers = defaultdict(set)
+        # authors and groups whose posts feeds pull rather than get pushed
+        self.pulled_authors = set()
+        self.pulled_groups = set()
+
+        self.tags = {}
+        self.tags_by_content = {}
+        self.post_tags = defaultdict(list)
+
+        self.messages = {}
+        self.conversations = defaultdict(list)
+        self.conversation_peers = defaultdict(set)
+
+        # ids grow with time, so insertion order is also timestamp order
+        self.stories = {}
+        self.stories_by_uploader = defaultdict(set)
+        self.stories_by_group = defaultdict(set)
+
+        self.reactions = {}
+        self.reactions_by_story = defaultdict(set)
+        self.reactions_by_user = defaultdict(set)
+
+        # user_id -> ranked (candidate_id, mutual_friends, shared_groups),
+        # and user_id -> mark of the users queued for a refresh, oldest first
+        self.suggestions = {}
+        self.stale = {}
+
+    def next_id(self, table: str) -> int:
+        return next(self._ids[table])
+
+    def require(self, table: dict, key: Optional[int]) -> None:
+        if key is not None and key not in table:
+            raise StorageError("FOREIGN KEY constraint failed")
+
+    def mark_stale(self, user_ids) -> None:
+        for user_id in sorted(user_ids):
+            self.stale.pop(user_id, None)
+            self.stale[user_id] = self.next_id("suggestion_queue")
+
+    def deliver(self, post: dict, reader_ids, via_group: bool) -> None:
+        for reader_id in reader_ids:
+            self.timelines[reader_id][post["id"]] = via_group
+        self.post_readers[post["id"]].update(reader_ids)
+
+    def undeliver(self, post_id: int, reader_ids) -> None:
+        readers = self.post_readers.get(post_id)
+        for reader_id in list(reader_ids):
+            timeline = self.timelines.get(reader_id)
+            if timeline is not None:
+                timeline.pop(post_id, None)
+            if readers is not None:
+                readers.discard(reader_id)
+
+    def undeliver_from(self, reader_id: int, matches) -> None:
+        # the posts in the reader's feed for which matches(post, via_group)
+        timeline = self.timelines.get(reader_id, {})
+        for post_id in [
+            post_id
+            for post_id, via_group in timeline.items()
+            if matches(self.posts[post_id], via_group)
+        ]:
+            self.undeliver(post_id, [reader_id])
+
+    def delete_user(self, user_id: int) -> None:
+        user = self.users.pop(user_id)
+        namesakes = self.users_by_name[user["name"]]
+        namesakes.discard(user_id)
+        if not namesakes:
+            del self.users_by_name[user["name"]]
+        self.admins.discard(user_id)
+        self.pulled_authors.discard(user_id)
+        self.suggestions.pop(user_id, None)
+        self.stale.pop(user_id, None)
+
+        for other_id in self.friend_links.pop(user_id, set()):
+            self.friends.pop(friend_pair(user_id, other_id), None)
+            self.friend_links[other_id].discard(user_id)
+
+        for group_id in list(self.groups_by_owner.pop(user_id, ())):
+            self.delete_group(group_id)
+        for group_id in self.user_groups.pop(user_id, set()):
+            self.group_members[group_id].discard(user_id)
+
+        for post_id in list(self.posts_by_user.pop(user_id, ())):
+            self.delete_post(post_id)
+        for post_id in self.timelines.pop(user_id, {}):
+            self.post_readers[post_id].discard(user_id)
+
+        for other_id in self.conversation_peers.pop(user_id, set()):
+            for key in ((user_id, other_id), (other_id, user_id)):
+                for message_id in self.conversations.pop(key, ()):
+                    self.messages.pop(message_id, None)
+            self.conversation_peers[other_id].discard(user_id)
+
+        for story_id in list(self.stories_by_uploader.pop(user_id, ())):
+            self.delete_story(story_id)
+        for reaction_id in self.reactions_by_user.pop(user_id, set()):
+            reaction = self.reactions.pop(reaction_id)
+            self.reactions_by_story[reaction["story_id"]].discard(reaction_id)
+
+    def delete_group(self, group_id: int) -> None:
+        group = self.groups.pop(group_id)
+        self.groups_by_owner[group["owner_id"]].discard(group_id)
+        self.pulled_groups.discard(group_id)
+        for user_id in self.group_members.pop(group_id, set()):
+            self.user_groups[user_id].discard(group_id)
+        for post_id in list(self.posts_by_group.pop(group_id, ())):
+            self.delete_post(post_id)
+        for story_id in list(self.stories_by_group.pop(group_id, ())):
+            self.delete_story(story_id)
+
+    def delete_post(self, post_id: int) -> None:
+        post = self.posts.pop(post_id)
+        self.posts_by_user[post["user_id"]].discard(post_id)
+        if post["group_id"] is not None:
+            self.posts_by_group[post["group_id"]].discard(post_id)
+        self.post_tags.pop(post_id, None)
+        self.undeliver(post_id, self.post_readers.pop(post_id, ()))
+
+    def delete_story(self, story_id: int) -> None:
+        story = self.stories.pop(story_id)
+        self.stories_by_uploader[story["uploader_id"]].discard(story_id)
+        if story["group_id"] is not None:
+            self.stories_by_group[story["group_id"]].discard(story_id)
+        for reaction_id in self.reactions_by_story.pop(story_id, set()):
+            reaction = self.reactions.pop(reaction_id)
+            self.reactions_by_user[reaction["user_id"]].discard(reaction_id)
+
+
+class _MemoryRepository:
+    def __init__(self, store: MemoryStore):
+        self.store = store
+
+
+class MemoryUserRepository(_MemoryRepository, UserRepository):
+    async def get(self, user_id: int) -> Optional[dict]:
+        user = self.store.users.get(user_id)
+        return dict(user) if user is not None else None
+
+    async def get_by_name(self, name: str) -> Optional[dict]:
+        ids = self.store.users_by_name.get(name)
+        return await self.get(min(ids)) if ids else None
+
+    async def exists(self, user_id: int) -> bool:
+        return user_id in self.store.users
+
+    async def admin_exists(self) -> bool:
+        return bool(self.store.admins)
+
+    async def lock(self) -> None:
+        # nothing to hold: the store changes only between awaits
+        pass
+
+    async def create(
+        self, name: str, password: str, role: str, profile_image: Optional[str] = None
+    ) -> int:
+        if self.store.users_by_name.get(name):
+            raise ConflictError("UNIQUE constraint failed: users.name")
+        user_id = self.store.next_id("users")
+        self.store.users[user_id] = {
+            "id": user_id,
+            "name": name,
+            "password": password,
+            "role": role,
+            "profile_image": profile_image,
+        }
+        self.store.users_by_name[name].add(user_id)
+        if role == "admin":
+            self.store.admins.add(user_id)
+        return user_id
+
+    async def existing_names(self, names: list[str]) -> set[str]:
+        return {name for name in names if self.store.users_by_name.get(name)}
+
+    async def create_many(self, users: list[tuple[str, str, str]]) -> set[str]:
+        created = set()
+        for name, password, role in users:
+            if not self.store.users_by_name.get(name):
+                await self.create(name, password, role)
+                created.add(name)
+        return created
+
+    async def set_password(self, user_id: int, password: str) -> bool:
+        user = self.store.users.get(user_id)
+        if user is None:
+            return False
+        user["password"] = password
+        return True
+
+    async def summaries(self, user_ids: list[int]) -> list[Friend]:
+        users = self.store.users
+        return [
+            Friend(user_id, users[user_id]["name"])
+            for user_id in user_ids
+            if user_id in users
+        ]
+
+    async def delete_by_name(self, name: str) -> int:
+        ids = list(self.store.users_by_name.get(name, ()))
+        for user_id in ids:
+            self.store.delete_user(user_id)
+        self.store.revoked.update(ids)
+        revocations.add(ids)
+        return len(ids)
+
+    async def revoked_ids(self) -> set[int]:
+        return set(self.store.revoked)
+
+    async def revoked_count(self) -> int:
+        return len(self.store.revoked)
+
+
+class MemoryFriendRepository(_MemoryRepository, FriendRepository):
+    async def send_request(self, sender_id: int, receiver_id: int) -> bool:
+        store = self.store
+        key = friend_pair(sender_id, receiver_id)
+        if (
+            sender_id == receiver_id
+            or key in store.friends
+            or not (sender_id in store.users and receiver_id in store.users)
+        ):
+            return False
+        store.friends[key] = (sender_id, "pending")
+        store.friend_links[sender_id].add(receiver_id)
+        store.friend_links[receiver_id].add(sender_id)
+        return True
+
+    async def accept(self, sender_id: int, receiver_id: int) -> bool:
+        key = friend_pair(sender_id, receiver_id)
+        if self.store.friends.get(key) != (sender_id, "pending"):
+            return False
+        self._mark_neighbourhood(sender_id, receiver_id)
+        self.store.friends[key] = (sender_id, "accepted")
+        return True
+
+    async def decline(self, sender_id: int, receiver_id: int) -> bool:
+        key = friend_pair(sender_id, receiver_id)
+        if self.store.friends.get(key) != (sender_id, "pending"):
+            return False
+        self._delete(sender_id, receiver_id)
+        return True
+
+    async def respond_many(
+        self, receiver_id: int, decisions: list[tuple[int, bool]]
+    ) -> list[bool]:
+        results = []
+        for sender_id, accept in decisions:
+            if accept:
+                results.append(await self.accept(sender_id, receiver_id))
+            else:
+                results.append(await self.decline(sender_id, receiver_id))
+        return results
+
+    async def are_friends(self, user_id: int, other_id: int) -> bool:
+        row = self.store.friends.get(friend_pair(user_id, other_id))
+        return row is not None and row[1] == "accepted"
+
+    def _friend_ids(self, user_id: int) -> list[int]:
+        store = self.store
+        return [
+            other_id
+            for other_id in store.friend_links.get(user_id, ())
+            if store.friends[friend_pair(user_id, other_id)][1] == "accepted"
+        ]
+
+    async def list_friends(
+        self,
+        user_id: int,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> list[Friend]:
+        users = self.store.users
+        friends = [
+            Friend(other_id, users[other_id]["name"])
+            for other_id in sorted(self._friend_ids(user_id))
+            if (after is None or other_id > after)
+            and (prefix is None or users[other_id]["name"].startswith(prefix))
+        ]
+        return friends[:limit] if limit is not None else friends
+
+    async def list_pending(
+        self,
+        user_id: int,
+        incoming: bool,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> list[Friend]:
+        store = self.store
+        other_ids = []
+        for other_id in store.friend_links.get(user_id, ()):
+            requester_id, status = store.friends[friend_pair(user_id, other_id)]
+            if status == "pending" and (requester_id == other_id) == incoming:
+                other_ids.append(other_id)
+        requests = [
+            Friend(other_id, store.users[other_id]["name"])
+            for other_id in sorted(other_ids)
+            if after is None or other_id > after
+        ]
+        return requests[:limit] if limit is not None else requests
+
+    async def count(self, user_id: int) -> int:
+        return len(self._friend_ids(user_id))
+
+    async def friend_ids(self, user_id: int) -> frozenset:
+        return frozenset(self._friend_ids(user_id))
+
+    async def mutual_ids(self, user_id: int, other_id: int) -> list[int]:
+        return sorted(set(self._friend_ids(user_id)) & set(self._friend_ids(other_id)))
+
+    async def connection_path(
+        self, user_id: int, other_id: int, max_depth: int
+    ) -> Optional[list[int]]:
+        return shortest_path(self._friend_ids, user_id, other_id, max_depth)
+
+    async def pending_ids(self, user_ids: list[int]) -> dict[int, set[int]]:
+        store = self.store
+        return {
+            user_id: {
+                other_id
+                for other_id in store.friend_links.get(user_id, ())
+                if store.friends[friend_pair(user_id, other_id)][1] == "pending"
+            }
+            for user_id in user_ids
+        }
+
+    async def trim_changes(self, reader: str, now: float, expired: float) -> int:
+        return 0
+
+    async def remove(self, user_id: int, friend_id: int) -> bool:
+        store = self.store
+        if friend_pair(user_id, friend_id) not in store.friends:
+            return False
+        # each one's posts delivered to the other as a friend
+        for reader_id, author_id in ((user_id, friend_id), (friend_id, user_id)):
+            store.undeliver_from(
+                reader_id,
+                lambda post, via_group: not via_group and post["user_id"] == author_id,
+            )
+        self._mark_neighbourhood(user_id, friend_id)
+        return self._delete(user_id, friend_id)
+
+    def _mark_neighbourhood(self, user_id: int, other_id: int) -> None:
+        self.store.mark_stale(
+            {user_id, other_id, *self._friend_ids(user_id), *self._friend_ids(other_id)}
+        )
+
+    def _delete(self, user_id: int, friend_id: int) -> bool:
+        store = self.store
+        if store.friends.pop(friend_pair(user_id, friend_id), None) is None:
+            return False
+        store.friend_links[user_id].discard(friend_id)
+        store.friend_links[friend_id].discard(user_id)
+        return True
+
+
+class MemoryGroupRepository(_MemoryRepository, GroupRepository):
+    async def create(self, name: str, owner_id: int, member_ids: list[int]) -> int:
+        store = self.store
+        store.require(store.users, owner_id)
+        for member_id in member_ids:
+            store.require(store.users, member_id)
+
+        group_id = store.next_id("groups")
+        store.groups[group_id] = {"id": group_id, "name": name, "owner_id": owner_id}
+        store.groups_by_owner[owner_id].add(group_id)
+        for member_id in member_ids:
+            self._add(group_id, member_id)
+        return group_id
+
+    async def get_owner(self, group_id: int) -> Optional[int]:
+        group = self.store.groups.get(group_id)
+        return group["owner_id"] if group is not None else None
+
+    async def delete(self, group_id: int) -> None:
+        if group_id in self.store.groups:
+            self.store.delete_group(group_id)
+
+    async def is_member(self, group_id: int, user_id: int) -> bool:
+        return user_id in self.store.group_members.get(group_id, ())
+
+    async def add_member(self, group_id: int, user_id: int) -> bool:
+        self.store.require(self.store.groups, group_id)
+        self.store.require(self.store.users, user_id)
+        if user_id in self.store.group_members.get(group_id, ()):
+            return False
+        self._add(group_id, user_id)
+        return True
+
+    async def remove_member(self, group_id: int, user_id: int) -> bool:
+        members = self.store.group_members.get(group_id)
+        if not members or user_id not in members:
+            return False
+        members.discard(user_id)
+        self.store.user_groups[user_id].discard(group_id)
+        self.store.undeliver_from(
+            user_id,
+            lambda post, via_group: via_group
+            and post["group_id"] == group_id
+            and post["user_id"] != user_id,
+        )
+        self.store.mark_stale([user_id])
+        return True
+
+    async def shared_counts(self, user_ids: list[int]) -> dict[int, dict[int, int]]:
+        store = self.store
+        shared = {}
+        for user_id in user_ids:
+            counts = shared[user_id] = defaultdict(int)
+            for group_id in store.user_groups.get(user_id, ()):
+                for other_id in store.group_members[group_id]:
+                    if other_id != user_id:
+                        counts[other_id] += 1
+        return shared
+
+    def _add(self, group_id: int, user_id: int) -> None:
+        self.store.group_members[group_id].add(user_id)
+        self.store.user_groups[user_id].add(group_id)
+        self.store.mark_stale([user_id])
+
+
+class MemoryPostRepository(_MemoryRepository, PostRepository):
+    async def create(
+        self,
+        user_id: int,
+        post_type: str,
+        content: str,
+        visibility: str,
+        group_id: Optional[int],
+        tags: list[str] = (),
+    ) -> int:
+        store = self.store
+        store.require(store.users, user_id)
+        store.require(store.groups, group_id)
+
+        post_id = store.next_id("posts")
+        store.posts[post_id] = {
+            "id": post_id,
+            "user_id": user_id,
+            "post_type": post_type,
+            "content": content,
+            "visibility": visibility,
+            "group_id": group_id,
+        }
+        store.posts_by_user[user_id].add(post_id)
+        if group_id is not None:
+            store.posts_by_group[group_id].add(post_id)
+
+        for content in tags:
+            tag_id = store.tags_by_content.get(content)
+            if tag_id is None:
+                tag_id = store.next_id("tags")
+                store.tags[tag_id] = content
+                store.tags_by_content[content] = tag_id
+            store.post_tags[post_id].append(tag_id)
+        self._deliver(store.posts[post_id])
+        return post_id
+
+    def _deliver(self, post: dict) -> None:
+        store = self.store
+        author_id = post["user_id"]
+        if post["visibility"] == "group":
+            readers = set(store.group_members.get(post["group_id"], ()))
+        else:
+            readers = {
+                other_id
+                for other_id in store.friend_links.get(author_id, ())
+                if store.friends[friend_pair(author_id, other_id)][1] == "accepted"
+            }
+        via_group = post["visibility"] == "group"
+        if fanout.pushed(len(readers)):
+            store.deliver(post, readers | {author_id}, via_group)
+            return
+        store.deliver(post, {author_id}, via_group)
+        if via_group:
+            store.pulled_groups.add(post["group_id"])
+        else:
+            store.pulled_authors.add(author_id)
+
+    async def get(self, post_id: int) -> Optional[dict]:
+        post = self.store.posts.get(post_id)
+        return dict(post) if post is not None else None
+
+    async def update(
+        self,
+        post_id: int,
+        content: Optional[str] = None,
+        visibility: Optional[str] = None,
+    ) -> None:
+        post = self.store.posts.get(post_id)
+        if post is None:
+            return
+        if content is not None:
+            post["content"] = content
+        if visibility is not None:
+            redeliver = (post["visibility"] == "group") != (visibility == "group")
+            post["visibility"] = visibility
+            if redeliver:
+                self.store.undeliver(post_id, set(self.store.post_readers[post_id]))
+                self._deliver(post)
+
+    async def delete(self, post_id: int) -> None:
+        if post_id in self.store.posts:
+            self.store.delete_post(post_id)
+
+    async def feed(
+        self, user_id: int, before: Optional[int] = None, limit: Optional[int] = None
+    ) -> list[FeedPost]:
+        store = self.store
+
+        def stream(post_ids) -> list[FeedPost]:
+            return [
+                FeedPost(**store.posts[post_id])
+                for post_id in sorted(post_ids, reverse=True)
+                if before is None or post_id < before
+            ]
+
+        pulled = [
+            [
+                post_id
+                for post_id in store.posts_by_user.get(other_id, ())
+                if store.posts[post_id]["visibility"] != "group"
+            ]
+            for other_id in store.friend_links.get(user_id, ())
+            if other_id in store.pulled_authors
+            and store.friends[friend_pair(user_id, other_id)][1] == "accepted"
+        ] + [
+            [
+                post_id
+                for post_id in store.posts_by_group.get(group_id, ())
+                if store.posts[post_id]["visibility"] == "group"
+            ]
+            for group_id in store.user_groups.get(user_id, ())
+            if group_id in store.pulled_groups
+        ]
+        return fanout.merge(
+            [stream(store.timelines.get(user_id, ())), *map(stream, pulled)], limit
+        )
+
+
+class MemoryTagRepository(_MemoryRepository, TagRepository):
+    async def for_post(self, post_id: int) -> list[str]:
+        tags = self.store.tags
+        return [tags[tag_id] for tag_id in self.store.post_tags.get(post_id, ())]
+
+
+class MemoryMessageRepository(_MemoryRepository, MessageRepository):
+    async def send(self, sender_id: int, receiver_id: int, content: str) -> None:
+        store = self.store
+        store.require(store.users, sender_id)
+        store.require(store.users, receiver_id)
+
+        message_id = store.next_id("messages")
+        store.messages[message_id] = {
+            "id": message_id,
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "content": content,
+            "timestamp": _timestamp(),
+        }
+        store.conversations[(sender_id, receiver_id)].append(message_id)
+        store.conversation_peers[sender_id].add(receiver_id)
+        store.conversation_peers[receiver_id].add(sender_id)
+
+    async def conversation(self, user_id: int, other_id: int) -> list[ChatMessage]:
+        store = self.store
+        message_ids = set(store.conversations.get((user_id, other_id), ()))
+        message_ids.update(store.conversations.get((other_id, user_id), ()))
+        messages = sorted(
+            (store.messages[message_id] for message_id in message_ids),
+            key=lambda message: (message["timestamp"], message["id"]),
+        )
+        return [
+            ChatMessage(
+                message["content"],
+                message["timestamp"],
+                store.users[message["sender_id"]]["name"],
+            )
+            for message in messages
+        ]
+
+
+class MemoryStoryRepository(_MemoryRepository, StoryRepository):
+    async def create(
+        self,
+        uploader_id: int,
+        content: str,
+        visibility: str,
+        group_id: Optional[int],
+    ) -> int:
+        store = self.store
+        store.require(store.users, uploader_id)
+        store.require(store.groups, group_id)
+
+        story_id = store.next_id("stories")
+        store.stories[story_id] = {
+            "id": story_id,
+            "uploader_id": uploader_id,
+            "content": content,
+            "timestamp": _timestamp(),
+            "visibility": visibility,
+            "group_id": group_id,
+        }
+        store.stories_by_uploader[uploader_id].add(story_id)
+        if group_id is not None:
+            store.stories_by_group[group_id].add(story_id)
+        return story_id
+
+    async def get_uploader(self, story_id: int) -> Optional[int]:
+        story = self.store.stories.get(story_id)
+        return story["uploader_id"] if story is not None else None
+
+    async def delete(self, story_id: int) -> None:
+        if story_id in self.store.stories:
+            self.store.delete_story(story_id)
+
+    async def visible_to(self, viewer_id: Optional[int]) -> list[Story]:
+        store = self.store
+        friends = MemoryFriendRepository(store)
+        cutoff = _timestamp(datetime.now(timezone.utc) - timedelta(days=1))
+
+        stories = []
+        # newest first, stopping at the first story older than a day
+        for story in reversed(store.stories.values()):
+            if story["timestamp"] <= cutoff:
+                break
+
+            uploader_id = story["uploader_id"]
+            visibility = story["visibility"]
+            if not (
+                uploader_id == viewer_id
+                or visibility == "public"
+                or (
+                    visibility == "friends"
+                    and viewer_id is not None
+                    and await friends.are_friends(uploader_id, viewer_id)
+                )
+                or (
+                    visibility == "group"
+                    and viewer_id in store.group_members.get(story["group_id"], ())
+                )
+            ):
+                continue
+
+            uploader = store.users[uploader_id]
+            stories.append(
+                Story(
+                    story["id"],
+                    story["content"],
+                    story["timestamp"],
+                    visibility,
+                    uploader_id,
+                    uploader["name"],
+                    uploader["profile_image"],
+                    [],
+                )
+            )
+        return stories
+
+
+class MemoryReactionRepository(_MemoryRepository, ReactionRepository):
+    async def add(self, user_id: int, story_id: int, emoji: str) -> None:
+        store = self.store
+        store.require(store.users, user_id)
+        store.require(store.stories, story_id)
+
+        reaction_id = store.next_id("stories_reaction")
+        store.reactions[reaction_id] = {
+            "id": reaction_id,
+            "user_id": user_id,
+            "story_id": story_id,
+            "emoji": emoji,
+        }
+        store.reactions_by_story[story_id].add(reaction_id)
+        store.reactions_by_user[user_id].add(reaction_id)
+
+    async def counts(self, story_ids: list[int]) -> dict[int, list[ReactionCount]]:
+        store = self.store
+        counts = {}
+        for story_id in story_ids:
+            emojis = defaultdict(int)
+            for reaction_id in store.reactions_by_story.get(story_id, ()):
+                emojis[store.reactions[reaction_id]["emoji"]] += 1
+            counts[story_id] = [
+                ReactionCount(emoji, count) for emoji, count in sorted(emojis.items())
+            ]
+        return counts
+
+
+class MemorySuggestionRepository(_MemoryRepository, SuggestionRepository):
+    async def mark_stale(self, user_ids: list[int]) -> None:
+        self.store.mark_stale(user_ids)
+
+    async def claim(self, limit: int) -> list[int]:
+        stale = self.store.stale
+        claimed = list(itertools.islice(stale, limit))
+        for user_id in claimed:
+            del stale[user_id]
+        return claimed
+
+    async def replace(self, ranked: dict[int, list[tuple[int, int, int]]]) -> None:
+        for user_id, suggestions in ranked.items():
+            self.store.suggestions[user_id] = list(suggestions)
+
+    async def for_user(self, user_id: int) -> list[Suggestion]:
+        store = self.store
+        suggestions = []
+        for candidate_id, mutual_friends, shared_groups in store.suggestions.get(
+            user_id, ()
+        ):
+            if candidate_id not in store.users:
+                continue
+            row = store.friends.get(friend_pair(user_id, candidate_id))
+            if row is not None and row[1] == "accepted":
+                continue
+            suggestions.append(
+                Suggestion(
+                    candidate_id,
+                    store.users[candidate_id]["name"],
+                    mutual_friends,
+                    shared_groups,
+                )
+            )
+        return suggestions
+
+
+class MemoryRepositories(Repositories):
+    def __init__(self, store: MemoryStore):
+        self.users = MemoryUserRepository(store)
+        self.friends = MemoryFriendRepository(store)
+        self.groups = MemoryGroupRepository(store)
+        self.posts = MemoryPostRepository(store)
+        self.tags = MemoryTagRepository(store)
+        self.messages = MemoryMessageRepository(store)
+        self.stories = MemoryStoryRepository(store)
+        self.reactions = MemoryReactionRepository(store)
+        self.suggestions = MemorySuggestionRepository(store)
@@ -0,0 +1,1535 @@
+import asyncio
+import heapq
+import json
+import sqlite3
+import weakref
+from collections import defaultdict
+from operator import attrgetter
+from typing import Optional
+from cache import user_cache
+from database import AsyncSession
+import fanout
+from friend_graph import friend_graph
+from graph_snapshot import (
+    CHANGES_SINCE,
+    LAST_CHANGE,
+    LOWEST_READER,
+    TRIM_CHANGES,
+    CSRSnapshot,
+    changes_since,
+    last_change,
+    open_snapshot,
+)
+from records import ChatMessage, FeedPost, Friend, ReactionCount, Story, Suggestion
+from revocation import revocations
+from repositories.base import (
+    ConflictError,
+    FriendRepository,
+    GroupRepository,
+    MessageRepository,
+    PostRepository,
+    ReactionRepository,
+    Repositories,
+    StorageError,
+    StoryRepository,
+    SuggestionRepository,
+    TagRepository,
+    UserRepository,
+    friend_pair,
+)
+
+ACCEPTED_FRIENDS = "SELECT user_low, user_high FROM friends WHERE status = 'accepted'"
+
+
+def load_friend_graph(
+    conn: sqlite3.Connection, snapshot: Optional[CSRSnapshot] = None
+) -> None:
+    # from a snapshot only the friendships changed since it was written are
+    # read; without one, or when the log no longer holds the changes right
+    # after the snapshot, all of them
+    if snapshot is not None:
+        changes = changes_since(conn, snapshot.mark)
+        first = changes[0][0] if changes else last_change(conn) + 1
+        if first == snapshot.mark + 1:
+            friend_graph.load_snapshot(snapshot, changes)
+            return
+    mark = last_change(conn)
+    friend_graph.load(conn.execute(ACCEPTED_FRIENDS).fetchall(), mark)
+
+
+# requests (by their root session) that have already brought the friend
+# graph up to date with the change log
+_caught_up = weakref.WeakSet()
+
+
+async def _friend_graph(db: AsyncSession, current: bool = False):
+    # Loaded at startup; databases configured without the app lifespan
+    # (benchmarks, scripts) load it on first use instead. The changes other
+    # processes logged since the graph's mark are applied at most once per
+    # refresh interval, or, for a permission check (current), before it is
+    # answered, once per request. A write transaction would also read its
+    # own uncommitted changes from the log, so it uses the graph as it is.
+    root = db.shard(0)
+    if not friend_graph.loaded:
+        friend_graph.begin_load()
+        mark = (await db.fetchone(LAST_CHANGE))["last"]
+        rows = await db.fetchall(ACCEPTED_FRIENDS, row_factory=_plain_row)
+        friend_graph.load(rows, mark)
+        _caught_up.add(root)
+    elif db.in_write or root in _caught_up:
+        pass
+    elif current or friend_graph.refresh_due():
+        _caught_up.add(root)
+        await _catch_up(db)
+    return friend_graph
+
+
+async def _catch_up(db: AsyncSession) -> None:
+    mark = friend_graph.mark
+    last = (await db.fetchone(LAST_CHANGE))["last"]
+    if last <= mark:
+        return
+    changes = await db.fetchall(CHANGES_SINCE, (mark,), row_factory=_plain_row)
+    if changes and changes[0][0] == mark + 1:
+        friend_graph.apply(changes)
+        return
+
+    # The changes right after the mark were trimmed by a newer snapshot.
+    # That snapshot plus the changes since it is loaded instead, or, without
+    # one, the whole table.
+    trimmed = changes[0][0] - 1 if changes else last
+    friend_graph.begin_load()
+    snapshot = open_snapshot()
+    if snapshot is not None and snapshot.mark >= trimmed:
+        newer = [change for change in changes if change[0] > snapshot.mark]
+        friend_graph.load_snapshot(snapshot, newer)
+    else:
+        rows = await db.fetchall(ACCEPTED_FRIENDS, row_factory=_plain_row)
+        friend_graph.load(rows, last)
+
+
+MARK_STALE = "INSERT OR REPLACE INTO suggestion_queue (user_id) VALUES (?)"
+
+
+async def _mark_stale(db: AsyncSession, user_ids) -> None:
+    try:
+        await db.executemany(MARK_STALE, [(user_id,) for user_id in sorted(user_ids)])
+    except sqlite3.Error as e:
+        raise StorageError(str(e)) from e
+
+
+async def _mark_neighbourhood(db: AsyncSession, user_id: int, other_id: int) -> None:
+    # a friendship between the two changes their friends' friends of friends
+    graph = await _friend_graph(db)
+    await _mark_stale(
+        db, {user_id, other_id} | graph.friends_of(user_id) | graph.friends_of(other_id)
+    )
+
+
+# ids per IN (...) list, well below SQLite's bound parameter limit
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(ids: list) -> list:
+    return [ids[i : i + IN_CHUNK_SIZE] for i in range(0, len(ids), IN_CHUNK_SIZE)]
+
+
+def _plain_row(cursor, row: tuple) -> tuple:
+    return row
+
+
+UNIQUE_VIOLATIONS = ("SQLITE_CONSTRAINT_UNIQUE", "SQLITE_CONSTRAINT_PRIMARYKEY")
+
+
+def _storage_error(e: sqlite3.Error) -> StorageError:
+    # a taken unique key is a conflict the caller can report; anything else
+    # is a failure
+    if getattr(e, "sqlite_errorname", None) in UNIQUE_VIOLATIONS:
+        return ConflictError(str(e))
+    return StorageError(str(e))
+
+
+def _marks(ids: list) -> str:
+    return ", ".join("?" * len(ids))
+
+
+# Lookups by global id on a shard. The trailing parameter is the shard the
+# query runs on: only rows whose owner is homed there count.
+OWNED_POST = """
+    SELECT p.* FROM posts p
+    JOIN users u ON u.id = p.user_id
+    WHERE p.id = ? AND u.shard = ?
+"""
+OWNED_STORY = """
+    SELECT s.uploader_id FROM stories s
+    JOIN users u ON u.id = s.uploader_id
+    WHERE s.id = ? AND u.shard = ?
+"""
+
+
+class ShardRouter:
+    # Per-request map of where rows live. Users are homed on one shard each
+    # (users.shard in the directory) and their posts, stories and outgoing
+    # messages live there; reactions are kept next to their story. Lookups
+    # are cached for the rest of the request, and with a single shard every
+    # answer is 0 without a query.
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.count = db.shard_count
+        self.users = {}
+        self.posts = {}
+        self.stories = {}
+
+    def session(self, index: int) -> AsyncSession:
+        return self.db.shard(index)
+
+    def sessions(self) -> list[AsyncSession]:
+        return [self.db.shard(index) for index in range(self.count)]
+
+    async def load_users(self, user_ids: list[int]) -> None:
+        if self.count == 1:
+            return
+        missing = [
+            user_id for user_id in dict.fromkeys(user_ids) if user_id not in self.users
+        ]
+        # unknown users own no rows; they are answered from shard 0
+        self.users.update(dict.fromkeys(missing, 0))
+        for chunk in _chunks(missing):
+            rows = await self.db.fetchall(
+                f"SELECT id, shard FROM users WHERE id IN ({_marks(chunk)})",
+                tuple(chunk),
+                row_factory=_plain_row,
+            )
+            self.users.update(rows)
+
+    async def user_shard(self, user_id: int) -> int:
+        if self.count == 1:
+            return 0
+        if user_id not in self.users:
+            await self.load_users([user_id])
+        return self.users.get(user_id, 0)
+
+    async def next_id(self, index: int, table: str) -> Optional[int]:
+        # ids of posts and stories must be unique across shards; shard k
+        # hands out seq * N + k. A single shard keeps AUTOINCREMENT.
+        if self.count == 1:
+            return None
+
+        session = self.session(index)
+        await session.execute(
+            """
+            INSERT INTO id_sequence (name, seq) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET seq = seq + 1
+            """,
+            (table,),
+        )
+        row = await session.fetchone(
+            "SELECT seq FROM id_sequence WHERE name = ?", (table,)
+        )
+        return row["seq"] * self.count + index
+
+    async def find(self, cache: dict, key: int, sql: str, params: tuple):
+        # Looks a row up on every shard at once. The query must end with an
+        # owner filter on users.shard, so a copy left behind by an
+        # interrupted move is never answered.
+        index = cache.get(key)
+        if index is not None:
+            return await self.session(index).fetchone(sql, params + (index,))
+
+        rows = await asyncio.gather(
+            *(
+                session.fetchone(sql, params + (session.index,))
+                for session in self.sessions()
+            )
+        )
+        for index, row in enumerate(rows):
+            if row is not None:
+                cache[key] = index
+                return row
+        return None
+
+    async def post_shard(self, post_id: int) -> Optional[int]:
+        if self.count == 1:
+            return 0
+        if post_id not in self.posts:
+            await self.find(self.posts, post_id, OWNED_POST, (post_id,))
+        return self.posts.get(post_id)
+
+    async def story_shard(self, story_id: int) -> Optional[int]:
+        if self.count == 1:
+            return 0
+        if story_id not in self.stories:
+            await self.find(self.stories, story_id, OWNED_STORY, (story_id,))
+        return self.stories.get(story_id)
+
+    async def require_group(self, index: int, group_id: Optional[int]) -> None:
+        # shard files cannot reference the directory's groups table, so the
+        # foreign key the directory enforces is checked here
+        if index == 0 or group_id is None:
+            return
+        row = await self.db.fetchone("SELECT 1 FROM groups WHERE id = ?", (group_id,))
+        if row is None:
+            raise StorageError("FOREIGN KEY constraint failed")
+
+    async def purge(self, user_ids: list[int], group_ids: list[int]) -> None:
+        # Rows on shard files that the directory's ON DELETE CASCADE cannot
+        # reach. Shards are written in ascending order, after the directory.
+        statements = []
+        for chunk in _chunks(user_ids):
+            marks = _marks(chunk)
+            for sql in (
+                f"DELETE FROM posts WHERE user_id IN ({marks})",
+                f"DELETE FROM stories WHERE uploader_id IN ({marks})",
+                f"DELETE FROM stories_reaction WHERE user_id IN ({marks})",
+                f"DELETE FROM likes WHERE user_id IN ({marks})",
+                f"DELETE FROM comments WHERE user_id IN ({marks})",
+            ):
+                statements.append((sql, tuple(chunk)))
+            statements.append(
+                (
+                    f"DELETE FROM messages WHERE sender_id IN ({marks}) "
+                    f"OR receiver_id IN ({marks})",
+                    tuple(chunk) * 2,
+                )
+            )
+        for chunk in _chunks(group_ids):
+            marks = _marks(chunk)
+            statements.append(
+                (f"DELETE FROM posts WHERE group_id IN ({marks})", tuple(chunk))
+            )
+            statements.append(
+                (f"DELETE FROM stories WHERE group_id IN ({marks})", tuple(chunk))
+            )
+
+        for index in range(1, self.count):
+            session = self.session(index)
+            for sql, params in statements:
+                try:
+                    await session.execute(sql, params)
+                except sqlite3.Error as e:
+                    raise StorageError(str(e)) from e
+
+
+class _SqliteRepository:
+    def __init__(self, db: AsyncSession, shards: Optional[ShardRouter] = None):
+        self.db = db
+        self.shards = shards if shards is not None else ShardRouter(db)
+
+    async def _execute(
+        self, sql: str, params: tuple = (), session: Optional[AsyncSession] = None
+    ) -> sqlite3.Cursor:
+        try:
+            return await (session or self.db).execute(sql, params)
+        except sqlite3.Error as e:
+            raise _storage_error(e) from e
+
+    async def _execute_batched(
+        self, sql: str, params: tuple = (), session: Optional[AsyncSession] = None
+    ) -> int:
+        try:
+            return await (session or self.db).execute_batched(sql, params)
+        except sqlite3.Error as e:
+            raise _storage_error(e) from e
+
+    async def _executemany(
+        self,
+        sql: str,
+        seq_of_params: list,
+        session: Optional[AsyncSession] = None,
+    ) -> sqlite3.Cursor:
+        try:
+            return await (session or self.db).executemany(sql, seq_of_params)
+        except sqlite3.Error as e:
+            raise _storage_error(e) from e
+
+    async def _fetchone(
+        self, sql: str, params: tuple = (), session: Optional[AsyncSession] = None
+    ) -> Optional[dict]:
+        row = await (session or self.db).fetchone(sql, params)
+        return dict(row) if row is not None else None
+
+
+class SqliteUserRepository(_SqliteRepository, UserRepository):
+    async def get(self, user_id: int) -> Optional[dict]:
+        # Every authenticated request starts here, so rows are cached across
+        # requests. The home shard is only trusted when freshly read: a move
+        # may have changed it since the row was cached.
+        user = user_cache.get(user_id)
+        if user is not None:
+            return dict(user)
+
+        generation = user_cache.generation
+        user = await self._fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+        if user is not None:
+            self.shards.users[user_id] = user["shard"]
+            user_cache.put(user_id, dict(user), generation=generation)
+        return user
+
+    def _forget(self, user_ids: list[int]) -> None:
+        # Anything that changes a users row must call this. The cached copy is
+        # dropped once the change commits; until then, requests in this
+        # process may still be served the old row. A row another request read
+        # before the commit is not cached after it, since the invalidation
+        # moves the cache's generation on. Other processes keep their copy
+        # until it expires, at most USER_CACHE_TTL seconds.
+        def invalidate():
+            for user_id in user_ids:
+                user_cache.invalidate(user_id)
+
+        self.db.after_commit(invalidate)
+
+    async def get_by_name(self, name: str) -> Optional[dict]:
+        return await self._fetchone("SELECT * FROM users WHERE name = ?", (name,))
+
+    async def exists(self, user_id: int) -> bool:
+        row = await self.db.fetchone("SELECT id FROM users WHERE id = ?", (user_id,))
+        return row is not None
+
+    async def admin_exists(self) -> bool:
+        row = await self.db.fetchone("SELECT id FROM users WHERE role = 'admin'")
+        return row is not None
+
+    async def lock(self) -> None:
+        await self.db.take_writer(immediate=True)
+
+    async def create(
+        self, name: str, password: str, role: str, profile_image: Optional[str] = None
+    ) -> int:
+        cursor = await self._execute(
+            """
+            INSERT INTO users (name, password, role, profile_image)
+            VALUES (?, ?, ?, ?)
+            """,
+            (name, password, role, profile_image),
+        )
+        user_id = cursor.lastrowid
+        if self.shards.count > 1:
+            # new users are spread over the shards by id
+            await self._execute(
+                "UPDATE users SET shard = ? WHERE id = ?",
+                (user_id % self.shards.count, user_id),
+            )
+        return user_id
+
+    async def existing_names(self, names: list[str]) -> set[str]:
+        # one statement however many names: they travel as a JSON array
+        rows = await self.db.fetchall(
+            "SELECT name FROM users WHERE name IN (SELECT value FROM json_each(?))",
+            (json.dumps(names),),
+            row_factory=_plain_row,
+        )
+        return {name for (name,) in rows}
+
+    async def create_many(self, users: list[tuple[str, str, str]]) -> set[str]:
+        if not users:
+            return set()
+        # one statement for the batch; a name taken since the caller checked
+        # it is skipped by the unique index rather than failing every row
+        await self.db.take_writer()
+        try:
+            created = await self.db.fetchall(
+                """
+                INSERT INTO users (name, password, role)
+                SELECT value ->> 0, value ->> 1, value ->> 2 FROM json_each(?)
+                WHERE true
+                ON CONFLICT (name) DO NOTHING
+                RETURNING id, name
+                """,
+                (json.dumps(users),),
+                row_factory=_plain_row,
+            )
+        except sqlite3.Error as e:
+            raise _storage_error(e) from e
+        if self.shards.count > 1 and created:
+            await self._execute(
+                """
+                UPDATE users SET shard = id % ?
+                WHERE id IN (SELECT value FROM json_each(?))
+                """,
+                (self.shards.count, json.dumps([user_id for user_id, _ in created])),
+            )
+        return {name for _, name in created}
+
+    async def set_password(self, user_id: int, password: str) -> bool:
+        self._forget([user_id])
+        cursor = await self._execute(
+            "UPDATE users SET password = ? WHERE id = ?", (password, user_id)
+        )
+        return cursor.rowcount > 0
+
+    async def summaries(self, user_ids: list[int]) -> list[Friend]:
+        if not user_ids:
+            return []
+        rows = await self.db.fetchall(
+            "SELECT id, name FROM users WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(user_ids),),
+            row_factory=Friend.from_row,
+        )
+        by_id = {row.id: row for row in rows}
+        return [by_id[user_id] for user_id in user_ids if user_id in by_id]
+
+    async def delete_by_name(self, name: str) -> int:
+        users = await self.db.fetchall(
+            "SELECT id FROM users WHERE name = ?", (name,), row_factory=_plain_row
+        )
+        if not users:
+            return 0
+        user_ids = [user_id for (user_id,) in users]
+        self._forget(user_ids)
+        # tokens of deleted users stop working, including in auth modes that
+        # never load the user
+        await self._executemany(
+            "INSERT OR IGNORE INTO revoked_users (user_id) VALUES (?)",
+            [(user_id,) for user_id in user_ids],
+        )
+        self.db.after_commit(lambda: revocations.add(user_ids))
+        self.db.after_commit(lambda: friend_graph.remove_users(user_ids))
+
+        if self.shards.count == 1:
+            cursor = await self._execute("DELETE FROM users WHERE name = ?", (name,))
+            return cursor.rowcount
+
+        groups = await self.db.fetchall(
+            f"SELECT id FROM groups WHERE owner_id IN ({_marks(user_ids)})",
+            tuple(user_ids),
+            row_factory=_plain_row,
+        )
+        cursor = await self._execute("DELETE FROM users WHERE name = ?", (name,))
+        await self.shards.purge(user_ids, [group_id for (group_id,) in groups])
+        return cursor.rowcount
+
+    async def revoked_ids(self) -> set[int]:
+        rows = await self.db.fetchall(
+            "SELECT user_id FROM revoked_users", row_factory=_plain_row
+        )
+        return {user_id for (user_id,) in rows}
+
+    async def revoked_count(self) -> int:
+        (count,) = await self.db.fetchone(
+            "SELECT COUNT(*) FROM revoked_users", row_factory=_plain_row
+        )
+        return count
+
+
+class SqliteFriendRepository(_SqliteRepository, FriendRepository):
+    async def send_request(self, sender_id: int, receiver_id: int) -> bool:
+        # a pair that already has a row, in either direction, is refused by
+        # the primary key; asking yourself fails the CHECK
+        try:
+            await self.db.execute_batched(
+                """
+                INSERT INTO friends (user_low, user_high, requester_id, status)
+                VALUES (?, ?, ?, 'pending')
+                """,
+                (*friend_pair(sender_id, receiver_id), sender_id),
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    async def accept(self, sender_id: int, receiver_id: int) -> bool:
+        cursor = await self._execute(
+            """
+            UPDATE friends
+            SET status = 'accepted'
+            WHERE user_low = ? AND user_high = ?
+              AND requester_id = ? AND status = 'pending'
+            """,
+            (*friend_pair(sender_id, receiver_id), sender_id),
+        )
+        if cursor.rowcount == 0:
+            return False
+        await _mark_neighbourhood(self.db, sender_id, receiver_id)
+        self.db.after_commit(lambda: friend_graph.add(sender_id, receiver_id))
+        return True
+
+    async def decline(self, sender_id: int, receiver_id: int) -> bool:
+        cursor = await self._execute(
+            """
+            DELETE FROM friends
+            WHERE user_low = ? AND user_high = ?
+              AND requester_id = ? AND status = 'pending'
+            """,
+            (*friend_pair(sender_id, receiver_id), sender_id),
+        )
+        return cursor.rowcount > 0
+
+    async def respond_many(
+        self, receiver_id: int, decisions: list[tuple[int, bool]]
+    ) -> list[bool]:
+        # one primary key seek per sender finds the pending requests, then
+        # the accepted and the declined pairs are written in one batch each
+        senders = list(dict.fromkeys(sender_id for sender_id, _ in decisions))
+        rows = await self.db.fetchall(
+            """
+            SELECT f.requester_id
+            FROM json_each(?) j
+            JOIN friends f
+              ON f.user_low = MIN(j.value, ?) AND f.user_high = MAX(j.value, ?)
+            WHERE f.requester_id = j.value AND f.status = 'pending'
+            """,
+            (json.dumps(senders), receiver_id, receiver_id),
+            row_factory=_plain_row,
+        )
+        pending = {sender_id for (sender_id,) in rows}
+
+        results, accepted, declined = [], [], []
+        for sender_id, accept in decisions:
+            found = sender_id in pending
+            pending.discard(sender_id)
+            results.append(found)
+            if found:
+                pair = (*friend_pair(sender_id, receiver_id), sender_id)
+                (accepted if accept else declined).append(pair)
+
+        if accepted:
+            await self._executemany(
+                """
+                UPDATE friends
+                SET status = 'accepted'
+                WHERE user_low = ? AND user_high = ?
+                  AND requester_id = ? AND status = 'pending'
+                """,
+                accepted,
+            )
+            graph = await _friend_graph(self.db)
+            friend_ids = [requester_id for _, _, requester_id in accepted]
+            stale = {receiver_id, *graph.friends_of(receiver_id)}
+            for friend_id in friend_ids:
+                stale.add(friend_id)
+                stale.update(graph.friends_of(friend_id))
+            await _mark_stale(self.db, stale)
+
+            def add_friends():
+                for friend_id in friend_ids:
+                    friend_graph.add(friend_id, receiver_id)
+
+            self.db.after_commit(add_friends)
+        if declined:
+            await self._executemany(
+                """
+                DELETE FROM friends
+                WHERE user_low = ? AND user_high = ?
+                  AND requester_id = ? AND status = 'pending'
+                """,
+                declined,
+            )
+        return results
+
+    async def are_friends(self, user_id: int, other_id: int) -> bool:
+        graph = await _friend_graph(self.db, current=True)
+        return graph.are_friends(user_id, other_id)
+
+    async def list_friends(
+        self,
+        user_id: int,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> list[Friend]:
+        # The user is on the low side of some pairs and the high side of the
+        # others. Each side is a covering index range already in friend id
+        # order, so the two are merged without sorting and reading stops at
+        # the limit. The prefix is a range on the name.
+        names = "AND u.name >= ? AND u.name < ?" if prefix is not None else ""
+        side = (user_id, -1 if after is None else after)
+        if prefix is not None:
+            side += (prefix, prefix + "\U0010ffff")
+        return await self.db.fetchall(
+            f"""
+            SELECT f.user_high, u.name
+            FROM friends f
+            JOIN users u ON u.id = f.user_high
+            WHERE f.user_low = ? AND f.status = 'accepted' AND f.user_high > ?
+              {names}
+            UNION ALL
+            SELECT f.user_low, u.name
+            FROM friends f
+            JOIN users u ON u.id = f.user_low
+            WHERE f.user_high = ? AND f.status = 'accepted' AND f.user_low > ?
+              {names}
+            ORDER BY 1
+            LIMIT ?
+            """,
+            (*side, *side, -1 if limit is None else limit),
+            row_factory=Friend.from_row,
+        )
+
+    async def list_pending(
+        self,
+        user_id: int,
+        incoming: bool,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> list[Friend]:
+        # The requester of a received request is the other side of the
+        # pair, so on each side of the pair received requests are a range of
+        # the partial index on requester_id and sent ones are requester_id =
+        # user_id followed by the other side. Both ranges come out in the
+        # other user's id order and are merged without sorting.
+        after = -1 if after is None else after
+        limit = -1 if limit is None else limit
+        if incoming:
+            return await self.db.fetchall(
+                """
+                SELECT f.requester_id, u.name
+                FROM friends f INDEXED BY idx_friends_pending_high
+                JOIN users u ON u.id = f.requester_id
+                WHERE f.user_high = ? AND f.status = 'pending'
+                  AND f.requester_id > ? AND f.requester_id < ?
+                UNION ALL
+                SELECT f.requester_id, u.name
+                FROM friends f INDEXED BY idx_friends_pending_low
+                JOIN users u ON u.id = f.requester_id
+                WHERE f.user_low = ? AND f.status = 'pending'
+                  AND f.requester_id > MAX(?, ?)
+                ORDER BY 1
+                LIMIT ?
+                """,
+                (user_id, after, user_id, user_id, after, user_id, limit),
+                row_factory=Friend.from_row,
+            )
+        return await self.db.fetchall(
+            """
+            SELECT f.user_high, u.name
+            FROM friends f INDEXED BY idx_friends_pending_low
+            JOIN users u ON u.id = f.user_high
+            WHERE f.user_low = ? AND f.status = 'pending'
+              AND f.requester_id = ? AND f.user_high > ?
+            UNION ALL
+            SELECT f.user_low, u.name
+            FROM friends f INDEXED BY idx_friends_pending_high
+            JOIN users u ON u.id = f.user_low
+            WHERE f.user_high = ? AND f.status = 'pending'
+              AND f.requester_id = ? AND f.user_low > ?
+            ORDER BY 1
+            LIMIT ?
+            """,
+            (user_id, user_id, after, user_id, user_id, after, limit),
+            row_factory=Friend.from_row,
+        )
+
+    async def count(self, user_id: int) -> int:
+        return (await _friend_graph(self.db)).count(user_id)
+
+    async def friend_ids(self, user_id: int) -> frozenset:
+        return (await _friend_graph(self.db)).friends_of(user_id)
+
+    async def mutual_ids(self, user_id: int, other_id: int) -> list[int]:
+        return (await _friend_graph(self.db)).mutual_friends(user_id, other_id)
+
+    async def connection_path(
+        self, user_id: int, other_id: int, max_depth: int
+    ) -> Optional[list[int]]:
+        return (await _friend_graph(self.db)).path(user_id, other_id, max_depth)
+
+    async def pending_ids(self, user_ids: list[int]) -> dict[int, set[int]]:
+        pending = {user_id: set() for user_id in user_ids}
+        for chunk in _chunks(list(pending)):
+            marks = _marks(chunk)
+            rows = await self.db.fetchall(
+                f"""
+                SELECT user_low, user_high FROM friends
+                WHERE user_low IN ({marks}) AND status = 'pending'
+                UNION ALL
+                SELECT user_high, user_low FROM friends
+                WHERE user_high IN ({marks}) AND status = 'pending'
+                """,
+                (*chunk, *chunk),
+                row_factory=_plain_row,
+            )
+            for user_id, other_id in rows:
+                pending[user_id].add(other_id)
+        return pending
+
+    async def trim_changes(self, reader: str, now: float, expired: float) -> int:
+        # the graph is caught up first, so the mark reported is current
+        mark = (await _friend_graph(self.db, current=True)).mark
+        await self._execute(
+            """
+            INSERT INTO friend_graph_readers (reader, mark, seen_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (reader) DO UPDATE
+            SET mark = excluded.mark, seen_at = excluded.seen_at
+            """,
+            (reader, mark, now),
+        )
+        await self._execute(
+            "DELETE FROM friend_graph_readers WHERE seen_at < ?", (expired,)
+        )
+        floor = (await self.db.fetchone(LOWEST_READER))["mark"]
+        # workers starting from this machine's snapshot replay the changes
+        # after it
+        snapshot = open_snapshot()
+        if snapshot is not None:
+            floor = min(floor, snapshot.mark)
+        return (await self._execute(TRIM_CHANGES, (floor,))).rowcount
+
+    async def remove(self, user_id: int, friend_id: int) -> bool:
+        cursor = await self._execute(
+            "DELETE FROM friends WHERE user_low = ? AND user_high = ?",
+            friend_pair(user_id, friend_id),
+        )
+        if cursor.rowcount == 0:
+            return False
+        # each one's posts delivered to the other as a friend
+        await self._executemany(
+            """
+            DELETE FROM timelines
+            WHERE user_id = ? AND author_id = ? AND NOT via_group
+            """,
+            [(user_id, friend_id), (friend_id, user_id)],
+        )
+        await _mark_neighbourhood(self.db, user_id, friend_id)
+        self.db.after_commit(lambda: friend_graph.remove(user_id, friend_id))
+        return True
+
+
+class SqliteGroupRepository(_SqliteRepository, GroupRepository):
+    async def create(self, name: str, owner_id: int, member_ids: list[int]) -> int:
+        cursor = await self._execute(
+            "INSERT INTO groups (name, owner_id) VALUES (?, ?)", (name, owner_id)
+        )
+        group_id = cursor.lastrowid
+        if member_ids:
+            await self._executemany(
+                "INSERT OR IGNORE INTO groups_users (group_id, user_id) VALUES (?, ?)",
+                [(group_id, member_id) for member_id in member_ids],
+            )
+            await _mark_stale(self.db, set(member_ids))
+        return group_id
+
+    async def get_owner(self, group_id: int) -> Optional[int]:
+        row = await self.db.fetchone(
+            "SELECT owner_id FROM groups WHERE id = ?", (group_id,)
+        )
+        return row["owner_id"] if row is not None else None
+
+    async def delete(self, group_id: int) -> None:
+        await self._execute("DELETE FROM groups WHERE id = ?", (group_id,))
+        if self.shards.count > 1:
+            await self.shards.purge([], [group_id])
+
+    async def is_member(self, group_id: int, user_id: int) -> bool:
+        row = await self.db.fetchone(
+            """
+            SELECT 1 FROM groups_users
+            WHERE group_id = ? AND user_id = ?
+            """,
+            (group_id, user_id),
+        )
+        return row is not None
+
+    async def add_member(self, group_id: int, user_id: int) -> bool:
+        # a repeated membership is refused by idx_groups_users_group, so two
+        # requests adding the same member cannot both succeed
+        cursor = await self._execute(
+            "INSERT OR IGNORE INTO groups_users (group_id, user_id) VALUES (?, ?)",
+            (group_id, user_id),
+        )
+        if cursor.rowcount == 0:
+            return False
+        # only the member's own suggestions; the other members see the
+        # change when theirs are next recomputed
+        await _mark_stale(self.db, [user_id])
+        return True
+
+    async def remove_member(self, group_id: int, user_id: int) -> bool:
+        cursor = await self._execute(
+            """
+            DELETE FROM groups_users
+            WHERE group_id = ? AND user_id = ?
+            """,
+            (group_id, user_id),
+        )
+        if cursor.rowcount == 0:
+            return False
+        # the group's posts leave the former member's feed, except their own
+        await self._execute(
+            """
+            DELETE FROM timelines
+            WHERE user_id = ? AND group_id = ? AND via_group AND author_id != ?
+            """,
+            (user_id, group_id, user_id),
+        )
+        await _mark_stale(self.db, [user_id])
+        return True
+
+    async def shared_counts(self, user_ids: list[int]) -> dict[int, dict[int, int]]:
+        shared = {user_id: {} for user_id in user_ids}
+        for chunk in _chunks(list(shared)):
+            rows = await self.db.fetchall(
+                f"""
+                SELECT mine.user_id, theirs.user_id, COUNT(*)
+                FROM groups_users mine
+                JOIN groups_users theirs ON theirs.group_id = mine.group_id
+                WHERE mine.user_id IN ({_marks(chunk)})
+                  AND theirs.user_id != mine.user_id
+                GROUP BY mine.user_id, theirs.user_id
+                """,
+                tuple(chunk),
+                row_factory=_plain_row,
+            )
+            for user_id, other_id, count in rows:
+                shared[user_id][other_id] = count
+        return shared
+
+
+# Timeline deliveries of one post, in the directory: to the author, and to
+# the author's accepted friends or, for group posts, the group's members
+DELIVER_TO_FRIENDS = """
+    INSERT OR IGNORE INTO timelines
+        (user_id, post_id, author_id, group_id, via_group)
+    SELECT ?, ?, ?, ?, 0
+    UNION ALL
+    SELECT user_high, ?, user_low, ?, 0 FROM friends
+    WHERE user_low = ? AND status = 'accepted'
+    UNION ALL
+    SELECT user_low, ?, user_high, ?, 0 FROM friends
+    WHERE user_high = ? AND status = 'accepted'
+"""
+DELIVER_TO_GROUP = """
+    INSERT OR IGNORE INTO timelines
+        (user_id, post_id, author_id, group_id, via_group)
+    SELECT ?, ?, ?, ?, 1
+    UNION ALL
+    SELECT user_id, ?, ?, group_id, 1 FROM groups_users WHERE group_id = ?
+"""
+DELIVER_TO_AUTHOR = """
+    INSERT OR IGNORE INTO timelines
+        (user_id, post_id, author_id, group_id, via_group)
+    VALUES (?, ?, ?, ?, ?)
+"""
+POST_AUDIENCE = "SELECT user_id, visibility, group_id FROM posts WHERE id = ?"
+FEED_COLUMNS = "p.id, p.user_id, p.post_type, p.content, p.visibility, p.group_id"
+# no post id is larger, so "below it" is the first page
+NEWEST = 2**63 - 1
+# the pulled authors among the reader's friends, with their home shards,
+# and the reader's pulled groups
+PULLED_SOURCES = """
+    SELECT 'author', a.user_id, u.shard FROM pulled_authors a
+    JOIN users u ON u.id = a.user_id
+    WHERE a.user_id IN (
+        SELECT user_high FROM friends WHERE user_low = ? AND status = 'accepted'
+        UNION ALL
+        SELECT user_low FROM friends WHERE user_high = ? AND status = 'accepted'
+    )
+    UNION ALL
+    SELECT 'group', g.group_id, NULL FROM groups_users m
+    JOIN pulled_groups g ON g.group_id = m.group_id
+    WHERE m.user_id = ?
+"""
+# The newest posts below the cursor of the pulled authors, and of the pulled
+# groups: a range of idx_posts_user per author (idx_posts_group per group),
+# merged by SQLite's sorter, which keeps only the page's worth of rows. The
+# CROSS JOIN keeps the group's posts, not the shard's users, the outer loop.
+PULLED_POSTS = f"""
+    SELECT * FROM (
+        SELECT 'author', {FEED_COLUMNS} FROM posts p
+        WHERE p.user_id IN (SELECT value FROM json_each(?))
+            AND p.visibility != 'group' AND p.id < ?
+        ORDER BY p.id DESC
+        LIMIT ?
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'group', {FEED_COLUMNS} FROM posts p
+        CROSS JOIN users u ON u.id = p.user_id{{owner}}
+        WHERE p.group_id IN (SELECT value FROM json_each(?))
+            AND p.visibility = 'group' AND p.id < ?
+        ORDER BY p.id DESC
+        LIMIT ?
+    )
+    ORDER BY 1, 2 DESC
+"""
+
+
+def _delivery(author_id: int, post_id: int, visibility: str, group_id) -> tuple:
+    if visibility == "group":
+        return DELIVER_TO_GROUP, (
+            *(author_id, post_id, author_id, group_id),
+            *(post_id, author_id, group_id),
+        )
+    return DELIVER_TO_FRIENDS, (
+        *(author_id, post_id, author_id, group_id),
+        *(post_id, group_id, author_id) * 2,
+    )
+
+
+class SqlitePostRepository(_SqliteRepository, PostRepository):
+    async def create(
+        self,
+        user_id: int,
+        post_type: str,
+        content: str,
+        visibility: str,
+        group_id: Optional[int],
+        tags: list[str] = (),
+    ) -> int:
+        # tags are global and written first: the directory is always locked
+        # before a shard
+        tag_ids = await self._tag_ids(tags) if tags else {}
+
+        index = await self.shards.user_shard(user_id)
+        shard = self.shards.session(index)
+        await self.shards.require_group(index, group_id)
+        # the timelines are written after the post, whose id they need
+        await self.db.take_writer()
+        cursor = await self._execute(
+            """
+            INSERT INTO posts (id, user_id, post_type, content, visibility, group_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                await self.shards.next_id(index, "posts"),
+                user_id,
+                post_type,
+                content,
+                visibility,
+                group_id,
+            ),
+            session=shard,
+        )
+        post_id = cursor.lastrowid
+        self.shards.posts[post_id] = index
+
+        if tags:
+            # one statement however many tags, linked in the order given
+            await self._executemany(
+                "INSERT INTO posts_tags (post_id, tags_id) VALUES (?, ?)",
+                [(post_id, tag_ids[tag]) for tag in tags],
+                session=shard,
+            )
+        await self._deliver(user_id, post_id, visibility, group_id)
+        return post_id
+
+    async def _tag_ids(self, contents: list[str]) -> dict:
+        contents = list(dict.fromkeys(contents))
+        await self._executemany(
+            """
+            INSERT INTO tags (content)
+            SELECT ? WHERE NOT EXISTS (SELECT 1 FROM tags WHERE content = ?)
+            """,
+            [(content, content) for content in contents],
+        )
+        tag_ids = {}
+        for chunk in _chunks(contents):
+            rows = await self.db.fetchall(
+                f"""
+                SELECT content, MIN(id) FROM tags
+                WHERE content IN ({_marks(chunk)})
+                GROUP BY content
+                """,
+                tuple(chunk),
+                row_factory=_plain_row,
+            )
+            tag_ids.update(rows)
+        return tag_ids
+
+    async def get(self, post_id: int) -> Optional[dict]:
+        if self.shards.count == 1:
+            return await self._fetchone("SELECT * FROM posts WHERE id = ?", (post_id,))
+
+        row = await self.shards.find(self.shards.posts, post_id, OWNED_POST, (post_id,))
+        return dict(row) if row is not None else None
+
+    async def update(
+        self,
+        post_id: int,
+        content: Optional[str] = None,
+        visibility: Optional[str] = None,
+    ) -> None:
+        index = await self.shards.post_shard(post_id)
+        if index is None:
+            return
+        shard = self.shards.session(index)
+        if visibility is not None:
+            # switching between group and friends delivery redelivers the
+            # post; public and friends posts reach the same timelines
+            post = await shard.fetchone(POST_AUDIENCE, (post_id,))
+            if post is not None and (post["visibility"] == "group") != (
+                visibility == "group"
+            ):
+                await self._undeliver(post["user_id"], post_id)
+                await self._deliver(
+                    post["user_id"], post_id, visibility, post["group_id"]
+                )
+        if content is not None:
+            await self._execute(
+                "UPDATE posts SET content = ? WHERE id = ?",
+                (content, post_id),
+                session=shard,
+            )
+        if visibility is not None:
+            await self._execute(
+                "UPDATE posts SET visibility = ? WHERE id = ?",
+                (visibility, post_id),
+                session=shard,
+            )
+
+    async def delete(self, post_id: int) -> None:
+        index = await self.shards.post_shard(post_id)
+        if index is None:
+            return
+        shard = self.shards.session(index)
+        post = await shard.fetchone(POST_AUDIENCE, (post_id,))
+        if post is not None:
+            await self._undeliver(post["user_id"], post_id)
+        await self._execute("DELETE FROM posts WHERE id = ?", (post_id,), session=shard)
+
+    async def _deliver(
+        self, author_id: int, post_id: int, visibility: str, group_id: Optional[int]
+    ) -> None:
+        # Fan-out on write, one statement for every reader. Past
+        # fanout.PUSH_LIMIT readers only the author's timeline gets the
+        # post, and the author, or the group, is marked as pulled instead.
+        via_group = visibility == "group"
+        if via_group:
+            row = await self.db.fetchone(
+                "SELECT COUNT(*) AS members FROM groups_users WHERE group_id = ?",
+                (group_id,),
+            )
+            audience = row["members"]
+        else:
+            audience = (await _friend_graph(self.db)).count(author_id)
+
+        if fanout.pushed(audience):
+            await self._execute(*_delivery(author_id, post_id, visibility, group_id))
+            return
+        await self._execute(
+            DELIVER_TO_AUTHOR, (author_id, post_id, author_id, group_id, via_group)
+        )
+        if via_group:
+            await self._execute(
+                "INSERT OR IGNORE INTO pulled_groups (group_id) VALUES (?)",
+                (group_id,),
+            )
+        else:
+            await self._execute(
+                "INSERT OR IGNORE INTO pulled_authors (user_id) VALUES (?)",
+                (author_id,),
+            )
+
+    async def _undeliver(self, author_id: int, post_id: int) -> None:
+        await self._execute(
+            "DELETE FROM timelines WHERE author_id = ? AND post_id = ?",
+            (author_id, post_id),
+        )
+
+    async def feed(
+        self, user_id: int, before: Optional[int] = None, limit: Optional[int] = None
+    ) -> list[FeedPost]:
+        # The pushed posts are read from the timeline, the pulled ones from
+        # their authors' and groups' streams, and the streams are merged
+        # newest first (fan-out on read)
+        before = NEWEST if before is None else before
+        sources = await self.db.fetchall(
+            PULLED_SOURCES, (user_id, user_id, user_id), row_factory=_plain_row
+        )
+        timeline = await self._timeline(user_id, before, limit)
+        if not sources:
+            return timeline
+        streams = await self._pulled(
+            [(source, shard) for kind, source, shard in sources if kind == "author"],
+            [source for kind, source, _ in sources if kind == "group"],
+            before,
+            limit,
+        )
+        return fanout.merge([timeline, *streams], limit)
+
+    async def _timeline(
+        self, user_id: int, before: int, limit: Optional[int]
+    ) -> list[FeedPost]:
+        # one range of the timeline's primary key, newest first, joined to
+        # the posts by id
+        params = (user_id, before, -1 if limit is None else limit)
+        if self.shards.count == 1:
+            return await self.db.fetchall(
+                f"""
+                SELECT {FEED_COLUMNS}
+                FROM timelines t
+                JOIN posts p ON p.id = t.post_id
+                WHERE t.user_id = ? AND t.post_id < ?
+                ORDER BY t.post_id DESC
+                LIMIT ?
+                """,
+                params,
+                row_factory=FeedPost.from_row,
+            )
+
+        # the page's post ids come from the directory, the posts from their
+        # authors' shards
+        delivered = await self.db.fetchall(
+            """
+            SELECT post_id, author_id FROM timelines
+            WHERE user_id = ? AND post_id < ?
+            ORDER BY post_id DESC
+            LIMIT ?
+            """,
+            params,
+            row_factory=_plain_row,
+        )
+        await self.shards.load_users([author_id for _, author_id in delivered])
+        by_shard = defaultdict(list)
+        for post_id, author_id in delivered:
+            by_shard[self.shards.users[author_id]].append(post_id)
+        per_shard = await asyncio.gather(
+            *(
+                self.shards.session(index).fetchall(
+                    f"""
+                    SELECT {FEED_COLUMNS} FROM posts p
+                    WHERE p.id IN (SELECT value FROM json_each(?))
+                    """,
+                    (json.dumps(post_ids),),
+                    row_factory=FeedPost.from_row,
+                )
+                for index, post_ids in by_shard.items()
+            )
+        )
+        posts = {post.id: post for rows in per_shard for post in rows}
+        return [posts[post_id] for post_id, _ in delivered if post_id in posts]
+
+    async def _pulled(
+        self, authors: list[tuple[int, int]], group_ids: list[int], before: int, limit
+    ) -> list[list[FeedPost]]:
+        # one statement per shard, for a stream of its pulled authors' posts
+        # and one of its pulled groups' posts: an author's posts are on the
+        # author's shard, a group's on every shard
+        limit = -1 if limit is None else limit
+        groups = json.dumps(group_ids)
+        if self.shards.count == 1:
+            queries = [
+                (
+                    self.db,
+                    PULLED_POSTS.format(owner=""),
+                    (
+                        json.dumps([author_id for author_id, _ in authors]),
+                        *(before, limit, groups, before, limit),
+                    ),
+                )
+            ]
+        else:
+            queries = [
+                (
+                    session,
+                    PULLED_POSTS.format(owner=" AND u.shard = ?"),
+                    (
+                        json.dumps(
+                            [
+                                author_id
+                                for author_id, shard in authors
+                                if shard == session.index
+                            ]
+                        ),
+                        *(before, limit, session.index, groups, before, limit),
+                    ),
+                )
+                for session in self.shards.sessions()
+            ]
+        per_shard = await asyncio.gather(
+            *(
+                session.fetchall(sql, params, row_factory=_plain_row)
+                for session, sql, params in queries
+            )
+        )
+
+        streams = defaultdict(list)
+        for index, rows in enumerate(per_shard):
+            for kind, *post in rows:
+                streams[index, kind].append(FeedPost(*post))
+        return list(streams.values())
+
+
+class SqliteTagRepository(_SqliteRepository, TagRepository):
+    async def for_post(self, post_id: int) -> list[str]:
+        index = await self.shards.post_shard(post_id)
+        if index is None:
+            return []
+        # the tags table is the directory's, attached to every shard
+        rows = await self.shards.session(index).fetchall(
+            """
+            SELECT t.content FROM tags t
+            JOIN posts_tags pt ON t.id = pt.tags_id
+            WHERE pt.post_id = ?
+            """,
+            (post_id,),
+        )
+        return [row["content"] for row in rows]
+
+
+class SqliteMessageRepository(_SqliteRepository, MessageRepository):
+    async def send(self, sender_id: int, receiver_id: int, content: str) -> None:
+        index = await self.shards.user_shard(sender_id)
+        await self._execute_batched(
+            "INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+            (sender_id, receiver_id, content),
+            session=self.shards.session(index),
+        )
+
+    async def conversation(self, user_id: int, other_id: int) -> list[ChatMessage]:
+        # messages are stored with their sender, so a conversation spans the
+        # home shards of both users
+        await self.shards.load_users([user_id, other_id])
+        mine = await self.shards.user_shard(user_id)
+        theirs = await self.shards.user_shard(other_id)
+
+        if mine == theirs:
+            return await self.shards.session(mine).fetchall(
+                """
+                SELECT m.content, m.timestamp, u.name as sender_name
+                FROM messages m
+                JOIN users u ON m.sender_id = u.id
+                WHERE (m.sender_id = ? AND m.receiver_id = ?)
+                   OR (m.sender_id = ? AND m.receiver_id = ?)
+                ORDER BY m.timestamp ASC, m.id ASC
+                """,
+                (user_id, other_id, other_id, user_id),
+                row_factory=ChatMessage.from_row,
+            )
+
+        sql = """
+            SELECT m.content, m.timestamp, u.name as sender_name
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.sender_id = ? AND m.receiver_id = ?
+            ORDER BY m.timestamp ASC, m.id ASC
+        """
+        sent, received = await asyncio.gather(
+            self.shards.session(mine).fetchall(
+                sql, (user_id, other_id), row_factory=ChatMessage.from_row
+            ),
+            self.shards.session(theirs).fetchall(
+                sql, (other_id, user_id), row_factory=ChatMessage.from_row
+            ),
+        )
+        return list(heapq.merge(sent, received, key=attrgetter("timestamp")))
+
+
+VISIBLE_STORIES = """
+    SELECT
+        s.id,
+        s.content,
+        s.timestamp,
+        s.visibility,
+        s.uploader_id,
+        u.name as uploader_name,
+        u.profile_image
+    FROM stories s
+    JOIN users u ON s.uploader_id = u.id{owner}
+    WHERE
+        s.timestamp > datetime('now', '-1 day')
+        AND (
+            s.uploader_id = ?
+            OR s.visibility = 'public'
+            OR (s.visibility = 'friends'
+                AND s.uploader_id IN (SELECT value FROM json_each(?)))
+            OR (s.visibility = 'group' AND EXISTS (
+                SELECT 1 FROM groups_users gu
+                WHERE gu.group_id = s.group_id AND gu.user_id = ?
+            ))
+        )
+    ORDER BY s.timestamp DESC
+"""
+
+
+class SqliteStoryRepository(_SqliteRepository, StoryRepository):
+    async def create(
+        self,
+        uploader_id: int,
+        content: str,
+        visibility: str,
+        group_id: Optional[int],
+    ) -> int:
+        index = await self.shards.user_shard(uploader_id)
+        await self.shards.require_group(index, group_id)
+        cursor = await self._execute(
+            """
+            INSERT INTO stories (id, uploader_id, content, visibility, group_id)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                await self.shards.next_id(index, "stories"),
+                uploader_id,
+                content,
+                visibility,
+                group_id,
+            ),
+            session=self.shards.session(index),
+        )
+        self.shards.stories[cursor.lastrowid] = index
+        return cursor.lastrowid
+
+    async def get_uploader(self, story_id: int) -> Optional[int]:
+        if self.shards.count == 1:
+            row = await self.db.fetchone(
+                "SELECT uploader_id FROM stories WHERE id = ?", (story_id,)
+            )
+        else:
+            row = await self.shards.find(
+                self.shards.stories, story_id, OWNED_STORY, (story_id,)
+            )
+        return row["uploader_id"] if row is not None else None
+
+    async def delete(self, story_id: int) -> None:
+        index = await self.shards.story_shard(story_id)
+        if index is None:
+            return
+        await self._execute(
+            "DELETE FROM stories WHERE id = ?",
+            (story_id,),
+            session=self.shards.session(index),
+        )
+
+    async def visible_to(self, viewer_id: Optional[int]) -> list[Story]:
+        # the viewer's friends come from the friend graph and travel to every
+        # shard as one JSON array parameter
+        graph = await _friend_graph(self.db, current=True)
+        friend_ids = json.dumps(list(graph.friends_of(viewer_id)))
+        params = (viewer_id, friend_ids, viewer_id)
+        if self.shards.count == 1:
+            return await self.db.fetchall(
+                VISIBLE_STORIES.format(owner=""),
+                params,
+                row_factory=Story.from_row,
+            )
+
+        # every shard answers for the uploaders homed on it; the newest-first
+        # lists are merged into one
+        per_shard = await asyncio.gather(
+            *(
+                session.fetchall(
+                    VISIBLE_STORIES.format(owner=" AND u.shard = ?"),
+                    (session.index, *params),
+                    row_factory=Story.from_row,
+                )
+                for session in self.shards.sessions()
+            )
+        )
+        for index, stories in enumerate(per_shard):
+            for story in stories:
+                self.shards.stories[story.id] = index
+        return list(heapq.merge(*per_shard, key=attrgetter("timestamp"), reverse=True))
+
+
+class SqliteReactionRepository(_SqliteRepository, ReactionRepository):
+    async def add(self, user_id: int, story_id: int, emoji: str) -> None:
+        # reactions are stored with their story, so counting them never
+        # leaves the story's shard
+        index = await self.shards.story_shard(story_id)
+        if index is None:
+            raise StorageError("FOREIGN KEY constraint failed")
+        await self._execute_batched(
+            """
+            INSERT INTO stories_reaction (user_id, story_id, emoji)
+            VALUES (?, ?, ?)
+            """,
+            (user_id, story_id, emoji),
+            session=self.shards.session(index),
+        )
+
+    async def counts(self, story_ids: list[int]) -> dict[int, list[ReactionCount]]:
+        counts = {story_id: [] for story_id in story_ids}
+        by_shard = {}
+        for story_id in counts:
+            # stories not seen in this request are looked for everywhere
+            index = self.shards.stories.get(
+                story_id, 0 if self.shards.count == 1 else None
+            )
+            shards = range(self.shards.count) if index is None else (index,)
+            for shard in shards:
+                by_shard.setdefault(shard, []).append(story_id)
+
+        async def count_on(index: int, ids: list) -> list:
+            rows = []
+            for chunk in _chunks(ids):
+                rows += await self.shards.session(index).fetchall(
+                    f"""
+                    SELECT story_id, emoji, COUNT(*) as count
+                    FROM stories_reaction
+                    WHERE story_id IN ({_marks(chunk)})
+                    GROUP BY story_id, emoji
+                    """,
+                    tuple(chunk),
+                    row_factory=_plain_row,
+                )
+            return rows
+
+        per_shard = await asyncio.gather(
+            *(count_on(index, ids) for index, ids in sorted(by_shard.items()))
+        )
+        for rows in per_shard:
+            for story_id, emoji, count in rows:
+                counts[story_id].append(ReactionCount(emoji, count))
+        return counts
+
+
+class SqliteSuggestionRepository(_SqliteRepository, SuggestionRepository):
+    async def mark_stale(self, user_ids: list[int]) -> None:
+        await _mark_stale(self.db, user_ids)
+
+    async def claim(self, limit: int) -> list[int]:
+        # the delete takes the write lock before the rows are chosen, so
+        # concurrent workers, in this process or another, claim in turn
+        await self.db.take_writer()
+        try:
+            rows = await self.db.fetchall(
+                """
+                DELETE FROM suggestion_queue
+                WHERE id IN (SELECT id FROM suggestion_queue ORDER BY id LIMIT ?)
+                RETURNING id, user_id
+                """,
+                (limit,),
+                row_factory=_plain_row,
+            )
+        except sqlite3.Error as e:
+            raise _storage_error(e) from e
+        return [user_id for _, user_id in sorted(rows)]
+
+    async def replace(self, ranked: dict[int, list[tuple[int, int, int]]]) -> None:
+        for chunk in _chunks(list(ranked)):
+            await self._execute(
+                f"DELETE FROM friend_suggestions WHERE user_id IN ({_marks(chunk)})",
+                tuple(chunk),
+            )
+        await self._executemany(
+            """
+            INSERT INTO friend_suggestions
+                (user_id, rank, candidate_id, mutual_friends, shared_groups)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (user_id, rank, *suggestion)
+                for user_id, suggestions in ranked.items()
+                for rank, suggestion in enumerate(suggestions, 1)
+            ],
+        )
+
+    async def for_user(self, user_id: int) -> list[Suggestion]:
+        suggestions = await self.db.fetchall(
+            """
+            SELECT s.candidate_id, u.name, s.mutual_friends, s.shared_groups
+            FROM friend_suggestions s
+            JOIN users u ON u.id = s.candidate_id
+            WHERE s.user_id = ?
+            ORDER BY s.rank
+            """,
+            (user_id,),
+            row_factory=Suggestion.from_row,
+        )
+        # friends accepted since the last refresh are left out
+        graph = await _friend_graph(self.db, current=True)
+        return [s for s in suggestions if not graph.are_friends(user_id, s.id)]
+
+
+class SqliteRepositories(Repositories):
+    def __init__(self, db: AsyncSession):
+        shards = ShardRouter(db)
+        self.users = SqliteUserRepository(db, shards)
+        self.friends = SqliteFriendRepository(db, shards)
+        self.groups = SqliteGroupRepository(db, shards)
+        self.posts = SqlitePostRepository(db, shards)
+        self.tags = SqliteTagRepository(db, shards)
+        self.messages = SqliteMessageRepository(db, shards)
+        self.stories = SqliteStoryRepository(db, shards)
+        self.reactions = SqliteReactionRepository(db, shards)
+        self.suggestions = SqliteSuggestionRepository(db, shards)
@@ -0,0 +1,36 @@
+import json
+from typing import Any
+from fastapi.responses import JSONResponse
+from records import Record
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised by monkeypatching in tests
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    # orjson serializes slotted dataclasses natively; the stdlib fallback
+    # converts one record at a time as the encoder reaches it
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    # Return an instance of this class from a handler to skip FastAPI's
+    # jsonable_encoder pass; the content is serialized once, here.
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
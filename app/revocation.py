@@ -0,0 +1,53 @@
+import os
+import time
+
+REFRESH_INTERVAL = float(os.environ.get("SOCIAL_MEDIA_REVOCATION_REFRESH", "0"))
+
+
+class RevocationList:
+    # Ids of users whose tokens must no longer be accepted, for auth modes
+    # that trust the signed token claims instead of loading the user. At
+    # most once per refresh interval (by default on every check) the rows
+    # in revoked_users are counted, and the ids are reloaded only when that
+    # count differs from the set's size, so revocations made by other
+    # processes arrive within the interval; revocations made by this
+    # process apply once they commit. User ids are never reused, so entries
+    # are never removed and the set only ever holds committed rows.
+    def __init__(
+        self, refresh_interval: float = REFRESH_INTERVAL, clock=time.monotonic
+    ):
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._revoked = frozenset()
+        self._loaded_at = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._revoked
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def add(self, user_ids) -> None:
+        self._revoked = self._revoked | frozenset(user_ids)
+
+    def clear(self) -> None:
+        self._revoked = frozenset()
+        self._loaded_at = None
+
+    async def refresh(self, users) -> None:
+        now = self._clock()
+        if (
+            self._loaded_at is not None
+            and now - self._loaded_at < self.refresh_interval
+        ):
+            return
+
+        # claimed before the query runs, so concurrent requests do not all
+        # reload at once
+        first = self._loaded_at is None
+        self._loaded_at = now
+        if first or await users.revoked_count() != len(self._revoked):
+            self.add(await users.revoked_ids())
+
+
+revocations = RevocationList()
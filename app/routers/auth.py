@@ -1,87 +1,103 @@
-import sqlite3
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from database import get_db_connection
 from models import UserRegister, Role
-from utils import create_access_token
+from passwords import PasswordHasherBusy, hasher
+from ratelimit import limit_login
+from repositories import ConflictError, Repositories, StorageError, get_repositories
+from user_import import UserImporter, ndjson_lines
+from utils import create_access_token, get_current_user
 
 router = APIRouter(tags=["Authentication"])
 
 
-@router.post("/auth/register")
-def register(user: UserRegister):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many passwords being hashed, try again shortly",
+        headers={"Retry-After": "1"},
+    )
 
-    cursor.execute("SELECT id FROM users WHERE name = ?", (user.name,))
-    if cursor.fetchone():
-        conn.close()
-        raise HTTPException(status_code=400, detail="Username taken")
 
-    if user.role == Role.ADMIN:
-        cursor.execute("SELECT id FROM users WHERE role = 'admin'")
-        admin_user_row = cursor.fetchone()
+@router.post("/auth/register")
+async def register(user: UserRegister, repos: Repositories = Depends(get_repositories)):
+    try:
+        password = await hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise _busy()
 
-        if admin_user_row is not None:
-            conn.close()
+    if user.role == Role.ADMIN:
+        # users stay locked until this request commits, so no other admin
+        # can be registered in between
+        await repos.users.lock()
+        if await repos.users.admin_exists():
             raise HTTPException(
                 status_code=422,
                 detail="An admin user already exists. You cannot register as admin.",
             )
+
+    # the name is not looked up first: a read made before the hash is stale
+    # by the time the row is written, so the unique index on users(name)
+    # decides
     try:
-        cursor.execute(
-            """
-                INSERT INTO users (name, password, role, profile_image)
-                VALUES (?, ?, ?, ?)
-            """,
-            (user.name, user.password, user.role.value, None),
-        )
-
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.close()
+        await repos.users.create(user.name, password, user.role.value)
+    except ConflictError:
+        raise HTTPException(status_code=400, detail="Username taken")
+    except StorageError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
-    conn.close()
-
     return {
         "message": f"User {user.name} created successfully with role {user.role.value}"
     }
 
 
-@router.post("/auth/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+@router.post("/auth/login", dependencies=[Depends(limit_login)])
+async def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    repos: Repositories = Depends(get_repositories),
+):
+    user = await repos.users.get_by_name(form_data.username)
 
-    cursor.execute("SELECT * FROM users WHERE name = ?", (form_data.username,))
-    user = cursor.fetchone()
-
-    if not user or form_data.password != dict(user)["password"]:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Invalid credentials")
-
-    conn.close()
+    try:
+        # an unknown name costs the same hashing as a wrong password
+        stored = user["password"] if user else await hasher.dummy_hash()
+        if not await hasher.verify(form_data.password, stored) or not user:
+            raise HTTPException(status_code=400, detail="Invalid credentials")
+
+        # plaintext rows and hashes at an old cost are upgraded while the
+        # password is at hand
+        if hasher.needs_rehash(user["password"]):
+            password = await hasher.hash(form_data.password)
+            await repos.users.set_password(user["id"], password)
+    except PasswordHasherBusy:
+        raise _busy()
 
     access_token = create_access_token(
         data={
-            "sub": dict(user)["name"],
-            "user_id": dict(user)["id"],
-            "role": dict(user)["role"],
+            "sub": user["name"],
+            "user_id": user["id"],
+            "role": user["role"],
         }
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.delete("/force-delete-user")
-def force_delete_user(name: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@router.post("/auth/import-users")
+async def import_users(request: Request, current_user=Depends(get_current_user)):
+    # Body: NDJSON, one {"name", "password" or "password_hash", "role"} per
+    # line, read as it streams in. Rows that fail are listed by line number;
+    # the rest are created in batches, each committed on its own.
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can import users")
 
-    cursor.execute("DELETE FROM users WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
+    try:
+        return await UserImporter().run(ndjson_lines(request.stream()))
+    except StorageError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+
+@router.delete("/force-delete-user")
+async def force_delete_user(name: str, repos: Repositories = Depends(get_repositories)):
+    await repos.users.delete_by_name(name)
 
     return {"message": f"ЧАО! Потребител '{name}' беше изтрит завинаги."}
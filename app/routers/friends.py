@@ -1,62 +1,54 @@
-import sqlite3
-from fastapi import APIRouter, HTTPException, Depends
-from database import get_db_connection
-from models import FriendRequestAction
+from typing import Optional
+from fastapi import APIRouter, Body, HTTPException, Depends, Query
+from models import FriendRequestAction, FriendRequestDecision, FriendRequestDirection
+from ratelimit import limit_user
+from repositories import Repositories, get_repositories
+from responses import FastJSONResponse
+from suggestions import TOP_K
 from utils import get_current_user
 
-
 router = APIRouter()
 
-
-@router.post("/send-friend-request")
-def send_friend_request(
-    receiver_id: int, current_user: dict = Depends(get_current_user)
+MAX_PAGE_SIZE = 500
+# decisions one /respond-friend-requests call may carry
+MAX_BULK_RESPONSES = 5000
+RESPONDED = {
+    FriendRequestAction.ACCEPT: "accepted",
+    FriendRequestAction.DECLINE: "declined",
+}
+# friendships between two users beyond which /connection-path gives up
+MAX_PATH_DEPTH = 6
+
+
+@router.post(
+    "/send-friend-request", dependencies=[Depends(limit_user("send_friend_request"))]
+)
+async def send_friend_request(
+    receiver_id: int,
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
 ):
     sender_id = current_user["id"]
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute(
-            """
-        INSERT INTO friends (user_id, friend_id, status)
-        VALUES (?,?, 'pending')
-    """,
-            (sender_id, receiver_id),
-        )
-        conn.commit()
+    if await repos.friends.send_request(sender_id, receiver_id):
         msg = "Request sent successfully"
-    except sqlite3.IntegrityError:
+    else:
         msg = "Friend request already sent or you are already friends"
 
-    conn.close()
     return {"message": msg}
 
 
 @router.post("/respond-friend-request")
-def respond_friend_request(
+async def respond_friend_request(
     sender_id: int,
     action: FriendRequestAction,
     current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
 ):
     my_id = current_user["id"]
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     if action == FriendRequestAction.ACCEPT:
-        cursor.execute(
-            """
-            UPDATE friends 
-            SET status = 'accepted' 
-            WHERE user_id = ? AND friend_id = ? AND status = 'pending'
-        """,
-            (sender_id, my_id),
-        )
-
-        if cursor.rowcount == 0:
-            conn.close()
+        if not await repos.friends.accept(sender_id, my_id):
             raise HTTPException(
                 status_code=404, detail="No pending request found to accept"
             )
@@ -64,71 +56,159 @@ def respond_friend_request(
         msg = "Friend request accepted"
 
     elif action == FriendRequestAction.DECLINE:
-        cursor.execute(
-            """
-            DELETE FROM friends 
-            WHERE user_id = ? AND friend_id = ? AND status = 'pending'
-        """,
-            (sender_id, my_id),
-        )
-
-        if cursor.rowcount == 0:
-            conn.close()
+        if not await repos.friends.decline(sender_id, my_id):
             raise HTTPException(
                 status_code=404, detail="No pending request found to decline"
             )
 
         msg = "Friend request declined"
 
-    conn.commit()
-    conn.close()
     return {"message": msg}
 
 
-@router.get("/get-my-friends/{user_id}")
-def get_my_friends(current_user: dict = Depends(get_current_user)):
-    user_id = current_user["id"]
+@router.post("/respond-friend-requests", response_class=FastJSONResponse)
+async def respond_friend_requests(
+    decisions: list[FriendRequestDecision] = Body(max_length=MAX_BULK_RESPONSES),
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # Accepts and declines many requests in one transaction. Each decision
+    # gets a result: "accepted", "declined", or "not_found" when there was
+    # no pending request from that sender (or it was answered earlier in
+    # the same call).
+    found = await repos.friends.respond_many(
+        current_user["id"],
+        [
+            (decision.sender_id, decision.action == FriendRequestAction.ACCEPT)
+            for decision in decisions
+        ],
+    )
+    results = []
+    counts = {"accepted": 0, "declined": 0}
+    for decision, was_found in zip(decisions, found):
+        result = RESPONDED[decision.action] if was_found else "not_found"
+        if was_found:
+            counts[result] += 1
+        results.append({"sender_id": decision.sender_id, "result": result})
+    return FastJSONResponse({**counts, "results": results})
+
+
+@router.get("/friend-requests", response_class=FastJSONResponse)
+async def list_friend_requests(
+    direction: FriendRequestDirection = FriendRequestDirection.INCOMING,
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # The caller's pending requests, received or sent, paged by the other
+    # user's id like /get-my-friends
+    requests = await repos.friends.list_pending(
+        current_user["id"], direction == FriendRequestDirection.INCOMING, after, limit
+    )
+    next_cursor = requests[-1].id if len(requests) == limit else None
+    return FastJSONResponse({"requests": requests, "next_cursor": next_cursor})
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute(
-        """
-        SELECT u.id, u.name 
-        FROM users u
-        JOIN friends f ON (u.id = f.friend_id OR u.id = f.user_id)
-        WHERE (f.user_id = ? OR f.friend_id = ?) 
-          AND f.status = 'accepted'
-          AND u.id != ?
-    """,
-        (user_id, user_id, user_id),
-    )
+async def _require_friend_list(
+    repos: Repositories, current_user: dict, user_id: int
+) -> None:
+    # another user's friends are visible to that user's friends and to admins
+    viewer_id = current_user["id"]
+    if user_id != viewer_id and current_user["role"] != "admin":
+        if not await repos.friends.are_friends(viewer_id, user_id):
+            raise HTTPException(
+                status_code=403, detail="Only friends can see this friend list"
+            )
 
-    friends = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return {"friends": friends}
 
+@router.get("/get-my-friends/{user_id}", response_class=FastJSONResponse)
+async def get_my_friends(
+    user_id: int,
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    prefix: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # Friends of user_id in id order, a page at a time: pass the returned
+    # next_cursor as `after` for the next page.
+    await _require_friend_list(repos, current_user, user_id)
+    friends = await repos.friends.list_friends(user_id, after, limit, prefix or None)
+    next_cursor = friends[-1].id if len(friends) == limit else None
+    return FastJSONResponse(
+        {
+            "friends": friends,
+            "total": await repos.friends.count(user_id),
+            "next_cursor": next_cursor,
+        }
+    )
 
-@router.delete("/remove-friend")
-def remove_friend(friend_id: int, current_user: dict = Depends(get_current_user)):
-    my_id = current_user["id"]
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@router.get("/mutual-friends", response_class=FastJSONResponse)
+async def mutual_friends(
+    other_id: int,
+    limit: int = Query(20, ge=0, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # how many friends the caller shares with other_id, and the first
+    # `limit` of them in id order; limit=0 is just the count
+    await _require_friend_list(repos, current_user, other_id)
+    mutual = await repos.friends.mutual_ids(current_user["id"], other_id)
+    return FastJSONResponse(
+        {
+            "count": len(mutual),
+            "mutual_friends": await repos.users.summaries(mutual[:limit]),
+        }
+    )
+
 
-    cursor.execute(
-        """
-        DELETE FROM friends 
-        WHERE (user_id = ? AND friend_id = ?) 
-           OR (user_id = ? AND friend_id = ?)
-    """,
-        (my_id, friend_id, friend_id, my_id),
+@router.get("/connection-path", response_class=FastJSONResponse)
+async def connection_path(
+    other_id: int,
+    max_depth: int = Query(MAX_PATH_DEPTH, ge=1, le=MAX_PATH_DEPTH),
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # A shortest chain of friendships from the caller to other_id. Only the
+    # users the caller could find through friend lists are named: their
+    # friends and their friends' friends (and other_id, whom they asked
+    # about). Hops further out are null, except for admins.
+    path = await repos.friends.connection_path(current_user["id"], other_id, max_depth)
+    if path is None:
+        raise HTTPException(
+            status_code=404, detail=f"No connection within {max_depth} steps"
+        )
+    shown = path if current_user["role"] == "admin" else [*path[:3], other_id]
+    named = {user.id: user for user in await repos.users.summaries(shown)}
+    return FastJSONResponse(
+        {"degrees": len(path) - 1, "path": [named.get(user_id) for user_id in path]}
     )
 
-    if cursor.rowcount == 0:
-        conn.close()
+
+@router.get("/suggested-friends", response_class=FastJSONResponse)
+async def suggested_friends(
+    limit: int = Query(10, ge=1, le=TOP_K),
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # People with the most mutual friends and shared groups, as last
+    # computed by the background job; changes to the friend graph reach
+    # them within a few seconds
+    suggestions = await repos.suggestions.for_user(current_user["id"])
+    return FastJSONResponse({"suggestions": suggestions[:limit]})
+
+
+@router.delete("/remove-friend")
+async def remove_friend(
+    friend_id: int,
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    my_id = current_user["id"]
+
+    if not await repos.friends.remove(my_id, friend_id):
         raise HTTPException(status_code=404, detail="Friendship not found")
 
-    conn.commit()
-    conn.close()
     return {"message": "Friend removed successfully"}
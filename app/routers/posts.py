@@ -1,125 +1,76 @@
-import sqlite3
 from typing import Optional, List
 from fastapi import APIRouter, HTTPException, Depends, Query
-from database import get_db_connection
 from models import PostType, Visibility
+from repositories import Repositories, get_repositories
+from responses import FastJSONResponse
 from utils import get_current_user, get_optional_user
 
 router = APIRouter()
 
+MAX_FEED_PAGE_SIZE = 100
+
 
 @router.post("/create-post")
-def create_post(
+async def create_post(
     post_type: PostType,
     content: str,
     visibility: Visibility,
     group_id: Optional[int] = None,
     tags: list[str] = Query(default=[]),
     current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
 ):
     user_id = current_user["id"]
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # validation to prevent the visibility when it is a group post
     if visibility == Visibility.GROUP and group_id is None:
-        conn.close()
         raise HTTPException(
             status_code=422, detail="Group ID is required for group visibility"
         )
 
-    # adding a post
-    cursor.execute(
-        """
-        INSERT INTO posts (user_id , post_type, content, visibility, group_id)
-        VALUES (?, ?, ?, ?, ?)
-    """,
-        (user_id, post_type.value, content, visibility.value, group_id),
+    # adding a post together with its tags
+    await repos.posts.create(
+        user_id, post_type.value, content, visibility.value, group_id, tags
     )
 
-    new_post = cursor.lastrowid
-
-    for tags_text in tags:
-        cursor.execute(
-            """
-            SELECT id FROM tags WHERE content = ?
-        """,
-            (tags_text,),
-        )
-        existing_tag = cursor.fetchone()
-
-        if existing_tag:
-            tag_id = dict(existing_tag)["id"]
-        else:
-            cursor.execute(
-                """
-                INSERT INTO tags (content) VALUES (?)
-            """,
-                (tags_text,),
-            )
-            tag_id = cursor.lastrowid
-
-        cursor.execute(
-            """
-            INSERT INTO posts_tags (post_id, tags_id) VALUES (?, ?)
-        """,
-            (new_post, tag_id),
-        )
-
-    conn.commit()
-    conn.close()
-
     return {
         "message": f"User {user_id} posted successfully a {post_type.value}",
     }
 
 
 @router.delete("/delete-post")
-def delete_post(post_id: int, current_user: dict = Depends(get_current_user)):
+async def delete_post(
+    post_id: int,
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
 
     user_id = current_user["id"]
     user_role = current_user["role"]
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # validate that the post exists
-    cursor.execute(
-        """
-        SELECT user_id FROM posts WHERE id = ?
-    """,
-        (post_id,),
-    )
-    post_row = cursor.fetchone()
+    post = await repos.posts.get(post_id)
 
-    if post_row is None:
-        conn.close()
+    if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    post_user_id = dict(post_row)["user_id"]
+    post_user_id = post["user_id"]
 
     if user_id != post_user_id and user_role != "admin":
-        conn.close()
         raise HTTPException(
             status_code=403, detail="You are not allowed to delete this post"
         )
-    cursor.execute(
-        """
-                   DELETE FROM posts WHERE id = ?""",
-        (post_id,),
-    )
-    conn.commit()
-    conn.close()
+    await repos.posts.delete(post_id)
 
     return {"message": f"Post {post_id} deleted successfully"}
 
 
 @router.get("/get-post/{post_id}")
-def get_post(post_id: int, current_user: Optional[dict] = Depends(get_optional_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
+async def get_post(
+    post_id: int,
+    current_user: Optional[dict] = Depends(get_optional_user),
+    repos: Repositories = Depends(get_repositories),
+):
     if current_user:
         viewer_id = current_user["id"]
         viewer_role = current_user["role"]
@@ -127,19 +78,11 @@ def get_post(post_id: int, current_user: Optional[dict] = Depends(get_optional_u
         viewer_id = None
         viewer_role = "guest"
 
-    cursor.execute(
-        """
-        SELECT * FROM posts WHERE id = ?
-    """,
-        (post_id,),
-    )
-    post_row = cursor.fetchone()
+    post = await repos.posts.get(post_id)
 
-    if not post_row:
-        conn.close()
+    if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    post = dict(post_row)
     author_id = post["user_id"]
     visibility = post["visibility"]
     group_id = post["group_id"]
@@ -152,24 +95,14 @@ def get_post(post_id: int, current_user: Optional[dict] = Depends(get_optional_u
     # validate that that only friends can see it
     elif visibility == "friends":
         if viewer_role == "guest":
-            conn.close()
             raise HTTPException(
                 status_code=403, detail="Guests cannot view friends-only posts"
             )
 
         # validate if they are friends
-        cursor.execute(
-            """
-                        SELECT 1 FROM friends 
-                        WHERE ((user_id = ? AND friend_id = ?) 
-                        OR (user_id = ? AND friend_id = ?))
-                        AND status = 'accepted'
-                    """,
-            (author_id, viewer_id, viewer_id, author_id),
-        )
+        friendship = await repos.friends.are_friends(author_id, viewer_id)
 
-        if not cursor.fetchone():
-            conn.close()
+        if not friendship:
             raise HTTPException(
                 status_code=403, detail="You must be a friend to view this post"
             )
@@ -177,97 +110,68 @@ def get_post(post_id: int, current_user: Optional[dict] = Depends(get_optional_u
     elif visibility == "group":
 
         if viewer_role == "guest":
-            conn.close()
             raise HTTPException(
                 status_code=403, detail="Guests cannot view group posts"
             )
 
         if not group_id:
-            conn.close()
             raise HTTPException(
                 status_code=500, detail="Invalid post data: Missing group ID"
             )
 
         # validate that the viewer is a part of the group
-        cursor.execute(
-            """
-            SELECT 1 FROM groups_users 
-            WHERE group_id = ? AND user_id = ?
-        """,
-            (group_id, viewer_id),
-        )
+        membership = await repos.groups.is_member(group_id, viewer_id)
 
-        if not cursor.fetchone():
-            conn.close()
+        if not membership:
             raise HTTPException(
                 status_code=403,
                 detail="You must be a member of the group to view this post",
             )
 
-    cursor.execute(
-        """
-            SELECT t.content FROM tags t 
-            JOIN posts_tags pt ON t.id = pt.tags_id 
-            WHERE pt.post_id = ?
-        """,
-        (post_id,),
-    )
+    tags_list = await repos.tags.for_post(post_id)
 
-    tags_rows = cursor.fetchall()
-    tags_list = [dict(row)["content"] for row in tags_rows]
+    return {"post_data": post, "tags": tags_list}
 
-    conn.close()
 
-    return {"post_data": post, "tags": tags_list}
+@router.get("/feed", response_class=FastJSONResponse)
+async def feed(
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=MAX_FEED_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+):
+    # The caller's home feed, newest first: their own posts, their friends'
+    # public and friends-only posts and their groups' posts. Pass the
+    # returned next_cursor as `before` for the next page.
+    posts = await repos.posts.feed(current_user["id"], before, limit)
+    next_cursor = posts[-1].id if len(posts) == limit else None
+    return FastJSONResponse({"posts": posts, "next_cursor": next_cursor})
 
 
 @router.put("/update-post/{post_id}")
-def update_post(
+async def update_post(
     post_id: int,
     content: str = None,
     visibility: Visibility = None,
     current_user: dict = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
 ):
     user_id = current_user["id"]
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    post = await repos.posts.get(post_id)
 
-    cursor.execute(
-        """
-        SELECT user_id FROM posts WHERE id = ?
-    """,
-        (post_id,),
-    )
-    post_row = cursor.fetchone()
-
-    if not post_row:
-        conn.close()
+    if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    author_id = dict(post_row)["user_id"]
+    author_id = post["user_id"]
 
     if author_id != user_id:
-        conn.close()
         raise HTTPException(status_code=403, detail="You can only edit your own posts!")
 
-    if content is not None:
-        cursor.execute(
-            """
-            UPDATE posts SET content = ? WHERE id = ?
-    """,
-            (content, post_id),
-        )
-
-    if visibility is not None:
-        cursor.execute(
-            """
-            UPDATE posts SET visibility = ? WHERE id = ?
-    """,
-            (visibility.value, post_id),
-        )
-
-    conn.commit()
-    conn.close()
+    await repos.posts.update(
+        post_id,
+        content=content,
+        visibility=visibility.value if visibility is not None else None,
+    )
 
     return {"message": f"Post {post_id} updated successfully"}
@@ -0,0 +1,237 @@
+import argparse
+import sqlite3
+import sys
+from contextlib import contextmanager
+from database import DATABASE_PATH, SHARDS, lock_exclusive, lock_path, shard_path
+from migrations import migrate_shards
+
+# Moving users is an offline job. A request may read a user's home shard
+# before a move and write there after it, where the row would be lost, and
+# the app's per-request shard routing cannot see the move coming. So moves
+# refuse to start while any app process serves the database.
+
+# Everything a user owns, copied from the attached source shard into the
+# target. Posts and stories keep their ids, which are global; rows only ever
+# addressed through their parent get new local ids.
+COPY_STATEMENTS = [
+    """
+    INSERT INTO posts (id, user_id, post_type, content, visibility, group_id)
+    SELECT id, user_id, post_type, content, visibility, group_id
+    FROM source.posts WHERE user_id = ?
+    """,
+    """
+    INSERT INTO posts_tags (post_id, tags_id)
+    SELECT pt.post_id, pt.tags_id FROM source.posts_tags pt
+    JOIN source.posts p ON p.id = pt.post_id WHERE p.user_id = ?
+    """,
+    """
+    INSERT INTO likes (user_id, post_id)
+    SELECT l.user_id, l.post_id FROM source.likes l
+    JOIN source.posts p ON p.id = l.post_id WHERE p.user_id = ?
+    """,
+    """
+    INSERT INTO comments (user_id, post_id, content)
+    SELECT c.user_id, c.post_id, c.content FROM source.comments c
+    JOIN source.posts p ON p.id = c.post_id WHERE p.user_id = ?
+    """,
+    """
+    INSERT INTO stories (id, uploader_id, content, timestamp, visibility, group_id)
+    SELECT id, uploader_id, content, timestamp, visibility, group_id
+    FROM source.stories WHERE uploader_id = ?
+    """,
+    """
+    INSERT INTO stories_reaction (user_id, story_id, emoji)
+    SELECT r.user_id, r.story_id, r.emoji FROM source.stories_reaction r
+    JOIN source.stories s ON s.id = r.story_id WHERE s.uploader_id = ?
+    """,
+    """
+    INSERT INTO messages (sender_id, receiver_id, content, timestamp)
+    SELECT sender_id, receiver_id, content, timestamp
+    FROM source.messages WHERE sender_id = ?
+    """,
+]
+
+# likes, comments, tag links and reactions go with their parent row
+PURGE_STATEMENTS = [
+    "DELETE FROM posts WHERE user_id = ?",
+    "DELETE FROM stories WHERE uploader_id = ?",
+    "DELETE FROM messages WHERE sender_id = ?",
+]
+
+
+def connect(path: str, index: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(shard_path(path, index))
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def prepare(path: str, shards: int) -> None:
+    connections = [connect(path, index) for index in range(shards)]
+    try:
+        migrate_shards(connections)
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def _purge(conn: sqlite3.Connection, user_id: int) -> None:
+    for sql in PURGE_STATEMENTS:
+        conn.execute(sql, (user_id,))
+
+
+class AppRunning(RuntimeError):
+    pass
+
+
+@contextmanager
+def offline(path: str):
+    # serving processes hold the lock file shared (database.hold_app_lock);
+    # taking it exclusively keeps new ones from starting until the block ends
+    with open(lock_path(path), "a") as lock:
+        try:
+            lock_exclusive(lock)
+        except BlockingIOError:
+            raise AppRunning(
+                f"The app is serving {path}; stop it before moving users"
+            ) from None
+        yield
+
+
+def copy_user(path: str, user_id: int, source: int, target: int) -> None:
+    # Replaces whatever an earlier, interrupted move left on the target, so
+    # copying twice yields the same rows. Nothing reads the copy until the
+    # directory points the user at the target.
+    conn = connect(path, target)
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (shard_path(path, source),))
+        with conn:
+            _purge(conn, user_id)
+            for sql in COPY_STATEMENTS:
+                conn.execute(sql, (user_id,))
+        conn.execute("DETACH DATABASE source")
+    finally:
+        conn.close()
+
+
+def move_user(path: str, shards: int, user_id: int, target: int) -> bool:
+    # raises AppRunning while the app serves the database
+    with offline(path):
+        return _move_user(path, shards, user_id, target)
+
+
+def _move_user(path: str, shards: int, user_id: int, target: int) -> bool:
+    # Copy, switch the directory, then clean up. A crash at any point leaves
+    # the user readable from exactly one shard, and running the move again
+    # finishes it.
+    if not 0 <= target < shards:
+        raise ValueError(f"No such shard: {target}")
+
+    directory = connect(path, 0)
+    try:
+        row = directory.execute(
+            "SELECT shard FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No such user: {user_id}")
+
+        home = row[0]
+        if home != target:
+            copy_user(path, user_id, home, target)
+            with directory:
+                directory.execute(
+                    "UPDATE users SET shard = ? WHERE id = ?", (target, user_id)
+                )
+    finally:
+        directory.close()
+
+    for index in range(shards):
+        if index == target:
+            continue
+        conn = connect(path, index)
+        try:
+            with conn:
+                _purge(conn, user_id)
+        finally:
+            conn.close()
+    return home != target
+
+
+def placement(path: str, shards: int) -> list:
+    # (user id, current shard, shard the user id maps to)
+    conn = connect(path, 0)
+    try:
+        rows = conn.execute("SELECT id, shard FROM users ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    return [(user_id, shard, user_id % shards) for user_id, shard in rows]
+
+
+def rebalance(path: str, shards: int) -> int:
+    # moves every user whose home is not the shard their id maps to, e.g.
+    # after splitting a single database or changing the shard count; raises
+    # AppRunning while the app serves the database
+    moved = 0
+    with offline(path):
+        for user_id, shard, wanted in placement(path, shards):
+            if shard != wanted and _move_user(path, shards, user_id, wanted):
+                moved += 1
+    return moved
+
+
+def status(path: str, shards: int) -> list:
+    homes = [0] * shards
+    misplaced = 0
+    for _user_id, shard, wanted in placement(path, shards):
+        if 0 <= shard < shards:
+            homes[shard] += 1
+        misplaced += shard != wanted
+
+    lines = []
+    for index in range(shards):
+        conn = connect(path, index)
+        try:
+            posts, stories, messages = (
+                conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+                for table in ("posts", "stories", "messages")
+            )
+        finally:
+            conn.close()
+        lines.append(
+            f"shard {index}: users={homes[index]} posts={posts} "
+            f"stories={stories} messages={messages}"
+        )
+    lines.append(f"misplaced users: {misplaced}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and rebalance shards")
+    parser.add_argument("--db", default=DATABASE_PATH)
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="users and rows per shard")
+    move = commands.add_parser("move", help="move one user to another shard")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    commands.add_parser("rebalance", help="move users to the shard of their id")
+    args = parser.parse_args()
+
+    # new shard files get their schema before anything is copied into them
+    prepare(args.db, args.shards)
+
+    try:
+        if args.command == "move":
+            moved = move_user(args.db, args.shards, args.user_id, args.shard)
+            verb = "moved to" if moved else "already on"
+            print(f"user {args.user_id} {verb} shard {args.shard}")
+        elif args.command == "rebalance":
+            print(f"moved {rebalance(args.db, args.shards)} users")
+    except AppRunning as e:
+        sys.exit(str(e))
+    for line in status(args.db, args.shards):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
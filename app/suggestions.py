@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import logging
+import os
+from collections import Counter
+from typing import Optional
+from repositories import Repositories, open_repositories
+
+logger = logging.getLogger("social_media.suggestions")
+
+# suggestions kept per user, and so the most one request can ask for
+TOP_K = int(os.environ.get("SOCIAL_MEDIA_SUGGESTIONS_TOP_K", "20"))
+# stale users recomputed per transaction
+BATCH_SIZE = int(os.environ.get("SOCIAL_MEDIA_SUGGESTIONS_BATCH_SIZE", "200"))
+# seconds the background job sleeps once the queue is empty; "0" leaves the
+# queue to refresh_stale calls, e.g. from tests
+INTERVAL = float(os.environ.get("SOCIAL_MEDIA_SUGGESTIONS_INTERVAL", "5"))
+
+# a mutual friend counts for more than a shared group
+MUTUAL_FRIEND_WEIGHT = 2
+SHARED_GROUP_WEIGHT = 1
+
+
+def rank(
+    user_id: int,
+    friends: frozenset,
+    friends_of_friends: Counter,
+    shared_groups: dict[int, int],
+    pending: set[int],
+    top_k: int = TOP_K,
+) -> list[tuple[int, int, int]]:
+    # (candidate_id, mutual_friends, shared_groups) of the best candidates,
+    # best first; ties go to the lower id
+    excluded = friends | pending | {user_id}
+    candidates = (friends_of_friends.keys() | shared_groups.keys()) - excluded
+
+    def score(candidate_id: int):
+        mutual = friends_of_friends.get(candidate_id, 0)
+        shared = shared_groups.get(candidate_id, 0)
+        return (
+            mutual * MUTUAL_FRIEND_WEIGHT + shared * SHARED_GROUP_WEIGHT,
+            -candidate_id,
+        )
+
+    best = heapq.nlargest(top_k, candidates, key=score)
+    return [
+        (
+            candidate_id,
+            friends_of_friends.get(candidate_id, 0),
+            shared_groups.get(candidate_id, 0),
+        )
+        for candidate_id in best
+    ]
+
+
+async def neighbourhood(repos: Repositories, user_ids: list[int]) -> tuple:
+    # Everything a batch is ranked from: the friends of each user and of
+    # their friends, read from the friend graph (which the sqlite backend
+    # keeps in memory), plus pending requests and shared groups, one query
+    # each for the whole batch.
+    friends = {}
+    for user_id in user_ids:
+        if user_id not in friends:
+            friends[user_id] = await repos.friends.friend_ids(user_id)
+        for friend_id in friends[user_id]:
+            if friend_id not in friends:
+                friends[friend_id] = await repos.friends.friend_ids(friend_id)
+    pending = await repos.friends.pending_ids(user_ids)
+    shared = await repos.groups.shared_counts(user_ids)
+    return friends, pending, shared
+
+
+def recompute(
+    user_ids: list[int],
+    friends: dict[int, frozenset],
+    pending: dict[int, set[int]],
+    shared: dict[int, dict[int, int]],
+    top_k: int = TOP_K,
+) -> dict[int, list[tuple[int, int, int]]]:
+    # CPU only, so it runs off the event loop
+    ranked = {}
+    for user_id in user_ids:
+        friends_of_friends = Counter()
+        for friend_id in friends[user_id]:
+            friends_of_friends.update(friends[friend_id])
+        ranked[user_id] = rank(
+            user_id,
+            friends[user_id],
+            friends_of_friends,
+            shared[user_id],
+            pending[user_id],
+            top_k,
+        )
+    return ranked
+
+
+async def refresh_stale(batch_size: int = BATCH_SIZE, top_k: int = TOP_K) -> int:
+    # Refreshes one batch of queued users and returns how many there were.
+    # The claim and the reads commit in one short transaction, the ranking
+    # runs in a thread and the results are written in a second one, so no
+    # transaction stays open while the batch is ranked. A failed batch is
+    # queued again.
+    async with open_repositories() as repos:
+        user_ids = await repos.suggestions.claim(batch_size)
+        if not user_ids:
+            return 0
+        inputs = await neighbourhood(repos, user_ids)
+    try:
+        loop = asyncio.get_running_loop()
+        ranked = await loop.run_in_executor(None, recompute, user_ids, *inputs, top_k)
+        async with open_repositories() as repos:
+            await repos.suggestions.replace(ranked)
+    except BaseException:
+        async with open_repositories() as repos:
+            await repos.suggestions.mark_stale(user_ids)
+        raise
+    return len(user_ids)
+
+
+async def refresh_all(batch_size: int = BATCH_SIZE, top_k: int = TOP_K) -> int:
+    refreshed = 0
+    while True:
+        count = await refresh_stale(batch_size, top_k)
+        refreshed += count
+        if count < batch_size:
+            return refreshed
+
+
+class SuggestionWorker:
+    # Drains the suggestion queue in the background of each app process: a
+    # batch at a time until it is empty, then every `interval` seconds.
+    # Batches are claimed, so workers never refresh the same users at once.
+    # A failed batch is logged and retried on the next round.
+    def __init__(self, interval: float = INTERVAL, batch_size: int = BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await refresh_all(self.batch_size)
+            except Exception:
+                logger.exception("Refreshing friend suggestions failed")
+            await asyncio.sleep(self.interval)
+
+
+worker = SuggestionWorker()
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import os
+import sys
+from typing import AsyncIterable, Optional
+from pydantic import ValidationError
+import database
+from database import DATABASE_PATH, SHARDS, get_shard_connections
+from migrations import migrate_shards
+from models import Role, UserImport
+from passwords import hasher, is_hashed
+from repositories import open_repositories
+
+# users validated, checked and inserted together, each batch in its own
+# transaction so a long import never holds the writer for long
+BATCH_SIZE = int(os.environ.get("SOCIAL_MEDIA_IMPORT_BATCH_SIZE", "5000"))
+# errors listed in an import response; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+async def ndjson_lines(chunks: AsyncIterable[bytes]):
+    # re-splits an upload, which arrives in arbitrary chunks, into lines
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def _lines_of(path: str):
+    with open(path, "rb") if path != "-" else sys.stdin.buffer as source:
+        for line in source:
+            yield line
+
+
+def _describe(error: ValidationError) -> str:
+    first = error.errors()[0]
+    where = ".".join(str(part) for part in first["loc"])
+    return f"{where}: {first['msg']}" if where else first["msg"]
+
+
+class UserImporter:
+    # Creates users from NDJSON lines such as
+    #   {"name": "ana", "password": "secret", "role": "user"}
+    # in batches. Names are checked against the rest of the import in a set
+    # and against the database with one query per batch, before any password
+    # is hashed; a name taken after that check is refused by the unique
+    # index when the batch is inserted. Rows that fail are reported by line
+    # number and skipped, the others are created.
+    # A pre-computed "password_hash" is stored as is, which is what keeps
+    # large imports fast: plaintext passwords are hashed on the pool.
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        max_errors: Optional[int] = MAX_REPORTED_ERRORS,
+    ):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        self._line_no = 0
+        self._seen = set()
+        self._batch = []
+
+    def _fail(self, line_no: int, message: str) -> None:
+        self.error_count += 1
+        if self.max_errors is None or len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_no, "error": message})
+
+    async def add(self, line: bytes) -> None:
+        self._line_no += 1
+        if not line.strip():
+            return
+
+        try:
+            user = UserImport.model_validate_json(line)
+        except ValidationError as e:
+            self._fail(self._line_no, _describe(e))
+            return
+
+        if (user.password is None) == (user.password_hash is None):
+            self._fail(self._line_no, "Give exactly one of password, password_hash")
+            return
+        if user.password_hash is not None and not is_hashed(user.password_hash):
+            self._fail(self._line_no, "Unsupported password_hash format")
+            return
+        if user.name in self._seen:
+            self._fail(self._line_no, "Username repeated in this import")
+            return
+
+        self._seen.add(user.name)
+        self._batch.append((self._line_no, user))
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        async with open_repositories() as repos:
+            taken = await repos.users.existing_names([user.name for _, user in batch])
+            accepted = []
+            for line_no, user in batch:
+                if user.name in taken:
+                    self._fail(line_no, "Username taken")
+                else:
+                    accepted.append((line_no, user))
+
+            plaintext = [
+                user.password for _, user in accepted if user.password_hash is None
+            ]
+            hashed = iter(await hasher.hash_many(plaintext))
+            passwords = [user.password_hash or next(hashed) for _, user in accepted]
+
+            if any(user.role == Role.ADMIN for _, user in accepted):
+                # users stay locked until the batch commits, as in registration
+                await repos.users.lock()
+                accepted, passwords = self._one_admin(
+                    accepted, passwords, await repos.users.admin_exists()
+                )
+
+            created = await repos.users.create_many(
+                [
+                    (user.name, password, user.role.value)
+                    for (_, user), password in zip(accepted, passwords)
+                ]
+            )
+            for line_no, user in accepted:
+                if user.name not in created:
+                    self._fail(line_no, "Username taken")
+            self.created += len(created)
+
+    def _one_admin(self, accepted: list, passwords: list, admin_exists: bool):
+        kept, kept_passwords = [], []
+        for (line_no, user), password in zip(accepted, passwords):
+            if user.role == Role.ADMIN:
+                if admin_exists:
+                    self._fail(line_no, "An admin user already exists")
+                    continue
+                admin_exists = True
+            kept.append((line_no, user))
+            kept_passwords.append(password)
+        return kept, kept_passwords
+
+    async def run(self, lines: AsyncIterable[bytes]) -> dict:
+        async for line in lines:
+            await self.add(line)
+        await self.flush()
+        return self.report()
+
+    def report(self) -> dict:
+        return {
+            "created": self.created,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create users from an NDJSON file")
+    parser.add_argument("path", help="NDJSON file, one user per line; - for stdin")
+    parser.add_argument("--db", default=DATABASE_PATH)
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    database.configure(args.db, shards=args.shards)
+    connections = get_shard_connections()
+    try:
+        migrate_shards(connections)
+    finally:
+        for conn in connections:
+            conn.close()
+
+    importer = UserImporter(args.batch_size, max_errors=None)
+    try:
+        report = asyncio.run(importer.run(_lines_of(args.path)))
+    finally:
+        hasher.shutdown()
+        database.close()
+
+    for error in report["errors"]:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    print(f"created {report['created']} users, {report['error_count']} errors")
+    sys.exit(1 if report["error_count"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,49 @@
+import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from database import get_db_connection
-import sqlite3
+from cache import token_cache
+from repositories import Repositories, get_repositories
+from revocation import revocations
 
 SECRET_KEY = "secret-word"
 ALGORITHM = "HS256"
 
+# "lookup" loads the caller's row on every request (served from the user
+# cache when possible); "claims" trusts the signed token claims and only
+# checks the id against the revocation list
+AUTH_MODE = os.environ.get("SOCIAL_MEDIA_AUTH_MODE", "lookup")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
 
+async def _load_user(payload: dict, repos: Repositories) -> Optional[dict]:
+    user_id = payload.get("user_id")
+    if AUTH_MODE == "claims" and "role" in payload:
+        await revocations.refresh(repos.users)
+        if user_id in revocations:
+            return None
+        return {"id": user_id, "name": payload.get("sub"), "role": payload["role"]}
+
+    return await repos.users.get(user_id)
+
+
+def decode_token(token: str) -> dict:
+    # A token string maps to one payload, so once its signature has been
+    # verified the payload is kept until the token expires. Tokens that
+    # fail verification are never cached. Raises JWTError.
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        expires = payload.get("exp")
+        if isinstance(expires, (int, float)):
+            token_cache.put(token, payload, ttl=expires - time.time())
+    return payload
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=1000)
@@ -20,7 +52,10 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    repos: Repositories = Depends(get_repositories),
+):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -31,46 +66,39 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id: int = payload.get("user_id")
         if user_id is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    user = await _load_user(payload, repos)
 
     if user is None:
         raise credentials_exception
 
-    return dict(user)
+    return user
 
 
-def get_optional_user(token: str = Depends(oauth2_scheme)) -> Optional[dict]:
+async def get_optional_user(
+    token: str = Depends(oauth2_scheme),
+    repos: Repositories = Depends(get_repositories),
+) -> Optional[dict]:
     if not token:
         return None
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id: int = payload.get("user_id")
         if user_id is None:
             return None
     except JWTError:
         return None
 
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    user = await _load_user(payload, repos)
 
     if user is None:
         return None
 
-    return dict(user)
+    return user
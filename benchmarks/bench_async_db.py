@@ -0,0 +1,174 @@
+"""Latency of the async DB executor path against the old sync path.
+
+Runs both paths in-process under the same concurrent load and prints p50/p99
+latencies for a read endpoint (/get-chat) and a write endpoint
+(/send-message). The sync path is the pre-executor handler shape: a plain
+``def`` endpoint that Starlette runs on its shared threadpool and that opens
+its own pooled connection.
+
+    python benchmarks/bench_async_db.py --concurrency 64 --requests 2000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+# one client replays a whole load; do not throttle it
+os.environ.setdefault("SOCIAL_MEDIA_RATE_LIMIT", "0")
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI, HTTPException  # noqa: E402
+
+import database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def build_sync_app() -> FastAPI:
+    from jose import jwt, JWTError
+    from utils import ALGORITHM, SECRET_KEY, oauth2_scheme
+
+    def current_user(token: str = Depends(oauth2_scheme)):
+        try:
+            user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["user_id"]
+        except JWTError:
+            raise HTTPException(status_code=401)
+        conn = database.get_db_connection()
+        user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        conn.close()
+        return dict(user)
+
+    app = FastAPI()
+
+    @app.get("/get-chat")
+    def get_chat(other_user_id: int, user: dict = Depends(current_user)):
+        conn = database.get_db_connection()
+        rows = conn.execute(
+            """
+            SELECT m.content, m.timestamp, u.name as sender_name
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE (m.sender_id = ? AND m.receiver_id = ?)
+               OR (m.sender_id = ? AND m.receiver_id = ?)
+            ORDER BY m.timestamp ASC
+            """,
+            (user["id"], other_user_id, other_user_id, user["id"]),
+        ).fetchall()
+        conn.close()
+        return {"messages": [dict(row) for row in rows]}
+
+    @app.post("/send-message")
+    def send_message(
+        receiver_id: int, content: str, user: dict = Depends(current_user)
+    ):
+        conn = database.get_db_connection()
+        conn.execute(
+            "INSERT INTO messages(sender_id, receiver_id, content) VALUES (?, ?, ?)",
+            (user["id"], receiver_id, content),
+        )
+        conn.commit()
+        conn.close()
+        return {"message": "Message sent successfully"}
+
+    return app
+
+
+def seed(users: int, messages: int) -> None:
+    conn = database.get_db_connection()
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'pass', 'user')",
+        [(f"user{i}",) for i in range(users)],
+    )
+    conn.executemany(
+        """
+        INSERT INTO friends (user_low, user_high, requester_id, status)
+        VALUES (?, ?, ?, 'accepted')
+        """,
+        [(i, i + 1, i) for i in range(1, users)],
+    )
+    conn.executemany(
+        "INSERT INTO messages (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+        [(1 + i % 2, 2 - i % 2, f"message {i}") for i in range(messages)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def run_load(app, method, url, params, headers, concurrency, total):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        remaining = iter(range(total))
+
+        async def worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.request(
+                    method, url, params=params, headers=headers
+                )
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "rps": total / elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-async-db-")
+
+    from main import app as async_app
+    from utils import create_access_token
+
+    token = create_access_token({"sub": "user0", "user_id": 1, "role": "user"})
+    headers = {"Authorization": f"Bearer {token}"}
+    scenarios = [
+        ("GET", "/get-chat", {"other_user_id": 2}),
+        ("POST", "/send-message", {"receiver_id": 2, "content": "hi"}),
+    ]
+
+    print(f"concurrency={args.concurrency} requests={args.requests}")
+    print(f"{'path':<6} {'endpoint':<14} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for name, app in (("sync", build_sync_app()), ("async", async_app)):
+        for method, url, params in scenarios:
+            # every run starts from the same freshly seeded database
+            database.configure(
+                os.path.join(workdir, f"{name}{url.replace('/', '-')}.db")
+            )
+            seed(users=100, messages=args.messages)
+
+            result = asyncio.run(
+                run_load(
+                    app, method, url, params, headers, args.concurrency, args.requests
+                )
+            )
+            print(
+                f"{name:<6} {url:<14} {result['p50']:>8.2f} "
+                f"{result['p99']:>8.2f} {result['rps']:>8.0f}"
+            )
+
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
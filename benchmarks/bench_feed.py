@@ -0,0 +1,98 @@
+"""Feed latency as the reader's friend count grows: pushed against pulled.
+
+Fills a temporary database with a reader and --friends accepted friends,
+each with --posts posts, then times reading the first feed page twice: with
+every post pushed into the reader's timeline (fan-out on write), and with
+every friend marked as pulled, so the page is merged from one stream per
+friend (fan-out on read).
+
+    python benchmarks/bench_feed.py --friends 10,100,1000,5000 --posts 20
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import database  # noqa: E402
+import repositories  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def fill(friends: int, posts: int) -> None:
+    conn = database.get_db_connection()
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (id, name, password, role) VALUES (?, ?, 'x', 'user')",
+        ((user_id, f"user{user_id}") for user_id in range(1, friends + 2)),
+    )
+    conn.executemany(
+        "INSERT INTO friends VALUES (1, ?, 1, 'accepted')",
+        ((friend_id,) for friend_id in range(2, friends + 2)),
+    )
+    # the friends take turns, so every page mixes many authors
+    conn.executemany(
+        "INSERT INTO posts (user_id, post_type, content, visibility) "
+        "VALUES (?, 'text', ?, 'friends')",
+        (
+            (friend_id, f"post {i} of {friend_id}")
+            for i in range(posts)
+            for friend_id in range(2, friends + 2)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def deliver(pushed: bool) -> None:
+    conn = database.get_db_connection()
+    conn.execute("DELETE FROM timelines")
+    conn.execute("DELETE FROM pulled_authors")
+    if pushed:
+        conn.execute(
+            "INSERT INTO timelines (user_id, post_id, author_id, group_id, via_group) "
+            "SELECT 1, id, user_id, NULL, 0 FROM posts"
+        )
+    else:
+        conn.execute("INSERT INTO pulled_authors SELECT id FROM users WHERE id > 1")
+    conn.commit()
+    conn.close()
+
+
+async def read_feed(reads: int, limit: int) -> float:
+    started = time.perf_counter()
+    for _ in range(reads):
+        async with repositories.open_repositories() as repos:
+            page = await repos.posts.feed(1, limit=limit)
+    elapsed = time.perf_counter() - started
+    assert len(page) == limit
+    return elapsed / reads * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--friends", default="10,100,1000,5000")
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'friends':>8} {'pushed':>10} {'pulled':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for friends in map(int, args.friends.split(",")):
+            database.configure(os.path.join(directory, f"feed-{friends}.db"))
+            fill(friends, args.posts)
+            latencies = []
+            for pushed in (True, False):
+                deliver(pushed)
+                latencies.append(asyncio.run(read_feed(args.reads, args.limit)))
+            database.close()
+            print(f"{friends:>8} {latencies[0]:>7.2f} ms {latencies[1]:>7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Latency of mutual-friend and connection-path queries on the friend graph.
+
+Builds a random graph of --users users with about --degree friends each,
+plus a few hub users with --hub-friends friends apiece, and times
+FriendGraph.mutual_friends and FriendGraph.path (bidirectional BFS) between
+hubs and between random users.
+
+    python benchmarks/bench_graph_queries.py --users 200000 --hub-friends 5000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from friend_graph import FriendGraph  # noqa: E402
+
+
+def build(users: int, degree: int, hubs: int, hub_friends: int, seed: int):
+    rng = random.Random(seed)
+    pairs = set()
+    for _ in range(users * degree // 2):
+        a, b = rng.randint(1, users), rng.randint(1, users)
+        if a != b:
+            pairs.add((min(a, b), max(a, b)))
+    for hub in range(1, hubs + 1):
+        for friend_id in rng.sample(range(hubs + 1, users + 1), hub_friends):
+            pairs.add((hub, friend_id))
+    graph = FriendGraph()
+    graph.load(pairs)
+    return graph
+
+
+def timed(query, cases: list) -> list[float]:
+    timings = []
+    for args in cases:
+        started = time.perf_counter()
+        query(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(label: str, timings: list[float]) -> None:
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(
+        f"{label:<28} median {statistics.median(timings):7.3f} ms"
+        f"   p99 {p99:7.3f} ms   max {timings[-1]:7.3f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--degree", type=int, default=20)
+    parser.add_argument("--hubs", type=int, default=4)
+    parser.add_argument("--hub-friends", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-depth", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    graph = build(args.users, args.degree, args.hubs, args.hub_friends, args.seed)
+    print(
+        f"{args.users} users, {len(graph)} friendships, built in "
+        f"{time.perf_counter() - started:.1f} s"
+    )
+
+    rng = random.Random(args.seed + 1)
+    hubs = range(1, args.hubs + 1)
+    hub_pairs = [tuple(rng.sample(hubs, 2)) for _ in range(args.queries)]
+    random_pairs = [
+        (rng.randint(1, args.users), rng.randint(1, args.users))
+        for _ in range(args.queries)
+    ]
+    hub_to_user = [(rng.choice(hubs), b) for _, b in random_pairs]
+
+    report("mutual friends, hub-hub", timed(graph.mutual_friends, hub_pairs))
+    report("mutual friends, random", timed(graph.mutual_friends, random_pairs))
+
+    def path(a: int, b: int):
+        return graph.path(a, b, args.max_depth)
+
+    report("path, hub-hub", timed(path, hub_pairs))
+    report("path, hub-random", timed(path, hub_to_user))
+    report("path, random", timed(path, random_pairs))
+
+
+if __name__ == "__main__":
+    main()
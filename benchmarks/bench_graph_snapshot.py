@@ -0,0 +1,124 @@
+"""Startup time of the friend graph: the friends table against a snapshot.
+
+Fills a temporary database with --users users and about --degree accepted
+friendships each, writes a graph snapshot, applies --changes friendship
+changes after it, then times loading the graph from the whole table and from
+the snapshot plus the changes logged since.
+
+    python benchmarks/bench_graph_snapshot.py --users 200000 --degree 20
+"""
+
+import argparse
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from friend_graph import FriendGraph  # noqa: E402
+from graph_snapshot import CSRSnapshot, changes_since, write_snapshot  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def fill(conn: sqlite3.Connection, users: int, degree: int, rng: random.Random):
+    conn.executemany(
+        "INSERT INTO users (id, name, password, role) VALUES (?, ?, 'x', 'user')",
+        ((user_id, f"user{user_id}") for user_id in range(1, users + 1)),
+    )
+    pairs = set()
+    for _ in range(users * degree // 2):
+        a, b = rng.randint(1, users), rng.randint(1, users)
+        if a != b:
+            pairs.add((min(a, b), max(a, b)))
+    conn.executemany(
+        "INSERT INTO friends VALUES (?, ?, ?, 'accepted')",
+        ((low, high, low) for low, high in pairs),
+    )
+    conn.commit()
+    return sorted(pairs)
+
+
+def change(conn: sqlite3.Connection, pairs: list, changes: int, rng: random.Random):
+    # half removals of existing friendships, half new ones
+    users = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    conn.executemany(
+        "DELETE FROM friends WHERE user_low = ? AND user_high = ?",
+        rng.sample(pairs, changes // 2),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO friends VALUES (?, ?, ?, 'accepted')",
+        (
+            (low, high, low)
+            for low, high in (
+                sorted(rng.sample(range(1, users + 1), 2))
+                for _ in range(changes - changes // 2)
+            )
+        ),
+    )
+    conn.commit()
+
+
+def timed(label: str, load) -> FriendGraph:
+    started = time.perf_counter()
+    graph = load()
+    print(f"{label:<24} {(time.perf_counter() - started) * 1000:9.1f} ms")
+    return graph
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--degree", type=int, default=20)
+    parser.add_argument("--changes", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(os.path.join(directory, "bench.db"))
+        migrate(conn)
+        pairs = fill(conn, args.users, args.degree, rng)
+        path = os.path.join(directory, "graph.csr")
+        write_snapshot(conn, path)
+        change(conn, pairs, args.changes, rng)
+        print(
+            f"{len(pairs)} friendships, {args.changes} changed since the snapshot "
+            f"of {os.path.getsize(path) / 2**20:.1f} MiB"
+        )
+
+        def from_table() -> FriendGraph:
+            graph = FriendGraph()
+            graph.load(
+                conn.execute(
+                    "SELECT user_low, user_high FROM friends "
+                    "WHERE status = 'accepted'"
+                ).fetchall()
+            )
+            return graph
+
+        def from_snapshot() -> FriendGraph:
+            graph = FriendGraph()
+            snapshot = CSRSnapshot(path)
+            graph.load_snapshot(snapshot, changes_since(conn, snapshot.mark))
+            return graph
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        mapped = timed("snapshot + changes", from_snapshot)
+        after_snapshot = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        loaded = timed("friends table", from_table)
+        after_table = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        conn.close()
+
+        assert len(mapped) == len(loaded)
+        print(
+            f"peak RSS growth: snapshot {(after_snapshot - before) / 1024:.0f} MiB, "
+            f"table {(after_table - after_snapshot) / 1024:.0f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
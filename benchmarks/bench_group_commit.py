@@ -0,0 +1,86 @@
+"""Insert throughput with and without the group-commit queue.
+
+Concurrent "requests" each insert one message, either in their own write
+transaction (AsyncSession.execute) or through the group-commit queue
+(AsyncSession.execute_batched). Use --synchronous FULL to include the fsync
+cost of every commit.
+
+    python benchmarks/bench_group_commit.py --concurrency 128 --inserts 5000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+INSERT = "INSERT INTO messages (sender_id, receiver_id, content) VALUES (1, 2, ?)"
+
+
+async def single_commits(content: str) -> None:
+    db = database.AsyncSession(database.executor)
+    await db.execute(INSERT, (content,))
+    await db.close()
+
+
+async def group_commits(content: str) -> None:
+    db = database.AsyncSession(database.executor)
+    await db.execute_batched(INSERT, (content,))
+    await db.close()
+
+
+async def run(write, concurrency: int, inserts: int) -> float:
+    remaining = iter(range(inserts))
+
+    async def worker():
+        for i in remaining:
+            await write(f"message {i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await database.executor.queue.close()
+    return inserts / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--inserts", type=int, default=5000)
+    parser.add_argument("--synchronous", default="FULL")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-group-commit-")
+    print(
+        f"concurrency={args.concurrency} inserts={args.inserts} "
+        f"synchronous={args.synchronous}"
+    )
+    for name, write in (("single", single_commits), ("grouped", group_commits)):
+        database.configure(
+            os.path.join(workdir, f"{name}.db"), synchronous=args.synchronous
+        )
+        conn = database.get_db_connection()
+        migrate(conn)
+        conn.execute(
+            "INSERT INTO users (name, password, role) VALUES ('a', 'p', 'user')"
+        )
+        conn.execute(
+            "INSERT INTO users (name, password, role) VALUES ('b', 'p', 'user')"
+        )
+        conn.commit()
+        conn.close()
+
+        rate = asyncio.run(run(write, args.concurrency, args.inserts))
+        print(f"{name:<8} {rate:>10.0f} inserts/s")
+
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Serialization cost of a chat history response: dict rows vs slotted records.
+
+Compares the old path (sqlite3.Row -> dict -> jsonable_encoder -> JSONResponse)
+with the new one (cursor row -> ChatMessage record -> FastJSONResponse) on the
+same fetched rows, reporting time and peak allocation per response.
+
+    python benchmarks/bench_json.py --messages 5000 --repeat 20
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import responses  # noqa: E402
+from records import ChatMessage  # noqa: E402
+
+QUERY = "SELECT content, timestamp, sender_name FROM messages ORDER BY id"
+
+
+def dict_rows(conn: sqlite3.Connection) -> bytes:
+    conn.row_factory = sqlite3.Row
+    messages = [dict(row) for row in conn.execute(QUERY).fetchall()]
+    content = {"chat_participants": [1, 2], "messages": messages}
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def record_rows(conn: sqlite3.Connection) -> bytes:
+    cursor = conn.execute(QUERY)
+    cursor.row_factory = ChatMessage.from_row
+    content = {"chat_participants": [1, 2], "messages": cursor.fetchall()}
+    return responses.FastJSONResponse(content).body
+
+
+def measure(fn, conn, repeat: int) -> tuple:
+    fn(conn)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(conn)
+    elapsed = (time.perf_counter() - started) / repeat
+
+    tracemalloc.start()
+    fn(conn)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY, content TEXT, "
+        "timestamp TEXT, sender_name TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO messages (content, timestamp, sender_name) VALUES (?, ?, ?)",
+        [
+            (f"message {i}", "2024-01-01 10:00:00", f"user{i % 2}")
+            for i in range(args.messages)
+        ],
+    )
+
+    assert json.loads(dict_rows(conn)) == json.loads(record_rows(conn))
+
+    print(
+        f"messages={args.messages} serializer="
+        f"{'orjson' if responses.orjson is not None else 'json'}"
+    )
+    print(f"{'path':<8} {'ms/response':>12} {'peak KiB':>10}")
+    for name, fn in (("dicts", dict_rows), ("records", record_rows)):
+        elapsed, peak = measure(fn, conn, args.repeat)
+        print(f"{name:<8} {elapsed * 1000:>12.2f} {peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
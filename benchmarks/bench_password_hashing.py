@@ -0,0 +1,174 @@
+"""Login throughput and other endpoints' latency during a login storm.
+
+Floods /auth/login while a second load reads /get-my-friends, once per way of
+running the password hash: ``inline`` on the event loop (the shape a plain
+synchronous hash call has), ``thread`` on the default threadpool and ``pool``
+on the bounded process pool. Refused logins (503) back off briefly and are
+retried, as a client honouring Retry-After would. Prints login req/s, how
+many 503s were answered, and p50/p99 of the friends endpoint.
+
+    python benchmarks/bench_password_hashing.py --cost 14 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+# one client replays a whole load; do not throttle it
+os.environ.setdefault("SOCIAL_MEDIA_RATE_LIMIT", "0")
+
+import httpx  # noqa: E402
+
+import database  # noqa: E402
+import passwords  # noqa: E402
+from migrations import migrate  # noqa: E402
+from routers import auth  # noqa: E402
+
+
+class InlineHasher(passwords.PasswordHasher):
+    async def _run(self, fn, *args):
+        return fn(*args)
+
+
+def seed(users: int, password_hash: str) -> None:
+    conn = database.get_db_connection()
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, ?, 'user')",
+        [(f"user{i}", password_hash) for i in range(users)],
+    )
+    conn.executemany(
+        """
+        INSERT INTO friends (user_low, user_high, requester_id, status)
+        VALUES (1, ?, 1, 'accepted')
+        """,
+        [(i,) for i in range(2, min(users, 50) + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def run_storm(
+    app, hasher, users, logins, login_concurrency, reads, read_concurrency
+):
+    from utils import create_access_token
+
+    # start the worker processes before anything is timed
+    await asyncio.gather(*(hasher.hash("warm-up") for _ in range(hasher.limit)))
+
+    token = create_access_token({"sub": "user0", "user_id": 1, "role": "user"})
+    headers = {"Authorization": f"Bearer {token}"}
+    read_latencies = []
+    busy = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        pending_logins = iter(range(logins))
+        pending_reads = iter(range(reads))
+
+        async def login_worker():
+            nonlocal busy
+            for i in pending_logins:
+                while True:
+                    response = await client.post(
+                        "/auth/login",
+                        data={"username": f"user{i % users}", "password": "pass"},
+                    )
+                    if response.status_code != 503:
+                        break
+                    busy += 1
+                    await asyncio.sleep(0.01)
+                response.raise_for_status()
+
+        async def login_storm():
+            started = time.perf_counter()
+            await asyncio.gather(*(login_worker() for _ in range(login_concurrency)))
+            return time.perf_counter() - started
+
+        async def read_worker():
+            for _ in pending_reads:
+                started = time.perf_counter()
+                response = await client.get("/get-my-friends/1", headers=headers)
+                read_latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        storm = asyncio.ensure_future(login_storm())
+        await asyncio.gather(*(read_worker() for _ in range(read_concurrency)))
+        elapsed = await storm
+
+    read_latencies.sort()
+    return {
+        "login_rps": logins / elapsed,
+        "busy": busy,
+        "p50": statistics.median(read_latencies) * 1000,
+        "p99": read_latencies[int(len(read_latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cost", type=int, default=passwords.COST)
+    parser.add_argument("--workers", type=int, default=passwords.WORKERS or 1)
+    parser.add_argument("--queue", type=int, default=passwords.QUEUE)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--read-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-password-hashing-")
+    password_hash = passwords.hash_password("pass", args.cost)
+
+    from main import app
+
+    hashers = [
+        ("inline", InlineHasher(args.cost, 0, args.queue)),
+        ("thread", passwords.PasswordHasher(args.cost, 0, args.queue)),
+        ("pool", passwords.PasswordHasher(args.cost, args.workers, args.queue)),
+    ]
+
+    print(
+        f"cost={args.cost} workers={args.workers} queue={args.queue} "
+        f"logins={args.logins}x{args.login_concurrency} "
+        f"reads={args.reads}x{args.read_concurrency}"
+    )
+    print(
+        f"{'hashing':<8} {'login/s':>8} {'503s':>6} "
+        f"{'friends p50 ms':>15} {'friends p99 ms':>15}"
+    )
+    for name, hasher in hashers:
+        database.configure(os.path.join(workdir, f"{name}.db"))
+        seed(args.users, password_hash)
+        auth.hasher = hasher
+        try:
+            result = asyncio.run(
+                run_storm(
+                    app,
+                    hasher,
+                    args.users,
+                    args.logins,
+                    args.login_concurrency,
+                    args.reads,
+                    args.read_concurrency,
+                )
+            )
+        finally:
+            hasher.shutdown()
+        print(
+            f"{name:<8} {result['login_rps']:>8.1f} {result['busy']:>6} "
+            f"{result['p50']:>15.2f} {result['p99']:>15.2f}"
+        )
+
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
 from helpers import register_user, login_user, auth_header
 
@@ -42,6 +43,37 @@ def test_register_second_admin_fails(client: TestClient) -> None:
     assert "admin user already exists" in response.json()["detail"].lower()
 
 
+def _register_concurrently(client: TestClient, users: list, monkeypatch) -> list:
+    # the requests overlap on the app's event loop, as they would in production
+    from passwords import hasher
+
+    monkeypatch.setattr(hasher, "limit", len(users))
+
+    def register(user: dict) -> int:
+        return client.post("/auth/register", json=user).status_code
+
+    with ThreadPoolExecutor(len(users)) as pool:
+        return sorted(pool.map(register, users))
+
+
+def test_concurrent_registrations_of_one_name_create_one_user(
+    client: TestClient, monkeypatch
+) -> None:
+    users = [{"name": "bob", "password": f"pass{i}", "role": "user"} for i in range(20)]
+
+    assert _register_concurrently(client, users, monkeypatch) == [200] + [400] * 19
+
+
+def test_concurrent_admin_registrations_create_one_admin(
+    client: TestClient, monkeypatch
+) -> None:
+    users = [
+        {"name": f"admin{i}", "password": "pass", "role": "admin"} for i in range(3)
+    ]
+
+    assert _register_concurrently(client, users, monkeypatch) == [200, 422, 422]
+
+
 def test_login_success(client: TestClient) -> None:
     register_user(client, name="charlie", password="secret")
     response = client.post(
@@ -88,7 +120,5 @@ def test_force_delete_user(client: TestClient) -> None:
 
 
 def test_protected_endpoint_without_token(client: TestClient) -> None:
-    response = client.post(
-        "/send-friend-request", params={"receiver_id": 1}
-    )
+    response = client.post("/send-friend-request", params={"receiver_id": 1})
     assert response.status_code == 401
@@ -0,0 +1,137 @@
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_and_least_recently_used_are_evicted() -> None:
+    from cache import TTLCache
+
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"
+    cache.put(3, "c")
+
+    # 2 was used least recently
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+
+    clock.now = 10
+    assert cache.get(1) is None
+    assert cache.get(3) is None
+    assert cache.stats() == {
+        "size": 0,
+        "hits": 2,
+        "misses": 3,
+        "hit_rate": 0.4,
+        "evictions": 1,
+        "expirations": 2,
+    }
+
+
+def test_disabled_cache_stores_nothing() -> None:
+    from cache import TTLCache
+
+    cache = TTLCache(maxsize=0)
+    cache.put(1, "a")
+    assert cache.get(1) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_authenticated_requests_skip_the_user_lookup(client: TestClient) -> None:
+    from cache import user_cache
+
+    register_user(client)
+    headers = auth_header(login_user(client))
+
+    first = client.get("/get-my-friends/1", headers=headers)
+    second = client.get("/get-my-friends/1", headers=headers)
+
+    assert int(first.headers["X-Query-Count"]) == 2
+    assert int(second.headers["X-Query-Count"]) == 1
+    assert user_cache.stats()["hits"] >= 1
+
+
+def test_deleted_user_is_dropped_from_the_cache(client: TestClient) -> None:
+    from cache import user_cache
+
+    register_user(client, name="gone", password="pass")
+    headers = auth_header(login_user(client, name="gone", password="pass"))
+    assert client.get("/get-my-friends/1", headers=headers).status_code == 200
+    assert user_cache.get(1) is not None
+
+    client.delete("/force-delete-user", params={"name": "gone"})
+
+    assert user_cache.get(1) is None
+    assert client.get("/get-my-friends/1", headers=headers).status_code == 401
+
+
+def test_entry_ttl_can_only_shorten_the_lifetime() -> None:
+    from cache import TTLCache
+
+    clock = FakeClock()
+    cache = TTLCache(maxsize=4, ttl=10, clock=clock)
+    cache.put("short", 1, ttl=2)
+    cache.put("long", 2, ttl=100)
+    cache.put("expired", 3, ttl=-1)
+
+    clock.now = 5
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    clock.now = 10
+    assert cache.get("long") is None
+    assert cache.get("expired") is None
+
+
+def test_a_value_read_before_an_invalidation_is_not_cached() -> None:
+    from cache import TTLCache
+
+    cache = TTLCache(maxsize=4, ttl=10)
+    generation = cache.generation
+    # another request changes the row and invalidates it after this one
+    # read it, but before this one caches it
+    cache.invalidate(1)
+    cache.put(1, "old", generation=generation)
+    assert cache.get(1) is None
+
+    cache.put(1, "new", generation=cache.generation)
+    assert cache.get(1) == "new"
+
+
+def test_tokens_are_verified_once_until_they_expire(monkeypatch) -> None:
+    from datetime import datetime, timedelta
+    from jose import JWTError, jwt
+    import utils
+
+    decoded = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(utils.jwt, "decode", counting_decode)
+
+    token = utils.create_access_token({"sub": "cached", "user_id": 7, "role": "user"})
+    assert utils.decode_token(token)["user_id"] == 7
+    assert utils.decode_token(token)["user_id"] == 7
+    assert decoded == [token]
+
+    expired = jwt.encode(
+        {"user_id": 7, "exp": datetime.utcnow() - timedelta(minutes=1)},
+        utils.SECRET_KEY,
+        algorithm=utils.ALGORITHM,
+    )
+    for _ in range(2):
+        with pytest.raises(JWTError):
+            utils.decode_token(expired)
+    assert decoded.count(expired) == 2
@@ -0,0 +1,347 @@
+import asyncio
+import threading
+import pytest
+from database import ConnectionPool
+
+
+def test_pool_reuses_connections(tmp_path) -> None:
+    pool = ConnectionPool(str(tmp_path / "pool.db"))
+
+    conn = pool.acquire()
+    conn.close()
+    again = pool.acquire()
+
+    assert again is conn
+    # every commit is synced unless a deployment opts out
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+    pool.close()
+
+
+def test_pool_applies_pragmas(tmp_path) -> None:
+    pool = ConnectionPool(
+        str(tmp_path / "pool.db"),
+        synchronous="NORMAL",
+        cache_size=-2000,
+        busy_timeout=1234,
+    )
+    conn = pool.acquire()
+
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert conn.execute("PRAGMA cache_size").fetchone()[0] == -2000
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 1234
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    conn.close()
+    pool.close()
+
+
+def test_pool_is_bounded_per_thread(tmp_path) -> None:
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_per_thread=2)
+
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        conn.close()
+
+    assert len(pool._idle()) == 2
+    assert len(pool._connections) == 2
+    pool.close()
+
+
+def test_pool_keeps_idle_connections_per_thread(tmp_path) -> None:
+    pool = ConnectionPool(str(tmp_path / "pool.db"))
+    conn = pool.acquire()
+    conn.close()
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.acquire()))
+    thread.start()
+    thread.join()
+
+    assert other[0] is not conn
+    other[0].close()
+    pool.close()
+
+
+def test_release_rolls_back_uncommitted_work(tmp_path) -> None:
+    pool = ConnectionPool(str(tmp_path / "pool.db"))
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE items(id INTEGER PRIMARY KEY)")
+    conn.execute("INSERT INTO items (id) VALUES (1)")
+    conn.close()
+
+    conn = pool.acquire()
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+    conn.close()
+    pool.close()
+
+
+def test_closed_pool_rejects_acquire(tmp_path) -> None:
+    pool = ConnectionPool(str(tmp_path / "pool.db"))
+    pool.close()
+
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+
+def test_invalid_pragma_value_is_rejected(tmp_path) -> None:
+    with pytest.raises(ValueError):
+        ConnectionPool(str(tmp_path / "pool.db"), synchronous="SOMETIMES")
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class _Request:
+    def __init__(self, method: str):
+        self.method = method
+
+
+def _count_tags() -> int:
+    import database
+
+    conn = database.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_get_db_commits_when_request_succeeds(client) -> None:
+    import database
+
+    async def request():
+        session = database.get_db(_Request("POST"))
+        db = await session.__anext__()
+        await db.execute("INSERT INTO tags (content) VALUES ('kept')")
+        with pytest.raises(StopAsyncIteration):
+            await session.__anext__()
+
+    _run(request())
+    assert _count_tags() == 1
+
+
+def test_get_db_rolls_back_when_request_fails(client) -> None:
+    import database
+
+    async def request():
+        session = database.get_db(_Request("POST"))
+        db = await session.__anext__()
+        await db.execute("INSERT INTO tags (content) VALUES ('dropped')")
+        with pytest.raises(ValueError):
+            await session.athrow(ValueError("handler failed"))
+
+    _run(request())
+    assert _count_tags() == 0
+
+
+def test_session_reads_use_reader_lane_until_first_write(client) -> None:
+    import database
+
+    async def request():
+        db = database.AsyncSession(database.executor)
+        await db.fetchone("SELECT 1")
+        assert not db.in_write
+        assert not database.executor.writer_lock.locked()
+
+        await db.execute("INSERT INTO tags (content) VALUES ('x')")
+        assert db.in_write
+        assert database.executor.writer_lock.locked()
+        # reads after the first write see the uncommitted row
+        assert (await db.fetchone("SELECT COUNT(*) FROM tags"))[0] == 1
+
+        await db.close()
+        assert not database.executor.writer_lock.locked()
+
+    _run(request())
+    assert _count_tags() == 1
+
+
+def test_writes_are_serialized_through_one_writer(client) -> None:
+    import database
+
+    async def writer(name: str, order: list):
+        db = database.AsyncSession(database.executor)
+        await db.execute("INSERT INTO tags (content) VALUES (?)", (name,))
+        order.append(f"{name}-start")
+        await asyncio.sleep(0.01)
+        order.append(f"{name}-end")
+        await db.close()
+
+    async def requests():
+        order = []
+        await asyncio.gather(writer("a", order), writer("b", order))
+        return order
+
+    order = _run(requests())
+    assert order in (
+        ["a-start", "a-end", "b-start", "b-end"],
+        ["b-start", "b-end", "a-start", "a-end"],
+    )
+    assert _count_tags() == 2
+
+
+def test_authenticated_request_uses_one_session(client, monkeypatch) -> None:
+    import database
+    from helpers import register_user, login_user, auth_header
+
+    register_user(client, name="alice", password="pass")
+    token = login_user(client, name="alice", password="pass")
+
+    sessions = []
+
+    class CountingSession(database.AsyncSession):
+        def __init__(self, db_executor, **kwargs):
+            super().__init__(db_executor, **kwargs)
+            sessions.append(self)
+
+    monkeypatch.setattr(database, "AsyncSession", CountingSession)
+    response = client.get("/get-my-friends/1", headers=auth_header(token))
+
+    assert response.status_code == 200
+    assert len(sessions) == 1
+
+
+def test_group_commit_batches_concurrent_writes(client, monkeypatch) -> None:
+    import database
+
+    queue = database.executor.queue
+    batches = []
+    apply = queue._apply
+
+    def recording_apply(batch):
+        batches.append(len(batch))
+        return apply(batch)
+
+    monkeypatch.setattr(queue, "_apply", recording_apply)
+
+    async def requests():
+        db = database.AsyncSession(database.executor)
+        ids = await asyncio.gather(
+            *(
+                db.execute_batched("INSERT INTO tags (content) VALUES (?)", (str(i),))
+                for i in range(20)
+            )
+        )
+        await queue.close()
+        return ids
+
+    ids = _run(requests())
+    assert sorted(ids) == list(range(1, 21))
+    assert batches == [20]
+    assert _count_tags() == 20
+
+
+def test_group_commit_reports_failures_per_caller(client) -> None:
+    import sqlite3
+    import database
+
+    conn = database.get_db_connection()
+    conn.execute("INSERT INTO users (name, password, role) VALUES ('a', 'p', 'user')")
+    conn.execute("INSERT INTO users (name, password, role) VALUES ('b', 'p', 'user')")
+    conn.execute("INSERT INTO users (name, password, role) VALUES ('c', 'p', 'user')")
+    conn.commit()
+    conn.close()
+
+    async def requests():
+        db = database.AsyncSession(database.executor)
+        insert = (
+            "INSERT INTO friends (user_low, user_high, requester_id) VALUES (?, ?, ?)"
+        )
+        results = await asyncio.gather(
+            db.execute_batched(insert, (1, 2, 1)),
+            db.execute_batched(insert, (1, 2, 2)),
+            db.execute_batched(insert, (1, 3, 3)),
+            return_exceptions=True,
+        )
+        await database.executor.queue.close()
+        return results
+
+    results = _run(requests())
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert not isinstance(results[0], Exception)
+    assert not isinstance(results[2], Exception)
+
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM friends").fetchone()[0] == 2
+    conn.close()
+
+
+def test_batched_write_joins_open_write_transaction(client) -> None:
+    import database
+
+    async def request():
+        db = database.AsyncSession(database.executor)
+        await db.execute("INSERT INTO tags (content) VALUES ('first')")
+        await db.execute_batched("INSERT INTO tags (content) VALUES ('second')")
+        await db.close(commit=False)
+
+    _run(request())
+    assert _count_tags() == 0
+
+
+def test_get_requests_get_read_only_sessions(client) -> None:
+    import database
+
+    async def request():
+        session = database.get_db(_Request("GET"))
+        db = await session.__anext__()
+        assert db.read_only
+        assert (await db.fetchone("SELECT COUNT(*) FROM tags"))[0] == 0
+        with pytest.raises(RuntimeError):
+            await db.execute("INSERT INTO tags (content) VALUES ('x')")
+        with pytest.raises(RuntimeError):
+            await db.execute_batched("INSERT INTO tags (content) VALUES ('x')")
+        with pytest.raises(StopAsyncIteration):
+            await session.__anext__()
+
+    _run(request())
+    assert not database.executor.writer_lock.locked()
+
+
+def test_read_pool_connections_are_read_only(client) -> None:
+    import sqlite3
+    import database
+
+    conn = database.read_pool.acquire()
+    assert conn.execute("PRAGMA query_only").fetchone()[0] == 1
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("INSERT INTO tags (content) VALUES ('x')")
+    conn.close()
+
+
+def test_read_only_pool_refuses_writes_without_query_only(tmp_path) -> None:
+    import sqlite3
+
+    writer = ConnectionPool(str(tmp_path / "pool.db"))
+    conn = writer.acquire()
+    conn.execute("CREATE TABLE items(id INTEGER PRIMARY KEY)")
+    conn.close()
+
+    reader = ConnectionPool(str(tmp_path / "pool.db"), read_only=True)
+    conn = reader.acquire()
+    conn.execute("PRAGMA query_only = OFF")
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        conn.execute("INSERT INTO items (id) VALUES (1)")
+    conn.close()
+    reader.close()
+    writer.close()
+
+
+def test_open_read_does_not_block_writer(client) -> None:
+    import database
+
+    reader = database.read_pool.acquire()
+    reader.execute("BEGIN")
+    assert reader.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 0
+
+    writer = database.get_db_connection()
+    writer.execute("INSERT INTO tags (content) VALUES ('x')")
+    writer.commit()
+    writer.close()
+
+    # the reader keeps its snapshot until its transaction ends
+    assert reader.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 0
+    reader.rollback()
+    assert reader.execute("SELECT COUNT(*) FROM tags").fetchone()[0] == 1
+    reader.close()
@@ -0,0 +1,257 @@
+import sqlite3
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+def _users(client: TestClient, *names: str) -> list:
+    headers = []
+    for name in names:
+        register_user(client, name=name, password="pass")
+        headers.append(auth_header(login_user(client, name=name, password="pass")))
+    return headers
+
+
+def _befriend(client: TestClient, sender: dict, receiver_id: int, receiver: dict):
+    client.post(
+        "/send-friend-request", params={"receiver_id": receiver_id}, headers=sender
+    )
+    return client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=receiver,
+    )
+
+
+def _sql(response) -> int:
+    return int(response.headers["X-Query-Count"])
+
+
+def test_changes_during_a_load_are_replayed() -> None:
+    from friend_graph import FriendGraph
+
+    graph = FriendGraph()
+    graph.add(1, 2)
+    assert not graph.are_friends(1, 2)
+
+    graph.begin_load()
+    graph.add(3, 4)
+    graph.remove(1, 2)
+    # the rows were read before either change committed
+    graph.load([(1, 2)])
+
+    assert graph.are_friends(4, 3)
+    assert not graph.are_friends(1, 2)
+    assert len(graph) == 1
+    assert graph.friends_of(3) == {4}
+
+
+def test_friendship_checks_use_the_graph(client: TestClient) -> None:
+    alice, bob = _users(client, "alice", "bob")
+    _befriend(client, alice, 2, bob)
+
+    def send():
+        return client.post(
+            "/send-message", params={"receiver_id": 2, "content": "hi"}, headers=alice
+        )
+
+    first = send()
+    assert first.status_code == 200
+    # the receiver's existence, the change log's last id and the insert: the
+    # caller is cached and the friendship is a graph lookup
+    assert _sql(send()) == 3
+
+    assert (
+        client.delete(
+            "/remove-friend", params={"friend_id": 1}, headers=bob
+        ).status_code
+        == 200
+    )
+    assert send().status_code == 403
+
+
+def test_friends_only_stories_follow_the_graph(client: TestClient) -> None:
+    alice, bob, eve = _users(client, "alice", "bob", "eve")
+    _befriend(client, alice, 2, bob)
+    client.post(
+        "/create-story",
+        params={"content": "for friends", "visibility": "friends"},
+        headers=alice,
+    )
+
+    def stories(headers: dict) -> list:
+        response = client.get("/get-stories", headers=headers)
+        return [story["content"] for story in response.json()["stories"]]
+
+    assert stories(bob) == ["for friends"]
+    assert stories(eve) == []
+
+    client.delete("/force-delete-user", params={"name": "bob"})
+    from friend_graph import friend_graph
+
+    assert friend_graph.friends_of(1) == frozenset()
+
+
+def test_graph_is_loaded_from_existing_rows(client: TestClient, tmp_path) -> None:
+    import database
+
+    _users(client, "alice", "bob")
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    conn.execute("""
+        INSERT INTO friends (user_low, user_high, requester_id, status)
+        VALUES (1, 2, 2, 'accepted')
+        """)
+    conn.commit()
+    conn.close()
+
+    # a database configured without the app lifespan loads it on first use
+    database.configure(str(tmp_path / "test.db"))
+    alice = auth_header(login_user(client, name="alice", password="pass"))
+    response = client.post(
+        "/send-message", params={"receiver_id": 2, "content": "hi"}, headers=alice
+    )
+    assert response.status_code == 200
+
+
+def test_reload_is_due_once_per_interval() -> None:
+    from friend_graph import FriendGraph
+
+    now = [0.0]
+    graph = FriendGraph(refresh_interval=5, clock=lambda: now[0])
+    assert not graph.refresh_due()
+    graph.load([(1, 2)])
+
+    now[0] = 4.9
+    assert not graph.refresh_due()
+    now[0] = 5.0
+    assert graph.refresh_due()
+    # claimed by the first caller
+    assert not graph.refresh_due()
+
+    # a reload replaces the loaded rows and replays what committed meanwhile
+    graph.begin_load()
+    graph.add(3, 4)
+    assert graph.are_friends(3, 4)
+    graph.load([(1, 2), (2, 5)])
+    assert graph.friends_of(2) == {1, 5}
+    assert graph.are_friends(4, 3)
+
+
+def test_other_processes_changes_reach_the_graph(client: TestClient, tmp_path) -> None:
+    from friend_graph import friend_graph
+
+    alice, bob = _users(client, "alice", "bob")
+    # another worker accepts the friendship
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    conn.execute("""
+        INSERT INTO friends (user_low, user_high, requester_id, status)
+        VALUES (1, 2, 2, 'accepted')
+        """)
+    conn.commit()
+    conn.close()
+
+    # a permission check applies the logged change before it is answered
+    response = client.post(
+        "/send-message", params={"receiver_id": 2, "content": "hi"}, headers=alice
+    )
+    assert response.status_code == 200
+    assert friend_graph.mark == 1
+    assert client.get("/get-my-friends/1", headers=alice).json()["total"] == 1
+
+    # and so does a removal
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    conn.execute("DELETE FROM friends")
+    conn.commit()
+    conn.close()
+    response = client.post(
+        "/send-message", params={"receiver_id": 2, "content": "hi"}, headers=alice
+    )
+    assert response.status_code == 403
+    assert friend_graph.mark == 2
+
+
+def test_a_trimmed_change_log_reloads_the_graph(
+    client: TestClient, tmp_path, monkeypatch
+) -> None:
+    from friend_graph import friend_graph
+
+    alice, _, _ = _users(client, "alice", "bob", "carol")
+    monkeypatch.setattr(friend_graph, "refresh_interval", 0)
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    conn.execute("INSERT INTO friends VALUES (1, 2, 2, 'accepted')")
+    conn.commit()
+    assert client.get("/get-my-friends/1", headers=alice).json()["total"] == 1
+
+    # one friendship ends and another starts, and a newer snapshot trims both
+    # changes from the log before this process reads them
+    conn.execute("DELETE FROM friends")
+    conn.execute("INSERT INTO friends VALUES (1, 3, 3, 'accepted')")
+    conn.execute("DELETE FROM friend_changes")
+    conn.commit()
+    conn.close()
+
+    assert client.get("/get-my-friends/1", headers=alice).json()["total"] == 1
+    assert friend_graph.friends_of(1) == {3}
+    assert friend_graph.mark == 3
+
+
+def test_the_change_log_is_trimmed_to_the_slowest_reader(
+    client: TestClient, tmp_path
+) -> None:
+    import change_log
+    from friend_graph import friend_graph
+    from repositories import open_repositories
+
+    alice, bob, carol = _users(client, "alice", "bob", "carol")
+    _befriend(client, alice, 2, bob)
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+
+    def log() -> list:
+        return [row[0] for row in conn.execute("SELECT id FROM friend_changes")]
+
+    async def trim(reader: str, now: float) -> int:
+        async with open_repositories() as repos:
+            return await repos.friends.trim_changes(reader, now, now - 180)
+
+    # another process still needs everything after the first change
+    conn.execute("INSERT INTO friend_graph_readers VALUES ('other', 0, 100)")
+    conn.commit()
+    _befriend(client, alice, 3, carol)
+    assert client.portal.call(trim, "this", 200) == 0
+    assert log() == [1, 2]
+
+    # once it catches up, or goes quiet, the log is trimmed to this process
+    conn.execute("UPDATE friend_graph_readers SET mark = 1 WHERE reader = 'other'")
+    conn.commit()
+    assert client.portal.call(trim, "this", 200) == 1
+    assert log() == [2]
+    assert client.portal.call(trim, "this", 1000) == 1
+    assert log() == []
+    conn.close()
+
+    # the graph follows later changes without a reload, and the readers not
+    # heard from in three intervals no longer hold the log back
+    client.delete("/remove-friend", params={"friend_id": 1}, headers=bob)
+    assert friend_graph.mark == 2
+    assert client.portal.call(change_log.trim, 60) == 1
+    assert friend_graph.mark == 3
+    assert friend_graph.friends_of(1) == {3}
+
+
+def test_paths_are_shortest_and_depth_limited() -> None:
+    from friend_graph import FriendGraph
+
+    graph = FriendGraph()
+    # a long way round 1-2-3-4-5-6 and a shortcut 1-7-6
+    graph.load([(1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (1, 7), (6, 7), (8, 9)])
+
+    assert graph.path(1, 6, max_depth=6) == [1, 7, 6]
+    assert graph.path(6, 3, max_depth=6) == [6, 5, 4, 3]
+    assert graph.path(1, 4, max_depth=2) is None
+    assert graph.path(1, 8, max_depth=6) is None
+    assert graph.path(1, 1, max_depth=1) == [1]
+
+    graph.add(2, 5)
+    assert graph.path(1, 5, max_depth=2) == [1, 2, 5]
+    assert graph.mutual_friends(1, 6) == [7]
+    assert graph.mutual_friends(3, 5) == [2, 4]
+    assert graph.mutual_friends(1, 99) == []
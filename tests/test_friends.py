@@ -166,3 +166,283 @@ def test_duplicate_friend_request(client: TestClient) -> None:
     )
     assert response.status_code == 200
     assert "already" in response.json()["message"]
+
+
+def test_reverse_friend_request_is_refused(client: TestClient) -> None:
+    register_user(client, name="alice", password="pass")
+    register_user(client, name="bob", password="pass")
+    alice = auth_header(login_user(client, name="alice", password="pass"))
+    bob = auth_header(login_user(client, name="bob", password="pass"))
+
+    client.post("/send-friend-request", params={"receiver_id": 2}, headers=alice)
+    response = client.post(
+        "/send-friend-request", params={"receiver_id": 1}, headers=bob
+    )
+    assert "already" in response.json()["message"]
+
+    # only the receiver can answer a request
+    answer = client.post(
+        "/respond-friend-request",
+        params={"sender_id": 2, "action": "accept"},
+        headers=alice,
+    )
+    assert answer.status_code == 404
+    answer = client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=bob,
+    )
+    assert answer.status_code == 200
+
+    friends = client.get("/get-my-friends/2", headers=bob).json()["friends"]
+    assert friends == [{"id": 1, "name": "alice"}]
+
+
+def _friends_of_alice(client: TestClient, names: list[str]) -> dict:
+    register_user(client, name="alice", password="pass")
+    alice = auth_header(login_user(client, name="alice", password="pass"))
+    headers = {"alice": alice}
+    for user_id, name in enumerate(names, start=2):
+        register_user(client, name=name, password="pass")
+        headers[name] = auth_header(login_user(client, name=name, password="pass"))
+        client.post(
+            "/send-friend-request", params={"receiver_id": user_id}, headers=alice
+        )
+        client.post(
+            "/respond-friend-request",
+            params={"sender_id": 1, "action": "accept"},
+            headers=headers[name],
+        )
+    return headers
+
+
+def test_friends_are_paged_by_id(client: TestClient) -> None:
+    headers = _friends_of_alice(client, ["bob", "bea", "carl", "ben", "dan"])
+
+    pages, after = [], None
+    while True:
+        params = {"limit": 2} if after is None else {"limit": 2, "after": after}
+        body = client.get(
+            "/get-my-friends/1", params=params, headers=headers["alice"]
+        ).json()
+        assert body["total"] == 5
+        pages.append([friend["id"] for friend in body["friends"]])
+        after = body["next_cursor"]
+        if after is None:
+            break
+    assert pages == [[2, 3], [4, 5], [6]]
+
+    body = client.get(
+        "/get-my-friends/1", params={"prefix": "be"}, headers=headers["alice"]
+    ).json()
+    assert body["friends"] == [{"id": 3, "name": "bea"}, {"id": 5, "name": "ben"}]
+    assert body["total"] == 5
+
+
+def test_other_users_friends_are_visible_to_their_friends(client: TestClient) -> None:
+    headers = _friends_of_alice(client, ["bob"])
+    register_user(client, name="eve", password="pass")
+    eve = auth_header(login_user(client, name="eve", password="pass"))
+
+    seen_by_bob = client.get("/get-my-friends/1", headers=headers["bob"])
+    assert seen_by_bob.json()["friends"] == [{"id": 2, "name": "bob"}]
+    assert client.get("/get-my-friends/1", headers=eve).status_code == 403
+
+
+def test_mutual_friends_are_counted_and_listed(client: TestClient) -> None:
+    headers = _friends_of_alice(client, ["bob", "carl", "dan"])
+    register_user(client, name="eve", password="pass")
+    eve = auth_header(login_user(client, name="eve", password="pass"))
+    for name in ("carl", "dan"):
+        client.post(
+            "/send-friend-request", params={"receiver_id": 5}, headers=headers[name]
+        )
+        client.post(
+            "/respond-friend-request",
+            params={"sender_id": {"carl": 3, "dan": 4}[name], "action": "accept"},
+            headers=eve,
+        )
+
+    # like a friend list, only for friends of other_id
+    response = client.get(
+        "/mutual-friends", params={"other_id": 5}, headers=headers["alice"]
+    )
+    assert response.status_code == 403
+
+    client.post(
+        "/send-friend-request", params={"receiver_id": 5}, headers=headers["alice"]
+    )
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=eve,
+    )
+    body = client.get(
+        "/mutual-friends", params={"other_id": 5}, headers=headers["alice"]
+    ).json()
+    assert body == {
+        "count": 2,
+        "mutual_friends": [{"id": 3, "name": "carl"}, {"id": 4, "name": "dan"}],
+    }
+
+    body = client.get(
+        "/mutual-friends", params={"other_id": 1, "limit": 0}, headers=eve
+    ).json()
+    assert body == {"count": 2, "mutual_friends": []}
+
+
+def test_connection_path_between_users(client: TestClient) -> None:
+    headers = _friends_of_alice(client, ["bob", "carl"])
+    register_user(client, name="eve", password="pass")
+    eve = auth_header(login_user(client, name="eve", password="pass"))
+    client.post(
+        "/send-friend-request", params={"receiver_id": 4}, headers=headers["bob"]
+    )
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 2, "action": "accept"},
+        headers=eve,
+    )
+
+    response = client.get("/connection-path", params={"other_id": 1}, headers=eve)
+    assert response.status_code == 200
+    assert response.json() == {
+        "degrees": 2,
+        "path": [
+            {"id": 4, "name": "eve"},
+            {"id": 2, "name": "bob"},
+            {"id": 1, "name": "alice"},
+        ],
+    }
+
+    response = client.get(
+        "/connection-path", params={"other_id": 3, "max_depth": 2}, headers=eve
+    )
+    assert response.status_code == 404
+    response = client.get("/connection-path", params={"other_id": 3}, headers=eve)
+    assert response.json()["degrees"] == 3
+
+
+def test_connection_path_hides_hops_beyond_friends_of_friends(
+    client: TestClient,
+) -> None:
+    headers = _friends_of_alice(client, ["bob", "carl"])
+    for name in ("eve", "fay"):
+        register_user(client, name=name, password="pass")
+        headers[name] = auth_header(login_user(client, name=name, password="pass"))
+    # eve - bob - alice - carl - fay
+    for sender, receiver_id, receiver, sender_id in [
+        ("bob", 4, "eve", 2),
+        ("carl", 5, "fay", 3),
+    ]:
+        client.post(
+            "/send-friend-request",
+            params={"receiver_id": receiver_id},
+            headers=headers[sender],
+        )
+        client.post(
+            "/respond-friend-request",
+            params={"sender_id": sender_id, "action": "accept"},
+            headers=headers[receiver],
+        )
+
+    response = client.get(
+        "/connection-path", params={"other_id": 5}, headers=headers["eve"]
+    )
+    assert response.json() == {
+        "degrees": 4,
+        "path": [
+            {"id": 4, "name": "eve"},
+            {"id": 2, "name": "bob"},
+            {"id": 1, "name": "alice"},
+            None,
+            {"id": 5, "name": "fay"},
+        ],
+    }
+
+
+def _inbox(client: TestClient, headers: dict, **params) -> list:
+    pages, after = [], None
+    while True:
+        page = (
+            {"limit": 1, **params}
+            if after is None
+            else {"limit": 1, "after": after, **params}
+        )
+        body = client.get("/friend-requests", params=page, headers=headers).json()
+        pages.extend(request["name"] for request in body["requests"])
+        after = body["next_cursor"]
+        if after is None:
+            return pages
+
+
+def test_pending_requests_are_listed_both_ways(client: TestClient) -> None:
+    headers = {}
+    for name in ("bob", "alice", "carl", "dan", "eve", "fay"):
+        register_user(client, name=name, password="pass")
+        headers[name] = auth_header(login_user(client, name=name, password="pass"))
+    for sender, receiver_id in [("bob", 2), ("dan", 2), ("alice", 3), ("alice", 5)]:
+        client.post(
+            "/send-friend-request",
+            params={"receiver_id": receiver_id},
+            headers=headers[sender],
+        )
+    client.post(
+        "/send-friend-request", params={"receiver_id": 2}, headers=headers["fay"]
+    )
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 6, "action": "accept"},
+        headers=headers["alice"],
+    )
+
+    assert _inbox(client, headers["alice"]) == ["bob", "dan"]
+    assert _inbox(client, headers["alice"], direction="outgoing") == ["carl", "eve"]
+    assert _inbox(client, headers["carl"]) == ["alice"]
+    assert _inbox(client, headers["carl"], direction="outgoing") == []
+
+
+def test_requests_are_answered_in_bulk(client: TestClient) -> None:
+    headers = {}
+    for name in ("alice", "bob", "carl", "dan"):
+        register_user(client, name=name, password="pass")
+        headers[name] = auth_header(login_user(client, name=name, password="pass"))
+        if name != "alice":
+            client.post(
+                "/send-friend-request", params={"receiver_id": 1}, headers=headers[name]
+            )
+
+    response = client.post(
+        "/respond-friend-requests",
+        json=[
+            {"sender_id": 2, "action": "accept"},
+            {"sender_id": 3, "action": "decline"},
+            {"sender_id": 2, "action": "decline"},
+            {"sender_id": 99, "action": "accept"},
+            {"sender_id": 4, "action": "accept"},
+        ],
+        headers=headers["alice"],
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "accepted": 2,
+        "declined": 1,
+        "results": [
+            {"sender_id": 2, "result": "accepted"},
+            {"sender_id": 3, "result": "declined"},
+            {"sender_id": 2, "result": "not_found"},
+            {"sender_id": 99, "result": "not_found"},
+            {"sender_id": 4, "result": "accepted"},
+        ],
+    }
+    friends = client.get("/get-my-friends/1", headers=headers["alice"]).json()
+    assert [friend["name"] for friend in friends["friends"]] == ["bob", "dan"]
+    assert _inbox(client, headers["alice"]) == []
+    # the accepted friendships are in the graph right away
+    response = client.post(
+        "/send-message",
+        params={"receiver_id": 4, "content": "hi"},
+        headers=headers["alice"],
+    )
+    assert response.status_code == 200
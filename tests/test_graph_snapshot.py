@@ -0,0 +1,211 @@
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+def _users(client: TestClient, count: int) -> list:
+    headers = []
+    for i in range(count):
+        register_user(client, name=f"user{i}", password="pass")
+        headers.append(
+            auth_header(login_user(client, name=f"user{i}", password="pass"))
+        )
+    return headers
+
+
+def _befriend(client: TestClient, users: list, sender_id: int, receiver_id: int):
+    client.post(
+        "/send-friend-request",
+        params={"receiver_id": receiver_id},
+        headers=users[sender_id - 1],
+    )
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": sender_id, "action": "accept"},
+        headers=users[receiver_id - 1],
+    )
+
+
+def _adjacency(graph, user_count: int) -> dict:
+    return {user_id: graph.friends_of(user_id) for user_id in range(user_count + 2)}
+
+
+def test_snapshot_stores_sorted_neighbours(tmp_path) -> None:
+    from graph_snapshot import CSRSnapshot, write_snapshot
+    from migrations import migrate
+
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'x', 'user')",
+        [(f"user{i}",) for i in range(6)],
+    )
+    conn.executemany(
+        "INSERT INTO friends VALUES (?, ?, ?, ?)",
+        [(1, 5, 1, "accepted"), (1, 3, 1, "accepted"), (3, 5, 5, "pending")],
+    )
+    conn.commit()
+
+    snapshot = write_snapshot(conn, str(tmp_path / "graph.csr"))
+    reopened = CSRSnapshot(str(tmp_path / "graph.csr"))
+    conn.close()
+
+    for csr in (snapshot, reopened):
+        assert list(csr.neighbours(1)) == [3, 5]
+        assert list(csr.neighbours(5)) == [1]
+        assert list(csr.neighbours(2)) == []
+        assert list(csr.neighbours(99)) == []
+        assert csr.has_edge(3, 1) and not csr.has_edge(3, 5)
+        assert csr.degree(1) == 2
+        assert csr.edges == 4
+        assert csr.mark == 2
+
+
+def test_snapshot_plus_changes_matches_the_table(client: TestClient, tmp_path) -> None:
+    import database
+    from friend_graph import FriendGraph
+    from graph_snapshot import changes_since, write_snapshot
+
+    users = _users(client, 6)
+    for pair in [(1, 2), (1, 3), (2, 3), (3, 4), (4, 5)]:
+        _befriend(client, users, *pair)
+    conn = database.get_db_connection()
+    snapshot = write_snapshot(conn, str(tmp_path / "graph.csr"))
+
+    # changes after the snapshot, including a cascade from a deleted user
+    _befriend(client, users, 5, 6)
+    _befriend(client, users, 1, 6)
+    client.delete("/remove-friend", params={"friend_id": 3}, headers=users[0])
+    client.delete("/remove-friend", params={"friend_id": 6}, headers=users[0])
+    client.delete("/force-delete-user", params={"name": "user3"})
+    _befriend(client, users, 2, 5)
+
+    from_table, from_snapshot = FriendGraph(), FriendGraph()
+    from_table.load(
+        conn.execute(
+            "SELECT user_low, user_high FROM friends WHERE status = 'accepted'"
+        ).fetchall()
+    )
+    from_snapshot.load_snapshot(snapshot, changes_since(conn, snapshot.mark))
+    conn.close()
+
+    assert _adjacency(from_snapshot, 6) == _adjacency(from_table, 6)
+    assert len(from_snapshot) == len(from_table) == 4
+    assert from_snapshot.count(2) == 3
+    assert from_snapshot.mutual_friends(2, 6) == [5]
+    assert from_snapshot.path(1, 6, max_depth=6) == [1, 2, 5, 6]
+
+    from_snapshot.remove_users([5])
+    assert from_snapshot.friends_of(2) == {1, 3}
+    assert len(from_snapshot) == 2
+
+
+def test_writing_a_snapshot_trims_the_change_log(tmp_path) -> None:
+    from graph_snapshot import write_snapshot
+    from migrations import migrate
+
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'x', 'user')",
+        [(f"user{i}",) for i in range(4)],
+    )
+
+    def changes() -> list:
+        return [row[0] for row in conn.execute("SELECT id FROM friend_changes")]
+
+    path = str(tmp_path / "graph.csr")
+    conn.execute("INSERT INTO friends VALUES (1, 2, 1, 'accepted')")
+    conn.commit()
+    assert write_snapshot(conn, path).mark == 1
+    assert changes() == []
+
+    # a running process whose graph has applied only the first change
+    conn.execute("INSERT INTO friend_graph_readers VALUES ('worker', 1, 0)")
+    conn.execute("INSERT INTO friends VALUES (1, 3, 1, 'accepted')")
+    conn.execute("INSERT INTO friends VALUES (1, 4, 1, 'accepted')")
+    conn.commit()
+    assert write_snapshot(conn, path).mark == 3
+    assert changes() == [2, 3]
+    # workers mapping the previous snapshot would replay from it too
+    conn.execute("UPDATE friend_graph_readers SET mark = 3")
+    conn.execute("DELETE FROM friends WHERE user_high = 4")
+    conn.commit()
+    assert write_snapshot(conn, path).mark == 4
+    assert changes() == [4]
+    conn.close()
+
+
+def test_a_snapshot_older_than_the_log_is_not_used(tmp_path) -> None:
+    from friend_graph import friend_graph
+    from graph_snapshot import write_snapshot
+    from migrations import migrate
+    from repositories.sqlite import load_friend_graph
+
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'x', 'user')",
+        [(f"user{i}",) for i in range(3)],
+    )
+    conn.execute("INSERT INTO friends VALUES (1, 2, 1, 'accepted')")
+    conn.commit()
+    snapshot = write_snapshot(conn, str(tmp_path / "graph.csr"))
+    # a change right after the snapshot is trimmed before this worker starts
+    conn.execute("DELETE FROM friends")
+    conn.execute("INSERT INTO friends VALUES (2, 3, 2, 'accepted')")
+    conn.execute("DELETE FROM friend_changes WHERE id = 2")
+    conn.commit()
+
+    friend_graph.clear()
+    load_friend_graph(conn, snapshot)
+
+    assert friend_graph.friends_of(2) == {3}
+    assert friend_graph.mark == 3
+    conn.close()
+
+
+def test_workers_start_from_the_snapshot(tmp_path, monkeypatch) -> None:
+    import database
+    import graph_snapshot
+    from friend_graph import friend_graph
+
+    database.configure(str(tmp_path / "test.db"))
+    from main import app
+
+    with TestClient(app) as client:
+        users = _users(client, 3)
+        _befriend(client, users, 1, 2)
+        conn = database.get_db_connection()
+        graph_snapshot.write_snapshot(conn, str(tmp_path / "graph.csr"))
+        conn.close()
+        _befriend(client, users, 2, 3)
+    database.close()
+
+    monkeypatch.setattr(
+        "main.open_snapshot",
+        lambda: graph_snapshot.open_snapshot(str(tmp_path / "graph.csr")),
+    )
+    database.configure(str(tmp_path / "test.db"))
+    with TestClient(app) as client:
+        assert friend_graph.friends_of(2) == {1, 3}
+        response = client.post(
+            "/send-message",
+            params={"receiver_id": 3, "content": "hi"},
+            headers=auth_header(login_user(client, name="user1", password="pass")),
+        )
+        assert response.status_code == 200
+    database.close()
+
+
+def test_foreign_snapshots_are_refused(tmp_path) -> None:
+    from graph_snapshot import CSRSnapshot, open_snapshot
+
+    path = tmp_path / "graph.csr"
+    path.write_bytes(b"not a snapshot" * 4)
+
+    with pytest.raises(ValueError):
+        CSRSnapshot(str(path))
+    assert open_snapshot(str(path)) is None
+    assert open_snapshot(str(tmp_path / "missing.csr")) is None
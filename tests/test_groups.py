@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
 from helpers import register_user, login_user, auth_header
 
@@ -76,6 +77,29 @@ def test_add_duplicate_member(client: TestClient) -> None:
     assert "already" in response.json()["detail"]
 
 
+def test_concurrent_adds_of_one_member_add_it_once(client: TestClient) -> None:
+    register_user(client, name="owner", password="pass")
+    register_user(client, name="member", password="pass")
+    token = login_user(client, name="owner", password="pass")
+    _create_group(client, token, name="G", owner_id=1)
+
+    def add(_) -> int:
+        return client.post(
+            "/add-member",
+            params={"group_id": 1, "new_member_id": 2},
+            headers=auth_header(token),
+        ).status_code
+
+    with ThreadPoolExecutor(8) as pool:
+        assert sorted(pool.map(add, range(8))) == [200] + [400] * 7
+
+    import database
+
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM groups_users").fetchone()[0] == 1
+    conn.close()
+
+
 def test_add_member_nonexistent_group(client: TestClient) -> None:
     register_user(client, name="user1", password="pass")
     token = login_user(client, name="user1", password="pass")
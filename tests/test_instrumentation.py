@@ -0,0 +1,145 @@
+import logging
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+def _query_count(response) -> int:
+    assert response.status_code == 200, response.text
+    return int(response.headers["X-Query-Count"])
+
+
+def test_query_stats_headers_and_log_line(client: TestClient, caplog) -> None:
+    register_user(client)
+    token = login_user(client)
+
+    with caplog.at_level(logging.INFO, logger="social_media.queries"):
+        response = client.get("/get-my-friends/1", headers=auth_header(token))
+
+    # the auth lookup and the friends query
+    assert _query_count(response) == 2
+    assert float(response.headers["X-Query-Time-Ms"]) >= 0
+    assert any(
+        "GET /get-my-friends/1 status=200 queries=2" in record.getMessage()
+        for record in caplog.records
+    )
+
+
+def test_repeated_statement_is_reported() -> None:
+    from instrumentation import NPlusOneError, QueryStats
+
+    stats = QueryStats(repeat_limit=1)
+    stats.record("SELECT 1", 0.001)
+    stats.record("SELECT  1", 0.001)
+    assert stats.count == 2
+    assert stats.repeated == {"SELECT 1": 2}
+
+    strict = QueryStats(repeat_limit=1, strict=True)
+    strict.record("SELECT 1", 0.0)
+    with pytest.raises(NPlusOneError):
+        strict.record("SELECT 1", 0.0)
+
+
+def test_a_failing_statement_raises_its_own_error(client: TestClient) -> None:
+    import sqlite3
+    import database
+    from instrumentation import QueryStats
+
+    async def fail_twice():
+        db = database.AsyncSession(
+            database.executor, stats=QueryStats(repeat_limit=1, strict=True)
+        )
+        try:
+            # the second run is over the repeat limit, yet the constraint
+            # error is the one raised
+            for _ in range(2):
+                with pytest.raises(sqlite3.IntegrityError):
+                    await db.execute("INSERT INTO users (name) VALUES ('x')")
+        finally:
+            await db.close(commit=False)
+        return db.stats.count
+
+    assert client.portal.call(fail_twice) == 2
+
+
+def test_test_mode_fails_on_n_plus_one(client: TestClient, monkeypatch) -> None:
+    from instrumentation import NPlusOneError
+    from records import ReactionCount
+    from repositories.sqlite import SqliteReactionRepository
+
+    register_user(client)
+    headers = auth_header(login_user(client))
+    for i in range(2):
+        client.post(
+            "/create-story",
+            params={"content": f"s{i}", "visibility": "public"},
+            headers=headers,
+        )
+
+    async def counts_one_by_one(self, story_ids):
+        return {
+            story_id: await self.db.fetchall(
+                "SELECT emoji, COUNT(*) as count FROM stories_reaction "
+                "WHERE story_id = ? GROUP BY emoji",
+                (story_id,),
+                row_factory=ReactionCount.from_row,
+            )
+            for story_id in story_ids
+        }
+
+    monkeypatch.setattr(SqliteReactionRepository, "counts", counts_one_by_one)
+    with pytest.raises(NPlusOneError):
+        client.get("/get-stories", headers=headers)
+
+
+def test_get_stories_query_count_does_not_grow(client: TestClient) -> None:
+    register_user(client, name="alice", password="pass")
+    register_user(client, name="bob", password="pass")
+    alice = auth_header(login_user(client, name="alice", password="pass"))
+    bob = auth_header(login_user(client, name="bob", password="pass"))
+
+    def add_story(i):
+        response = client.post(
+            "/create-story",
+            params={"content": f"s{i}", "visibility": "public"},
+            headers=alice,
+        )
+        story_id = response.json()["story_id"]
+        client.post(
+            "/react-to-story", params={"story_id": story_id, "emoji": "🔥"}, headers=bob
+        )
+
+    add_story(0)
+    one = _query_count(client.get("/get-stories", headers=bob))
+    for i in range(1, 6):
+        add_story(i)
+    response = client.get("/get-stories", headers=bob)
+
+    assert len(response.json()["stories"]) == 6
+    assert _query_count(response) == one
+
+
+def test_create_post_query_count_does_not_grow(client: TestClient) -> None:
+    register_user(client)
+    headers = auth_header(login_user(client))
+
+    def create_post(tags):
+        return client.post(
+            "/create-post",
+            params={
+                "post_type": "text",
+                "content": "hello",
+                "visibility": "public",
+                "tags": tags,
+            },
+            headers=headers,
+        )
+
+    # the first request also loads the caller into the user cache
+    create_post([])
+    one = _query_count(create_post(["a"]))
+    many = _query_count(create_post(["a", "b", "c", "d", "e"]))
+    assert many == one
+
+    post = client.get("/get-post/3", headers=headers).json()
+    assert post["tags"] == ["a", "b", "c", "d", "e"]
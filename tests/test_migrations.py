@@ -0,0 +1,237 @@
+import sqlite3
+import pytest
+from migrations import MIGRATIONS, get_schema_version, migrate
+
+
+def test_migrations_are_numbered_in_order() -> None:
+    versions = [version for version, _description, _statements in MIGRATIONS]
+    assert versions == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_migrate_sets_user_version(tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "fresh.db"))
+
+    assert migrate(conn) == len(MIGRATIONS)
+    assert get_schema_version(conn) == len(MIGRATIONS)
+    # running again is a no-op
+    assert migrate(conn) == len(MIGRATIONS)
+    conn.close()
+
+
+def test_migrate_upgrades_legacy_database(tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "legacy.db"))
+    conn.execute("""
+        CREATE TABLE users(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('user', 'admin', 'guest')),
+            profile_image TEXT
+        )
+    """)
+    conn.execute("INSERT INTO users (name, password, role) VALUES ('a', 'b', 'user')")
+    conn.commit()
+
+    migrate(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+    indexes = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+    assert "idx_users_name" in indexes
+    conn.close()
+
+
+def test_migrate_retypes_link_tables_and_keeps_rows(tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "legacy.db"))
+    conn.execute("PRAGMA foreign_keys = ON")
+    for _version, _description, statements in MIGRATIONS[:1]:
+        for statement in statements:
+            conn.execute(statement)
+    conn.execute("PRAGMA user_version = 1")
+    conn.execute("INSERT INTO users (name, password, role) VALUES ('a', 'b', 'user')")
+    conn.execute("INSERT INTO groups (id, name, owner_id) VALUES (5, 'g', 1)")
+    conn.execute("INSERT INTO groups_users (group_id, user_id) VALUES (5, 1)")
+    conn.execute("DELETE FROM groups WHERE id = 5")
+    conn.execute("INSERT INTO groups (id, name, owner_id) VALUES (3, 'h', 1)")
+    conn.execute("INSERT INTO groups_users (group_id, user_id) VALUES (3, 1)")
+    conn.commit()
+
+    migrate(conn)
+
+    assert conn.execute("SELECT group_id, user_id FROM groups_users").fetchall() == [
+        (3, 1)
+    ]
+    # ids of deleted groups are still never reused
+    conn.execute("INSERT INTO groups (name, owner_id) VALUES ('new', 1)")
+    assert conn.execute("SELECT MAX(id) FROM groups").fetchone()[0] == 6
+    columns = {
+        row[1]: row[2] for row in conn.execute("PRAGMA table_info(groups_users)")
+    }
+    assert columns == {"group_id": "INTEGER", "user_id": "INTEGER"}
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    conn.close()
+
+
+def test_shard_files_get_their_own_schema(tmp_path) -> None:
+    from migrations import SHARD_MIGRATIONS, migrate_shards
+
+    directory = sqlite3.connect(str(tmp_path / "test.db"))
+    shard = sqlite3.connect(str(tmp_path / "test.shard1.db"))
+    directory.execute("PRAGMA foreign_keys = ON")
+    shard.execute("PRAGMA foreign_keys = ON")
+
+    assert migrate_shards([directory, shard]) == len(MIGRATIONS)
+    assert get_schema_version(shard) == len(SHARD_MIGRATIONS)
+    tables = {
+        row[0]
+        for row in shard.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    assert "posts" in tables and "users" not in tables
+    # both files start handing out ids above anything already stored
+    for conn in (directory, shard):
+        assert conn.execute("SELECT seq FROM id_sequence ORDER BY name").fetchall() == [
+            (1,),
+            (1,),
+        ]
+    directory.close()
+    shard.close()
+
+
+def test_directed_friend_rows_fold_into_pairs(tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "legacy.db"))
+    migrate(conn, MIGRATIONS[:5])
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'p', 'user')",
+        [(name,) for name in "abcd"],
+    )
+    conn.executemany(
+        "INSERT INTO friends (user_id, friend_id, status) VALUES (?, ?, ?)",
+        [
+            (1, 2, "pending"),
+            (2, 1, "accepted"),
+            (3, 1, "PENDING"),
+            (4, 4, "accepted"),
+            (4, 2, "accepted"),
+        ],
+    )
+    conn.commit()
+
+    migrate(conn)
+
+    rows = conn.execute(
+        "SELECT user_low, user_high, requester_id, status FROM friends ORDER BY 1, 2"
+    ).fetchall()
+    # the accepted direction wins; a friendship with yourself is dropped
+    assert rows == [
+        (1, 2, 2, "accepted"),
+        (1, 3, 3, "pending"),
+        (2, 4, 4, "accepted"),
+    ]
+    conn.close()
+
+
+def test_existing_posts_are_delivered_to_timelines(tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "legacy.db"))
+    migrate(conn, MIGRATIONS[:10])
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'p', 'user')",
+        [(name,) for name in "abcd"],
+    )
+    conn.execute("INSERT INTO friends VALUES (1, 2, 1, 'accepted')")
+    conn.execute("INSERT INTO friends VALUES (1, 4, 1, 'pending')")
+    conn.execute("INSERT INTO groups (name, owner_id) VALUES ('g', 1)")
+    conn.execute("INSERT INTO groups_users (group_id, user_id) VALUES (1, 3)")
+    conn.executemany(
+        "INSERT INTO posts (user_id, post_type, content, visibility, group_id) "
+        "VALUES (1, 'text', 'x', ?, ?)",
+        [("friends", None), ("group", 1), ("public", 1)],
+    )
+    conn.commit()
+
+    migrate(conn)
+
+    rows = conn.execute(
+        "SELECT user_id, post_id, group_id, via_group FROM timelines ORDER BY 1, 2"
+    ).fetchall()
+    assert rows == [
+        (1, 1, None, 0),
+        (1, 2, 1, 1),
+        (1, 3, 1, 0),
+        (2, 1, None, 0),
+        (2, 3, 1, 0),
+        (3, 2, 1, 1),
+    ]
+    conn.close()
+
+
+def test_shard_posts_are_delivered_to_timelines(tmp_path) -> None:
+    from migrations import SHARD_MIGRATIONS, migrate_shards
+
+    # a directory already on timelines, over a shard that predates them
+    directory = sqlite3.connect(str(tmp_path / "test.db"))
+    shard = sqlite3.connect(str(tmp_path / "test.shard1.db"))
+    migrate(directory)
+    migrate(shard, SHARD_MIGRATIONS[:1])
+    directory.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'p', 'user')",
+        [(name,) for name in "abcd"],
+    )
+    directory.execute("INSERT INTO friends VALUES (1, 2, 1, 'accepted')")
+    directory.execute("INSERT INTO friends VALUES (2, 4, 4, 'accepted')")
+    directory.execute("INSERT INTO groups (name, owner_id) VALUES ('g', 1)")
+    directory.execute("INSERT INTO groups_users (group_id, user_id) VALUES (1, 3)")
+    directory.execute("INSERT INTO pulled_authors VALUES (4)")
+    directory.commit()
+    shard.executemany(
+        "INSERT INTO posts (id, user_id, post_type, content, visibility, group_id) "
+        "VALUES (?, ?, 'text', 'x', ?, ?)",
+        [(1, 1, "friends", None), (4, 1, "group", 1), (7, 4, "public", None)],
+    )
+    shard.commit()
+
+    migrate_shards([directory, shard])
+
+    rows = directory.execute(
+        "SELECT user_id, post_id, group_id, via_group FROM timelines ORDER BY 1, 2"
+    ).fetchall()
+    # the pulled author's post reaches only the author's own timeline
+    assert rows == [
+        (1, 1, None, 0),
+        (1, 4, 1, 1),
+        (2, 1, None, 0),
+        (3, 4, 1, 1),
+        (4, 7, None, 0),
+    ]
+    assert get_schema_version(shard) == len(SHARD_MIGRATIONS)
+    assert [row[1] for row in shard.execute("PRAGMA database_list")] == ["main"]
+    directory.close()
+    shard.close()
+
+
+def test_names_and_memberships_become_unique(tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "legacy.db"))
+    migrate(conn, MIGRATIONS[:12])
+    conn.executemany(
+        "INSERT INTO users (name, password, role) VALUES (?, 'p', 'user')",
+        [("a",), ("b",)],
+    )
+    conn.execute("INSERT INTO groups (name, owner_id) VALUES ('g', 1)")
+    conn.executemany(
+        "INSERT INTO groups_users (group_id, user_id) VALUES (1, ?)", [(2,), (2,)]
+    )
+    conn.commit()
+
+    migrate(conn)
+
+    assert conn.execute("SELECT group_id, user_id FROM groups_users").fetchall() == [
+        (1, 2)
+    ]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute(
+            "INSERT INTO users (name, password, role) VALUES ('a', 'p', 'user')"
+        )
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO groups_users (group_id, user_id) VALUES (1, 2)")
+    conn.close()
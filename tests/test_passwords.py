@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user
+
+
+def _stored_password(tmp_path, name: str = "testuser") -> str:
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    (password,) = conn.execute(
+        "SELECT password FROM users WHERE name = ?", (name,)
+    ).fetchone()
+    conn.close()
+    return password
+
+
+def test_hashes_verify_and_record_their_cost() -> None:
+    from passwords import PasswordHasher, hash_password, verify_password
+
+    stored = hash_password("secret", cost=4)
+    assert stored.startswith("scrypt$4$")
+    assert stored != hash_password("secret", cost=4)
+    assert verify_password("secret", stored)
+    assert not verify_password("wrong", stored)
+
+    assert not PasswordHasher(cost=4, workers=0).needs_rehash(stored)
+    assert PasswordHasher(cost=5, workers=0).needs_rehash(stored)
+    assert PasswordHasher(cost=4, workers=0).needs_rehash("secret")
+
+
+def test_register_stores_a_hash(client: TestClient, tmp_path) -> None:
+    register_user(client)
+
+    stored = _stored_password(tmp_path)
+    assert stored.startswith("scrypt$")
+    assert "testpass" not in stored
+    assert login_user(client)
+
+
+def test_plaintext_password_is_hashed_on_login(client: TestClient, tmp_path) -> None:
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    conn.execute(
+        "INSERT INTO users (name, password, role) VALUES ('old', 'plain', 'user')"
+    )
+    conn.commit()
+    conn.close()
+
+    wrong = client.post("/auth/login", data={"username": "old", "password": "nope"})
+    assert wrong.status_code == 400
+    assert _stored_password(tmp_path, "old") == "plain"
+
+    assert login_user(client, name="old", password="plain")
+    assert _stored_password(tmp_path, "old").startswith("scrypt$")
+    assert login_user(client, name="old", password="plain")
+
+
+def test_unknown_names_are_verified_like_wrong_passwords(
+    client: TestClient, monkeypatch
+) -> None:
+    from routers import auth
+
+    verified = []
+    verify = auth.hasher.verify
+
+    async def recording(password: str, stored: str) -> bool:
+        verified.append(stored)
+        return await verify(password, stored)
+
+    monkeypatch.setattr(auth.hasher, "verify", recording)
+    register_user(client)
+
+    for name in ("testuser", "nobody"):
+        response = client.post(
+            "/auth/login", data={"username": name, "password": "wrong"}
+        )
+        assert response.status_code == 400
+    # both paid for a full verify at the current cost
+    assert [auth.hasher.needs_rehash(stored) for stored in verified] == [False, False]
+    assert verified[0] != verified[1]
+
+
+def test_saturated_hasher_answers_503(client: TestClient, monkeypatch) -> None:
+    from routers import auth
+
+    register_user(client)
+    monkeypatch.setattr(auth.hasher, "in_flight", auth.hasher.limit)
+
+    response = client.post(
+        "/auth/login", data={"username": "testuser", "password": "testpass"}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_process_pool_rejects_calls_beyond_its_queue() -> None:
+    from passwords import PasswordHasher, PasswordHasherBusy, verify_password
+
+    hasher = PasswordHasher(cost=4, workers=1, queue=1)
+
+    async def storm():
+        return await asyncio.gather(
+            *(hasher.hash("secret") for _ in range(3)), return_exceptions=True
+        )
+
+    try:
+        results = asyncio.run(storm())
+    finally:
+        hasher.shutdown()
+
+    hashes = [result for result in results if isinstance(result, str)]
+    assert len(hashes) == 2
+    assert all(verify_password("secret", stored) for stored in hashes)
+    assert isinstance(results[2], PasswordHasherBusy)
+    assert hasher.rejected == 1
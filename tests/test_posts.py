@@ -232,3 +232,159 @@ def test_friends_only_post_blocked_for_non_friend(
         headers=auth_header(stranger_token),
     )
     assert response.status_code == 403
+
+
+def _feed_users(client: TestClient, *names: str) -> list:
+    headers = []
+    for name in names:
+        register_user(client, name=name, password="pass")
+        headers.append(auth_header(login_user(client, name=name, password="pass")))
+    return headers
+
+
+def _post(client: TestClient, headers: dict, content: str, **params) -> None:
+    response = client.post(
+        "/create-post",
+        params={"post_type": "text", "content": content, **params},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+
+
+def _feed(client: TestClient, headers: dict, **params) -> list:
+    response = client.get("/feed", params=params, headers=headers)
+    assert response.status_code == 200
+    return [post["content"] for post in response.json()["posts"]]
+
+
+def test_feed_holds_the_posts_each_reader_may_see(client: TestClient) -> None:
+    alice, bob, carol, dave = _feed_users(client, "alice", "bob", "carol", "dave")
+    client.post("/send-friend-request", params={"receiver_id": 2}, headers=alice)
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=bob,
+    )
+    client.post(
+        "/create-group", params={"name": "club", "owner_id": 1}, json=[3], headers=alice
+    )
+
+    _post(client, alice, "public", visibility="public")
+    _post(client, alice, "friends", visibility="friends")
+    _post(client, alice, "club", visibility="group", group_id=1)
+    _post(client, bob, "from bob", visibility="friends")
+
+    assert _feed(client, alice) == ["from bob", "club", "friends", "public"]
+    assert _feed(client, bob) == ["from bob", "friends", "public"]
+    assert _feed(client, carol) == ["club"]
+    assert _feed(client, dave) == []
+
+    # moving a post between friends and group delivery redelivers it
+    client.put("/update-post/3", params={"visibility": "friends"}, headers=alice)
+    assert _feed(client, bob) == ["from bob", "club", "friends", "public"]
+    assert _feed(client, carol) == []
+    client.put("/update-post/3", params={"visibility": "group"}, headers=alice)
+    assert _feed(client, carol) == ["club"]
+
+    client.delete("/delete-post", params={"post_id": 2}, headers=alice)
+    assert _feed(client, bob) == ["from bob", "public"]
+
+    # ending a friendship or leaving a group takes its posts back
+    client.delete("/remove-friend", params={"friend_id": 2}, headers=alice)
+    assert _feed(client, bob) == ["from bob"]
+    assert _feed(client, alice) == ["club", "public"]
+    client.delete(
+        "/remove-group-member", params={"group_id": 1, "user_id": 3}, headers=alice
+    )
+    assert _feed(client, carol) == []
+
+
+def test_feed_pages_are_two_queries(client: TestClient) -> None:
+    (alice,) = _feed_users(client, "alice")
+    for i in range(5):
+        _post(client, alice, f"post {i}", visibility="public")
+
+    first = client.get("/feed", params={"limit": 2}, headers=alice)
+    body = first.json()
+    assert [post["id"] for post in body["posts"]] == [5, 4]
+    assert body["next_cursor"] == 4
+    # the caller comes from the user cache, so only the pulled sources and
+    # the timeline are read
+    assert first.headers["X-Query-Count"] == "2"
+
+    pages = [body["posts"]]
+    while body["next_cursor"] is not None:
+        body = client.get(
+            "/feed", params={"limit": 2, "before": body["next_cursor"]}, headers=alice
+        ).json()
+        pages.append(body["posts"])
+    assert [[post["id"] for post in page] for page in pages] == [[5, 4], [3, 2], [1]]
+
+
+def test_feeds_pull_the_posts_of_large_audiences(
+    client: TestClient, monkeypatch
+) -> None:
+    import fanout
+    from database import get_db_connection
+
+    monkeypatch.setattr(fanout, "PUSH_LIMIT", 1)
+    alice, bob, carol, dave = _feed_users(client, "alice", "bob", "carol", "dave")
+    client.post("/send-friend-request", params={"receiver_id": 2}, headers=alice)
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=bob,
+    )
+    # one friend is within the limit, so this post is pushed
+    _post(client, alice, "pushed", visibility="public")
+    client.post("/send-friend-request", params={"receiver_id": 3}, headers=alice)
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=carol,
+    )
+    client.post(
+        "/create-group",
+        params={"name": "club", "owner_id": 4},
+        json=[2, 3],
+        headers=dave,
+    )
+    _post(client, alice, "pulled", visibility="friends")
+    _post(client, dave, "club", visibility="group", group_id=1)
+    _post(client, bob, "from bob", visibility="public")
+
+    conn = get_db_connection()
+    delivered = [
+        tuple(row)
+        for row in conn.execute(
+            "SELECT post_id, user_id FROM timelines ORDER BY post_id, user_id"
+        )
+    ]
+    pulled = (
+        [row[0] for row in conn.execute("SELECT user_id FROM pulled_authors")],
+        [row[0] for row in conn.execute("SELECT group_id FROM pulled_groups")],
+    )
+    conn.close()
+    assert delivered == [(1, 1), (1, 2), (2, 1), (3, 4), (4, 1), (4, 2)]
+    assert pulled == ([1], [1])
+
+    # the pushed post is in bob's timeline and alice's stream, and shows once
+    assert _feed(client, bob) == ["from bob", "club", "pulled", "pushed"]
+    assert _feed(client, carol) == ["club", "pulled", "pushed"]
+    response = client.get("/feed", params={"limit": 2}, headers=bob)
+    assert [post["content"] for post in response.json()["posts"]] == [
+        "from bob",
+        "club",
+    ]
+    # the pulled sources, the timeline and the pulled streams
+    assert response.headers["X-Query-Count"] == "3"
+    assert _feed(client, bob, before=3) == ["pulled", "pushed"]
+
+    client.delete("/remove-friend", params={"friend_id": 3}, headers=alice)
+    assert _feed(client, carol) == ["club"]
+    client.delete(
+        "/remove-group-member", params={"group_id": 1, "user_id": 3}, headers=dave
+    )
+    assert _feed(client, carol) == []
+    client.delete("/delete-post", params={"post_id": 2}, headers=alice)
+    assert _feed(client, bob) == ["from bob", "club", "pushed"]
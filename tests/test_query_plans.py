@@ -0,0 +1,157 @@
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+@pytest.fixture()
+def traced_statements(client: TestClient, monkeypatch):
+    import database
+
+    statements = []
+
+    # GET requests read on the read-only connections, so both pools are traced
+    for pool in (database.pool, database.read_pool):
+
+        def traced_acquire(acquire=pool.acquire):
+            conn = acquire()
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        monkeypatch.setattr(pool, "acquire", traced_acquire)
+    return statements
+
+
+def _exercise_every_endpoint(client: TestClient) -> None:
+    register_user(client, name="admin", password="pass", role="admin")
+    register_user(client, name="alice", password="pass")
+    register_user(client, name="bob", password="pass")
+    register_user(client, name="carol", password="pass")
+    admin = auth_header(login_user(client, name="admin", password="pass"))
+    alice = auth_header(login_user(client, name="alice", password="pass"))
+    bob = auth_header(login_user(client, name="bob", password="pass"))
+
+    client.post("/send-friend-request", params={"receiver_id": 3}, headers=alice)
+    client.post("/send-friend-request", params={"receiver_id": 4}, headers=alice)
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 2, "action": "accept"},
+        headers=bob,
+    )
+    client.get("/get-my-friends/2", headers=alice)
+    client.get("/friend-requests", headers=alice)
+    client.get("/friend-requests", params={"direction": "outgoing"}, headers=alice)
+    client.post(
+        "/respond-friend-requests",
+        json=[{"sender_id": 2, "action": "accept"}],
+        headers=alice,
+    )
+
+    client.post(
+        "/create-group",
+        params={"name": "club", "owner_id": 2},
+        json=[3],
+        headers=alice,
+    )
+    client.post(
+        "/add-member", params={"group_id": 1, "new_member_id": 4}, headers=alice
+    )
+    client.get("/suggested-friends", headers=alice)
+    client.get("/mutual-friends", params={"other_id": 3}, headers=alice)
+    client.get("/connection-path", params={"other_id": 3}, headers=alice)
+
+    client.post(
+        "/create-post",
+        params={
+            "post_type": "text",
+            "content": "hello",
+            "visibility": "friends",
+            "tags": ["a", "b"],
+        },
+        headers=alice,
+    )
+    client.post(
+        "/create-post",
+        params={
+            "post_type": "text",
+            "content": "club only",
+            "visibility": "group",
+            "group_id": 1,
+            "tags": ["a"],
+        },
+        headers=alice,
+    )
+    client.get("/get-post/1", headers=bob)
+    client.get("/get-post/2", headers=bob)
+    client.put("/update-post/1", params={"content": "hi"}, headers=alice)
+    client.put("/update-post/2", params={"visibility": "friends"}, headers=alice)
+    client.get("/feed", headers=bob)
+    client.get("/feed", params={"before": 2}, headers=alice)
+
+    client.post(
+        "/send-message", params={"receiver_id": 3, "content": "hey"}, headers=alice
+    )
+    client.get("/get-chat", params={"other_user_id": 3}, headers=bob)
+
+    client.post(
+        "/create-story", params={"content": "s", "visibility": "friends"}, headers=alice
+    )
+    client.post("/react-to-story", params={"story_id": 1, "emoji": "🔥"}, headers=bob)
+    client.get("/get-stories", headers=bob)
+    client.delete("/delete-story", params={"story_id": 1}, headers=alice)
+
+    client.delete("/delete-post", params={"post_id": 1}, headers=admin)
+    client.delete(
+        "/remove-group-member", params={"group_id": 1, "user_id": 4}, headers=alice
+    )
+    client.delete("/delete-group", params={"group_id": 1}, headers=alice)
+    client.delete("/remove-friend", params={"friend_id": 3}, headers=alice)
+    client.delete("/force-delete-user", params={"name": "carol"})
+
+
+def _full_scans(conn: sqlite3.Connection, statement: str) -> list[str]:
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    # foreign key actions show up in the plan too, so cascades are covered.
+    # A constant row (INSERT ... SELECT of bound values) and json_each over a
+    # bound array read no table.
+    return [
+        row[3]
+        for row in plan
+        if row[3].startswith("SCAN ")
+        and row[3] != "SCAN CONSTANT ROW"
+        and "VIRTUAL TABLE" not in row[3]
+    ]
+
+
+def _reads_rows(statement: str) -> bool:
+    # INSERT ... SELECT reads rows too, the fan-out deliveries for one
+    words = statement.split()
+    verb = words[0].upper() if words else ""
+    if verb in ("SELECT", "UPDATE", "DELETE", "WITH"):
+        return True
+    return verb == "INSERT" and "SELECT" in (word.upper() for word in words)
+
+
+def test_router_queries_do_not_scan_tables(
+    client: TestClient, traced_statements: list[str]
+) -> None:
+    import database
+
+    _exercise_every_endpoint(client)
+
+    queries = {
+        statement.strip() for statement in traced_statements if _reads_rows(statement)
+    }
+    # the read-only connections and the fan-out deliveries are both traced
+    assert any("FROM timelines t" in query for query in queries)
+    assert any(query.startswith("INSERT OR IGNORE INTO timelines") for query in queries)
+
+    conn = database.get_db_connection()
+    offenders = {}
+    for query in queries:
+        scans = _full_scans(conn, query)
+        if scans:
+            offenders[" ".join(query.split())] = scans
+    conn.close()
+
+    assert offenders == {}
@@ -0,0 +1,118 @@
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bucket_allows_a_burst_then_refills_lazily() -> None:
+    from ratelimit import RateLimiter
+
+    clock = FakeClock()
+    limiter = RateLimiter(3, 60, clock=clock)
+
+    assert [limiter.acquire("ip") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("ip") == pytest.approx(20)
+    assert limiter.acquire("other") == 0.0
+
+    clock.now = 20
+    assert limiter.acquire("ip") == 0.0
+    assert limiter.acquire("ip") == pytest.approx(20)
+    assert limiter.rejected == 2
+
+
+def test_idle_and_least_recently_used_buckets_are_dropped() -> None:
+    from ratelimit import RateLimiter
+
+    clock = FakeClock()
+    limiter = RateLimiter(2, 1, max_keys=64, shards=4, clock=clock)
+
+    for key in range(1000):
+        limiter.acquire(key)
+    assert len(limiter) <= 64
+    assert limiter.evictions >= 1000 - 64
+
+    # every bucket has refilled; using keys sweeps the idle ones out
+    clock.now = 10
+    for key in range(1000, 1016):
+        limiter.acquire(key)
+    assert len(limiter) <= 16
+
+
+def test_login_is_limited_per_username_and_address(
+    client: TestClient, monkeypatch
+) -> None:
+    import ratelimit
+
+    monkeypatch.setitem(
+        ratelimit.limiters["login"], "user", ratelimit.RateLimiter(2, 60)
+    )
+    register_user(client)
+    for _ in range(2):
+        assert login_user(client)
+
+    response = client.post(
+        "/auth/login", data={"username": "testuser", "password": "testpass"}
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+
+
+def test_a_refused_request_takes_no_token(monkeypatch) -> None:
+    import ratelimit
+    from fastapi import HTTPException
+    from starlette.requests import Request
+
+    ip = ratelimit.RateLimiter(2, 60)
+    monkeypatch.setitem(ratelimit.limiters["login"], "ip", ip)
+    monkeypatch.setitem(
+        ratelimit.limiters["login"], "user", ratelimit.RateLimiter(1, 60)
+    )
+
+    def login(address: str, name: str) -> int:
+        request = Request({"type": "http", "client": (address, 1234)})
+        try:
+            ratelimit.check("login", request, (address, name))
+        except HTTPException as e:
+            return e.status_code
+        return 200
+
+    assert login("10.0.0.1", "bob") == 200
+    # refused by bob's bucket, so the address keeps its second token
+    assert login("10.0.0.1", "bob") == 429
+    assert login("10.0.0.1", "ann") == 200
+    assert login("10.0.0.1", "cy") == 429
+    # bob's bucket at one address does not lock him out from another
+    assert login("10.0.0.2", "bob") == 200
+    assert ip.rejected == 1
+
+
+def test_friend_requests_are_limited_per_sender(
+    client: TestClient, monkeypatch
+) -> None:
+    import ratelimit
+
+    monkeypatch.setitem(
+        ratelimit.limiters["send_friend_request"], "user", ratelimit.RateLimiter(1, 5)
+    )
+    headers = []
+    for name in ("a", "b", "c"):
+        register_user(client, name=name, password="pass")
+        headers.append(auth_header(login_user(client, name=name, password="pass")))
+
+    def request(sender: dict, receiver_id: int):
+        return client.post(
+            "/send-friend-request", params={"receiver_id": receiver_id}, headers=sender
+        )
+
+    assert request(headers[0], 2).status_code == 200
+    limited = request(headers[0], 3)
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "5"
+    assert request(headers[1], 3).status_code == 200
@@ -0,0 +1,275 @@
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+@pytest.fixture()
+def memory_client(tmp_path) -> TestClient:
+    import database
+    import repositories
+
+    database.configure(str(tmp_path / "test.db"))
+    repositories.configure("memory")
+
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+    repositories.configure("sqlite")
+    database.close()
+
+
+def _scrub(value):
+    # timestamps differ between runs, everything else must match exactly
+    if isinstance(value, dict):
+        return {k: "<ts>" if k == "timestamp" else _scrub(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_scrub(v) for v in value]
+    return value
+
+
+def _scenario(client: TestClient) -> list:
+    responses = []
+
+    def call(method, url, **kwargs):
+        response = client.request(method, url, **kwargs)
+        responses.append((method, url, response.status_code, _scrub(response.json())))
+
+    register_user(client, name="admin", password="pass", role="admin")
+    call("POST", "/auth/register", json={"name": "x", "password": "p", "role": "admin"})
+    register_user(client, name="alice", password="pass")
+    register_user(client, name="bob", password="pass")
+    register_user(client, name="carol", password="pass")
+    call(
+        "POST", "/auth/register", json={"name": "bob", "password": "p", "role": "user"}
+    )
+    admin = auth_header(login_user(client, name="admin", password="pass"))
+    alice = auth_header(login_user(client, name="alice", password="pass"))
+    bob = auth_header(login_user(client, name="bob", password="pass"))
+    carol = auth_header(login_user(client, name="carol", password="pass"))
+
+    call("POST", "/send-friend-request", params={"receiver_id": 3}, headers=alice)
+    call("POST", "/send-friend-request", params={"receiver_id": 3}, headers=alice)
+    call("POST", "/send-friend-request", params={"receiver_id": 99}, headers=alice)
+    call("POST", "/send-friend-request", params={"receiver_id": 4}, headers=alice)
+    call(
+        "POST",
+        "/respond-friend-request",
+        params={"sender_id": 2, "action": "accept"},
+        headers=bob,
+    )
+    call(
+        "POST",
+        "/respond-friend-request",
+        params={"sender_id": 2, "action": "decline"},
+        headers=carol,
+    )
+    call(
+        "POST",
+        "/respond-friend-request",
+        params={"sender_id": 2, "action": "accept"},
+        headers=carol,
+    )
+    call("GET", "/friend-requests", headers=carol)
+    call("GET", "/friend-requests", params={"direction": "outgoing"}, headers=alice)
+    call(
+        "POST",
+        "/respond-friend-requests",
+        json=[
+            {"sender_id": 2, "action": "decline"},
+            {"sender_id": 9, "action": "accept"},
+        ],
+        headers=bob,
+    )
+    call("GET", "/get-my-friends/2", headers=alice)
+    call("GET", "/get-my-friends/3", headers=bob)
+
+    call(
+        "POST",
+        "/create-group",
+        params={"name": "club", "owner_id": 2},
+        json=[3],
+        headers=alice,
+    )
+    call(
+        "POST", "/add-member", params={"group_id": 1, "new_member_id": 3}, headers=alice
+    )
+    call("POST", "/add-member", params={"group_id": 1, "new_member_id": 4}, headers=bob)
+    call(
+        "POST", "/add-member", params={"group_id": 1, "new_member_id": 4}, headers=alice
+    )
+
+    import suggestions
+
+    client.portal.call(suggestions.refresh_all)
+    call("GET", "/suggested-friends", headers=bob)
+    call("GET", "/suggested-friends", headers=carol)
+    call("GET", "/mutual-friends", params={"other_id": 4}, headers=bob)
+    call("GET", "/connection-path", params={"other_id": 2}, headers=bob)
+    call("GET", "/connection-path", params={"other_id": 4}, headers=bob)
+
+    call(
+        "POST",
+        "/create-post",
+        params={
+            "post_type": "text",
+            "content": "hello",
+            "visibility": "friends",
+            "tags": ["a", "b"],
+        },
+        headers=alice,
+    )
+    call(
+        "POST",
+        "/create-post",
+        params={
+            "post_type": "text",
+            "content": "club only",
+            "visibility": "group",
+            "group_id": 1,
+            "tags": ["a"],
+        },
+        headers=alice,
+    )
+    call("GET", "/get-post/1", headers=bob)
+    call("GET", "/get-post/1", headers=carol)
+    call("GET", "/get-post/1")
+    call("GET", "/get-post/2", headers=carol)
+    call("PUT", "/update-post/1", params={"content": "hi"}, headers=alice)
+    call("PUT", "/update-post/1", params={"visibility": "public"}, headers=bob)
+    call("GET", "/get-post/1")
+    call("GET", "/feed", headers=alice)
+    call("GET", "/feed", params={"limit": 1}, headers=bob)
+    call("GET", "/feed", params={"before": 2}, headers=bob)
+    call("GET", "/feed", headers=carol)
+    call("PUT", "/update-post/2", params={"visibility": "friends"}, headers=alice)
+    call("GET", "/feed", headers=carol)
+    call("PUT", "/update-post/2", params={"visibility": "group"}, headers=alice)
+    call("GET", "/feed", headers=carol)
+
+    call(
+        "POST",
+        "/send-message",
+        params={"receiver_id": 3, "content": "hey"},
+        headers=alice,
+    )
+    call(
+        "POST", "/send-message", params={"receiver_id": 2, "content": "yo"}, headers=bob
+    )
+    call(
+        "POST",
+        "/send-message",
+        params={"receiver_id": 4, "content": "no"},
+        headers=alice,
+    )
+    call("GET", "/get-chat", params={"other_user_id": 2}, headers=bob)
+
+    call(
+        "POST",
+        "/create-story",
+        params={"content": "s", "visibility": "friends"},
+        headers=alice,
+    )
+    call(
+        "POST",
+        "/create-story",
+        params={"content": "g", "visibility": "group", "group_id": 1},
+        headers=alice,
+    )
+    call("POST", "/react-to-story", params={"story_id": 1, "emoji": "🔥"}, headers=bob)
+    call("POST", "/react-to-story", params={"story_id": 1, "emoji": "🔥"}, headers=bob)
+    call(
+        "POST", "/react-to-story", params={"story_id": 1, "emoji": "😂"}, headers=alice
+    )
+    call(
+        "POST", "/react-to-story", params={"story_id": 9, "emoji": "😂"}, headers=alice
+    )
+    call("GET", "/get-stories", headers=bob)
+    call("GET", "/get-stories", headers=carol)
+    call("GET", "/get-stories")
+    call("DELETE", "/delete-story", params={"story_id": 1}, headers=bob)
+    call("DELETE", "/delete-story", params={"story_id": 1}, headers=alice)
+
+    call("DELETE", "/delete-post", params={"post_id": 1}, headers=bob)
+    call("DELETE", "/delete-post", params={"post_id": 1}, headers=admin)
+    call(
+        "DELETE",
+        "/remove-group-member",
+        params={"group_id": 1, "user_id": 4},
+        headers=alice,
+    )
+    call(
+        "DELETE",
+        "/remove-group-member",
+        params={"group_id": 1, "user_id": 4},
+        headers=alice,
+    )
+    call("DELETE", "/remove-friend", params={"friend_id": 3}, headers=alice)
+    call("DELETE", "/remove-friend", params={"friend_id": 3}, headers=alice)
+    call("DELETE", "/delete-group", params={"group_id": 1}, headers=bob)
+    call("GET", "/feed", headers=bob)
+    call("GET", "/feed", headers=carol)
+    call("DELETE", "/delete-group", params={"group_id": 1}, headers=alice)
+    call("GET", "/get-post/2", headers=alice)
+    call("GET", "/feed", headers=alice)
+
+    # deleting a user cascades to everything that references them
+    call("DELETE", "/force-delete-user", params={"name": "alice"})
+    call("GET", "/get-stories", headers=bob)
+    call("GET", "/get-chat", params={"other_user_id": 2}, headers=bob)
+    call("GET", "/get-my-friends/3", headers=bob)
+    return responses
+
+
+# 0 pulls every post that has a reader besides its author
+@pytest.mark.parametrize("push_limit", [1000, 0])
+def test_backends_answer_identically(tmp_path, monkeypatch, push_limit) -> None:
+    import database
+    import fanout
+    import repositories
+    from main import app
+
+    monkeypatch.setattr(fanout, "PUSH_LIMIT", push_limit)
+
+    results = {}
+    for backend in repositories.BACKENDS:
+        database.configure(str(tmp_path / f"{backend}.db"))
+        repositories.configure(backend)
+        try:
+            with TestClient(app) as client:
+                results[backend] = _scenario(client)
+        finally:
+            repositories.configure("sqlite")
+            database.close()
+
+    assert results["memory"] == results["sqlite"]
+    assert not (tmp_path / "memory.db").exists()
+
+
+def test_memory_cascades_leave_no_rows(memory_client: TestClient) -> None:
+    import repositories
+
+    _scenario(memory_client)
+    for name in ("bob", "carol", "admin"):
+        memory_client.delete("/force-delete-user", params={"name": name})
+
+    store = repositories.store
+    assert store.users == {}
+    assert store.friends == {}
+    assert store.groups == {}
+    assert store.posts == {}
+    assert store.timelines == {}
+    assert store.post_readers == {}
+    assert store.pulled_authors == set()
+    assert store.pulled_groups == set()
+    assert store.messages == {}
+    assert store.stories == {}
+    assert store.reactions == {}
+
+
+def test_unknown_backend_is_rejected() -> None:
+    import repositories
+
+    with pytest.raises(ValueError):
+        repositories.configure("postgres")
@@ -0,0 +1,62 @@
+import json
+import pytest
+
+
+def _payload():
+    from records import ChatMessage, ReactionCount, Story
+
+    return {
+        "messages": [ChatMessage("здрасти", "2024-01-01 10:00:00", "alice")],
+        "stories": [
+            Story(1, "s", "2024-01-01 10:00:00", "public", 2, "bob", None, [])
+        ],
+        "reactions": [ReactionCount("🔥", 3)],
+    }
+
+
+def _as_dicts(value):
+    from records import Record
+
+    if isinstance(value, Record):
+        return _as_dicts(value.to_dict())
+    if isinstance(value, dict):
+        return {k: _as_dicts(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_as_dicts(v) for v in value]
+    return value
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_records_serialize_like_dicts(monkeypatch, use_orjson) -> None:
+    from fastapi.responses import JSONResponse
+    import responses
+
+    if not use_orjson:
+        monkeypatch.setattr(responses, "orjson", None)
+    elif responses.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    payload = _payload()
+    fast = responses.FastJSONResponse(payload).body
+    reference = JSONResponse(_as_dicts(payload)).body
+
+    assert json.loads(fast) == json.loads(reference)
+    # keys keep the column order of the records
+    assert fast.index(b'"content"') < fast.index(b'"timestamp"')
+    assert "🔥".encode() in fast
+
+
+def test_fallback_rejects_unknown_objects(monkeypatch) -> None:
+    import responses
+
+    monkeypatch.setattr(responses, "orjson", None)
+    with pytest.raises(TypeError):
+        responses.dumps({"value": object()})
+
+
+def test_records_have_no_instance_dict() -> None:
+    from records import ChatMessage
+
+    message = ChatMessage("hi", "2024-01-01 10:00:00", "alice")
+    assert not hasattr(message, "__dict__")
+    assert ChatMessage.from_row(None, ("hi", "2024-01-01 10:00:00", "alice")) == message
@@ -0,0 +1,81 @@
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+@pytest.fixture()
+def claims_mode(monkeypatch):
+    import utils
+    from revocation import revocations
+
+    monkeypatch.setattr(utils, "AUTH_MODE", "claims")
+    monkeypatch.setattr(revocations, "refresh_interval", 0)
+    return revocations
+
+
+def _friends(client: TestClient, headers: dict):
+    return client.get("/get-my-friends/1", headers=headers)
+
+
+def test_claims_mode_does_not_load_the_caller(client: TestClient, claims_mode) -> None:
+    register_user(client)
+    headers = auth_header(login_user(client))
+
+    # the first request loads the revocation list, later ones only count it
+    assert int(_friends(client, headers).headers["X-Query-Count"]) == 2
+    response = _friends(client, headers)
+    assert response.status_code == 200
+    assert int(response.headers["X-Query-Count"]) == 2
+
+
+def test_deleted_user_is_revoked_at_once(
+    client: TestClient, claims_mode, tmp_path
+) -> None:
+    register_user(client, name="gone", password="pass")
+    headers = auth_header(login_user(client, name="gone", password="pass"))
+    assert _friends(client, headers).status_code == 200
+
+    client.delete("/force-delete-user", params={"name": "gone"})
+
+    assert 1 in claims_mode
+    assert _friends(client, headers).status_code == 401
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    assert conn.execute("SELECT user_id FROM revoked_users").fetchall() == [(1,)]
+    conn.close()
+
+
+def _revoke_elsewhere(tmp_path, user_id: int) -> None:
+    # as another worker would
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    conn.execute("INSERT INTO revoked_users (user_id) VALUES (?)", (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def test_revocations_from_other_processes_apply_to_the_next_request(
+    client: TestClient, claims_mode, tmp_path
+) -> None:
+    register_user(client)
+    headers = auth_header(login_user(client))
+    assert _friends(client, headers).status_code == 200
+
+    _revoke_elsewhere(tmp_path, 1)
+    assert _friends(client, headers).status_code == 401
+    assert 1 in claims_mode
+
+
+def test_refresh_interval_defers_revocations_from_other_processes(
+    client: TestClient, claims_mode, tmp_path
+) -> None:
+    register_user(client)
+    headers = auth_header(login_user(client))
+    claims_mode.refresh_interval = 3600
+    assert _friends(client, headers).status_code == 200
+
+    # the list is not checked again until the interval has passed
+    _revoke_elsewhere(tmp_path, 1)
+    assert _friends(client, headers).status_code == 200
+
+    claims_mode.refresh_interval = 0
+    assert _friends(client, headers).status_code == 401
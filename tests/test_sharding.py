@@ -0,0 +1,469 @@
+import asyncio
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+SHARDS = 3
+
+
+@pytest.fixture()
+def db_path(tmp_path) -> str:
+    return str(tmp_path / "test.db")
+
+
+@pytest.fixture()
+def sharded_client(db_path) -> TestClient:
+    import database
+
+    database.configure(db_path, shards=SHARDS)
+
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+    database.close()
+
+
+def _rows(db_path: str, index: int, sql: str, params: tuple = ()) -> list:
+    from database import shard_path
+
+    conn = sqlite3.connect(shard_path(db_path, index))
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _users(client: TestClient, *names: str) -> list:
+    # user ids 1, 2, 3 are homed on shards 1, 2, 0
+    headers = []
+    for name in names:
+        register_user(client, name=name, password="pass")
+        headers.append(auth_header(login_user(client, name=name, password="pass")))
+    return headers
+
+
+def _befriend(client: TestClient, sender: dict, receiver_id: int, receiver: dict):
+    client.post(
+        "/send-friend-request", params={"receiver_id": receiver_id}, headers=sender
+    )
+    client.post(
+        "/respond-friend-request",
+        params={"sender_id": 1, "action": "accept"},
+        headers=receiver,
+    )
+
+
+def _post(client: TestClient, headers: dict, content: str, **params) -> None:
+    response = client.post(
+        "/create-post",
+        params={
+            "post_type": "text",
+            "content": content,
+            "visibility": "public",
+            **params,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_user_rows_live_on_their_home_shard(sharded_client, db_path) -> None:
+    alice, bob, carol = _users(sharded_client, "alice", "bob", "carol")
+    _befriend(sharded_client, alice, 2, bob)
+
+    _post(sharded_client, alice, "from alice")
+    _post(sharded_client, carol, "from carol")
+    sharded_client.post(
+        "/create-story",
+        params={"content": "bob story", "visibility": "public"},
+        headers=bob,
+    )
+    sharded_client.post(
+        "/send-message", params={"receiver_id": 2, "content": "hi"}, headers=alice
+    )
+
+    assert _rows(db_path, 0, "SELECT id, shard FROM users ORDER BY id") == [
+        (1, 1),
+        (2, 2),
+        (3, 0),
+    ]
+    assert _rows(db_path, 1, "SELECT content FROM posts") == [("from alice",)]
+    assert _rows(db_path, 0, "SELECT content FROM posts") == [("from carol",)]
+    assert _rows(db_path, 2, "SELECT content FROM stories") == [("bob story",)]
+    assert _rows(db_path, 1, "SELECT content FROM messages") == [("hi",)]
+    assert _rows(db_path, 2, "SELECT COUNT(*) FROM posts") == [(0,)]
+
+
+def test_posts_are_found_on_any_shard(sharded_client, db_path) -> None:
+    alice, bob, _carol = _users(sharded_client, "alice", "bob", "carol")
+    _post(sharded_client, alice, "hello", tags=["x", "y"])
+    _post(sharded_client, bob, "other", tags=["y", "z"])
+    [(post_id,)] = _rows(db_path, 1, "SELECT id FROM posts")
+
+    response = sharded_client.get(f"/get-post/{post_id}", headers=bob)
+    assert response.status_code == 200
+    assert response.json()["post_data"]["content"] == "hello"
+    assert response.json()["tags"] == ["x", "y"]
+    # tags are global: "y" exists once, in the directory
+    assert _rows(db_path, 0, "SELECT content FROM tags ORDER BY id") == [
+        ("x",),
+        ("y",),
+        ("z",),
+    ]
+
+    response = sharded_client.put(
+        f"/update-post/{post_id}", params={"content": "edited"}, headers=alice
+    )
+    assert response.status_code == 200
+    assert _rows(db_path, 1, "SELECT content FROM posts") == [("edited",)]
+
+    assert (
+        sharded_client.delete(
+            "/delete-post", params={"post_id": post_id}, headers=bob
+        ).status_code
+        == 403
+    )
+    assert (
+        sharded_client.delete(
+            "/delete-post", params={"post_id": post_id}, headers=alice
+        ).status_code
+        == 200
+    )
+    assert _rows(db_path, 1, "SELECT COUNT(*) FROM posts_tags") == [(0,)]
+    assert sharded_client.get(f"/get-post/{post_id}").status_code == 404
+
+
+def test_ids_are_unique_across_shards(sharded_client, db_path) -> None:
+    headers = _users(sharded_client, "alice", "bob", "carol")
+    story_ids = []
+    for user in headers * 2:
+        _post(sharded_client, user, "post")
+        response = sharded_client.post(
+            "/create-story",
+            params={"content": "story", "visibility": "public"},
+            headers=user,
+        )
+        story_ids.append(response.json()["story_id"])
+
+    post_ids = [
+        post_id
+        for index in range(SHARDS)
+        for (post_id,) in _rows(db_path, index, "SELECT id FROM posts")
+    ]
+    assert len(post_ids) == len(set(post_ids)) == 6
+    assert len(set(story_ids)) == 6
+    # new ids encode their shard: user ids 1, 2, 3 are homed on 1, 2, 0
+    assert [story_id % SHARDS for story_id in story_ids] == [1, 2, 0, 1, 2, 0]
+
+
+def test_feed_gathers_posts_from_their_authors_shards(sharded_client, db_path) -> None:
+    alice, bob, carol = _users(sharded_client, "alice", "bob", "carol")
+    _befriend(sharded_client, alice, 2, bob)
+    _befriend(sharded_client, alice, 3, carol)
+    # posts are written on shards 1, 2 and 0, each after its timelines
+    _post(sharded_client, alice, "from alice")
+    _post(sharded_client, bob, "from bob")
+    _post(sharded_client, carol, "from carol")
+
+    def feed(headers: dict) -> list:
+        response = sharded_client.get("/feed", headers=headers)
+        assert response.status_code == 200
+        return [post["content"] for post in response.json()["posts"]]
+
+    # newest first by id; ids 4, 5 and 3, since shard k hands out seq * 3 + k
+    assert feed(alice) == ["from bob", "from alice", "from carol"]
+    assert feed(bob) == ["from bob", "from alice"]
+
+    [(post_id,)] = _rows(db_path, 2, "SELECT id FROM posts")
+    sharded_client.delete("/delete-post", params={"post_id": post_id}, headers=bob)
+    assert feed(alice) == ["from alice", "from carol"]
+    assert _rows(
+        db_path, 0, "SELECT COUNT(*) FROM timelines WHERE post_id = ?", (post_id,)
+    ) == [(0,)]
+
+
+def test_feeds_pull_streams_from_every_shard(sharded_client, monkeypatch) -> None:
+    import fanout
+
+    monkeypatch.setattr(fanout, "PUSH_LIMIT", 0)
+    alice, bob, carol = _users(sharded_client, "alice", "bob", "carol")
+    _befriend(sharded_client, alice, 2, bob)
+    _befriend(sharded_client, alice, 3, carol)
+    sharded_client.post(
+        "/create-group",
+        params={"name": "club", "owner_id": 2},
+        json=[1, 3],
+        headers=bob,
+    )
+    # the group's stream is on shards 0 and 2
+    _post(sharded_client, alice, "from alice")
+    _post(sharded_client, bob, "from bob")
+    _post(sharded_client, carol, "carol club", visibility="group", group_id=1)
+    _post(sharded_client, bob, "bob club", visibility="group", group_id=1)
+
+    def feed(headers: dict, **params) -> tuple:
+        response = sharded_client.get("/feed", params=params, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        return [post["content"] for post in body["posts"]], body["next_cursor"]
+
+    assert feed(alice)[0] == ["bob club", "from bob", "from alice", "carol club"]
+    assert feed(carol)[0] == ["bob club", "from alice", "carol club"]
+    first, cursor = feed(alice, limit=2)
+    assert first == ["bob club", "from bob"]
+    assert feed(alice, before=cursor)[0] == ["from alice", "carol club"]
+
+
+def test_stories_and_reactions_are_gathered_from_all_shards(sharded_client) -> None:
+    alice, bob, carol = _users(sharded_client, "alice", "bob", "carol")
+    _befriend(sharded_client, alice, 2, bob)
+
+    story_ids = {}
+    for name, headers, visibility in (
+        ("alice", alice, "friends"),
+        ("bob", bob, "public"),
+        ("carol", carol, "public"),
+    ):
+        response = sharded_client.post(
+            "/create-story",
+            params={"content": f"{name} story", "visibility": visibility},
+            headers=headers,
+        )
+        story_ids[name] = response.json()["story_id"]
+
+    for headers in (alice, carol):
+        response = sharded_client.post(
+            "/react-to-story",
+            params={"story_id": story_ids["bob"], "emoji": "🔥"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+
+    stories = sharded_client.get("/get-stories", headers=bob).json()["stories"]
+    assert {story["content"] for story in stories} == {
+        "alice story",
+        "bob story",
+        "carol story",
+    }
+    timestamps = [story["timestamp"] for story in stories]
+    assert timestamps == sorted(timestamps, reverse=True)
+    reactions = {story["id"]: story["reactions"] for story in stories}
+    assert reactions[story_ids["bob"]] == [{"emoji": "🔥", "count": 2}]
+
+    # carol is no friend of alice
+    stories = sharded_client.get("/get-stories", headers=carol).json()["stories"]
+    assert {story["content"] for story in stories} == {"bob story", "carol story"}
+
+    response = sharded_client.delete(
+        "/delete-story", params={"story_id": story_ids["bob"]}, headers=bob
+    )
+    assert response.status_code == 200
+    stories = sharded_client.get("/get-stories", headers=carol).json()["stories"]
+    assert [story["content"] for story in stories] == ["carol story"]
+
+
+def test_chat_merges_both_senders_shards(sharded_client, db_path) -> None:
+    alice, bob, _carol = _users(sharded_client, "alice", "bob", "carol")
+    _befriend(sharded_client, alice, 2, bob)
+
+    for headers, receiver_id, content in (
+        (alice, 2, "one"),
+        (bob, 1, "two"),
+        (alice, 2, "three"),
+    ):
+        response = sharded_client.post(
+            "/send-message",
+            params={"receiver_id": receiver_id, "content": content},
+            headers=headers,
+        )
+        assert response.status_code == 200
+
+    assert _rows(db_path, 1, "SELECT content FROM messages ORDER BY id") == [
+        ("one",),
+        ("three",),
+    ]
+    assert _rows(db_path, 2, "SELECT content FROM messages") == [("two",)]
+
+    response = sharded_client.get(
+        "/get-chat", params={"other_user_id": 2}, headers=alice
+    )
+    messages = response.json()["messages"]
+    assert sorted(m["content"] for m in messages) == ["one", "three", "two"]
+    assert [m["timestamp"] for m in messages] == sorted(
+        m["timestamp"] for m in messages
+    )
+    senders = {m["content"]: m["sender_name"] for m in messages}
+    assert senders == {"one": "alice", "two": "bob", "three": "alice"}
+
+
+def test_deletes_reach_every_shard(sharded_client, db_path) -> None:
+    alice, bob, _carol = _users(sharded_client, "alice", "bob", "carol")
+    _befriend(sharded_client, alice, 2, bob)
+    sharded_client.post(
+        "/create-group", params={"name": "club", "owner_id": 2}, json=[1], headers=bob
+    )
+    _post(sharded_client, alice, "group post", visibility="group", group_id=1)
+    sharded_client.post(
+        "/create-story",
+        params={"content": "group story", "visibility": "group", "group_id": 1},
+        headers=alice,
+    )
+    _post(sharded_client, alice, "own post")
+    sharded_client.post(
+        "/send-message", params={"receiver_id": 1, "content": "hi"}, headers=bob
+    )
+
+    response = sharded_client.delete(
+        "/delete-group", params={"group_id": 1}, headers=bob
+    )
+    assert response.status_code == 200
+    assert _rows(db_path, 1, "SELECT content FROM posts") == [("own post",)]
+    assert _rows(db_path, 1, "SELECT COUNT(*) FROM stories") == [(0,)]
+
+    response = sharded_client.delete("/force-delete-user", params={"name": "alice"})
+    assert response.status_code == 200
+    for index in range(SHARDS):
+        assert _rows(db_path, index, "SELECT COUNT(*) FROM posts") == [(0,)]
+        assert _rows(db_path, index, "SELECT COUNT(*) FROM messages") == [(0,)]
+
+
+def test_unknown_group_is_rejected_on_a_shard(sharded_client) -> None:
+    alice, _bob, _carol = _users(sharded_client, "alice", "bob", "carol")
+    response = sharded_client.post(
+        "/create-story",
+        params={"content": "s", "visibility": "group", "group_id": 42},
+        headers=alice,
+    )
+    assert response.status_code == 500
+
+
+def test_move_user_keeps_data_readable(db_path) -> None:
+    import database
+    import sharding
+
+    database.configure(db_path, shards=SHARDS)
+    from main import app
+
+    with TestClient(app) as client:
+        alice, bob, _carol = _users(client, "alice", "bob", "carol")
+        _befriend(client, alice, 2, bob)
+        _post(client, alice, "hello", tags=["x"])
+        story_id = client.post(
+            "/create-story",
+            params={"content": "alice story", "visibility": "public"},
+            headers=alice,
+        ).json()["story_id"]
+        client.post(
+            "/react-to-story", params={"story_id": story_id, "emoji": "👏"}, headers=bob
+        )
+        client.post(
+            "/send-message", params={"receiver_id": 2, "content": "hi"}, headers=alice
+        )
+        [(post_id,)] = _rows(db_path, 1, "SELECT id FROM posts")
+
+        # an interrupted move leaves a copy on the target that nobody reads
+        sharding.copy_user(db_path, 1, 1, 2)
+        stories = client.get("/get-stories", headers=bob).json()["stories"]
+        assert [story["content"] for story in stories] == ["alice story"]
+
+        # moves are refused while the app serves the database
+        with pytest.raises(sharding.AppRunning):
+            sharding.move_user(db_path, SHARDS, 1, 2)
+        with pytest.raises(sharding.AppRunning):
+            sharding.rebalance(db_path, SHARDS)
+        assert _rows(db_path, 0, "SELECT shard FROM users WHERE id = 1") == [(1,)]
+
+    assert sharding.move_user(db_path, SHARDS, 1, 2)
+    assert not sharding.move_user(db_path, SHARDS, 1, 2)
+
+    assert _rows(db_path, 0, "SELECT shard FROM users WHERE id = 1") == [(2,)]
+    assert _rows(db_path, 1, "SELECT COUNT(*) FROM posts") == [(0,)]
+    assert _rows(db_path, 2, "SELECT COUNT(*) FROM stories_reaction") == [(1,)]
+
+    database.configure(db_path, shards=SHARDS)
+    with TestClient(app) as client:
+        post = client.get(f"/get-post/{post_id}", headers=bob).json()
+        assert post["post_data"]["content"] == "hello"
+        assert post["tags"] == ["x"]
+        stories = client.get("/get-stories", headers=bob).json()["stories"]
+        assert [story["reactions"] for story in stories] == [
+            [{"emoji": "👏", "count": 1}]
+        ]
+        chat = client.get("/get-chat", params={"other_user_id": 1}, headers=bob)
+        assert [m["content"] for m in chat.json()["messages"]] == ["hi"]
+
+        # new rows follow the user to the new shard
+        _post(client, alice, "after the move")
+    database.close()
+
+    assert _rows(db_path, 2, "SELECT content FROM posts WHERE user_id = 1") == [
+        ("hello",),
+        ("after the move",),
+    ]
+
+
+def test_rebalance_spreads_a_single_database(db_path) -> None:
+    import database
+    import sharding
+
+    # everything written while there was only one database lives on shard 0
+    database.configure(db_path, shards=1)
+    from main import app
+
+    with TestClient(app) as client:
+        alice, bob, carol = _users(client, "alice", "bob", "carol")
+        for headers in (alice, bob, carol):
+            _post(client, headers, "legacy")
+    database.close()
+
+    sharding.prepare(db_path, SHARDS)
+    assert sharding.rebalance(db_path, SHARDS) == 2
+    assert sharding.rebalance(db_path, SHARDS) == 0
+    assert "misplaced users: 0" in sharding.status(db_path, SHARDS)
+
+    database.configure(db_path, shards=SHARDS)
+    with TestClient(app) as client:
+        for post_id in (1, 2, 3):
+            assert client.get(f"/get-post/{post_id}").status_code == 200
+        _post(client, alice, "new")
+    database.close()
+
+    post_ids = [
+        post_id
+        for index in range(SHARDS)
+        for (post_id,) in _rows(db_path, index, "SELECT id FROM posts")
+    ]
+    assert len(post_ids) == len(set(post_ids)) == 4
+
+
+def test_shards_are_written_in_ascending_order(db_path) -> None:
+    import database
+    from migrations import migrate_shards
+
+    database.configure(db_path, shards=SHARDS)
+    connections = database.get_shard_connections()
+    migrate_shards(connections)
+    for conn in connections:
+        conn.close()
+
+    async def scenario():
+        db = database.AsyncSession(
+            database.executor, shard_executors=database.executors[1:]
+        )
+        try:
+            await db.shard(2).execute("DELETE FROM posts")
+            with pytest.raises(RuntimeError):
+                await db.shard(1).execute("DELETE FROM posts")
+            with pytest.raises(RuntimeError):
+                await db.execute("DELETE FROM tags")
+        finally:
+            await db.close(commit=False)
+        assert not any(e.writer_lock.locked() for e in database.executors)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        database.close()
@@ -0,0 +1,154 @@
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+def _users(client: TestClient, *names: str) -> list:
+    headers = []
+    for name in names:
+        register_user(client, name=name, password="pass")
+        headers.append(auth_header(login_user(client, name=name, password="pass")))
+    return headers
+
+
+def _befriend(client: TestClient, users: list, sender_id: int, receiver_id: int):
+    client.post(
+        "/send-friend-request",
+        params={"receiver_id": receiver_id},
+        headers=users[sender_id - 1],
+    )
+    response = client.post(
+        "/respond-friend-request",
+        params={"sender_id": sender_id, "action": "accept"},
+        headers=users[receiver_id - 1],
+    )
+    assert response.status_code == 200
+
+
+def _suggested(client: TestClient, headers: dict) -> list:
+    import suggestions
+
+    client.portal.call(suggestions.refresh_all)
+    response = client.get("/suggested-friends", headers=headers)
+    assert response.status_code == 200
+    return [
+        (s["name"], s["mutual_friends"], s["shared_groups"])
+        for s in response.json()["suggestions"]
+    ]
+
+
+def test_suggestions_rank_mutual_friends_then_groups(client: TestClient) -> None:
+    users = _users(client, "alice", "bob", "carol", "dan", "eve", "fay", "gus")
+    alice, bob = users[0], users[1]
+    for sender_id, receiver_id in [(1, 2), (1, 3), (2, 4), (3, 4), (2, 5), (2, 7)]:
+        _befriend(client, users, sender_id, receiver_id)
+    client.post(
+        "/create-group",
+        params={"name": "club", "owner_id": 2},
+        json=[1, 6],
+        headers=bob,
+    )
+    # a pending request is not suggested back
+    client.post("/send-friend-request", params={"receiver_id": 7}, headers=alice)
+
+    assert _suggested(client, alice) == [("dan", 2, 0), ("eve", 1, 0), ("fay", 0, 1)]
+
+    response = client.get("/suggested-friends", params={"limit": 1}, headers=alice)
+    assert [s["name"] for s in response.json()["suggestions"]] == ["dan"]
+    # the precomputed rows are read with one query; the other checks that
+    # the friend graph has every logged change
+    assert int(response.headers["X-Query-Count"]) == 2
+
+
+def test_friendship_changes_refresh_suggestions(client: TestClient) -> None:
+    users = _users(client, "alice", "bob", "carol", "dan")
+    alice = users[0]
+    _befriend(client, users, 1, 2)
+    _befriend(client, users, 2, 3)
+    assert _suggested(client, alice) == [("carol", 1, 0)]
+
+    # dan is three steps from alice until she befriends carol
+    _befriend(client, users, 3, 4)
+    assert _suggested(client, alice) == [("carol", 1, 0)]
+    _befriend(client, users, 1, 3)
+    assert _suggested(client, alice) == [("dan", 1, 0)]
+
+    response = client.delete("/remove-friend", params={"friend_id": 3}, headers=alice)
+    assert response.status_code == 200
+    assert _suggested(client, alice) == [("carol", 1, 0)]
+
+
+def test_accepted_candidates_are_hidden_before_the_refresh(client: TestClient) -> None:
+    users = _users(client, "alice", "bob", "carol")
+    alice = users[0]
+    _befriend(client, users, 1, 2)
+    _befriend(client, users, 2, 3)
+    assert _suggested(client, alice) == [("carol", 1, 0)]
+
+    _befriend(client, users, 3, 1)
+
+    response = client.get("/suggested-friends", headers=alice)
+    assert response.json()["suggestions"] == []
+
+
+def test_concurrent_refreshes_claim_different_users(
+    client: TestClient, monkeypatch
+) -> None:
+    import asyncio
+    import suggestions
+    from repositories import open_repositories
+
+    _users(client, "alice", "bob")
+    refreshed = []
+    recompute = suggestions.recompute
+
+    def recording(user_ids, *inputs):
+        refreshed.append(user_ids)
+        return recompute(user_ids, *inputs)
+
+    monkeypatch.setattr(suggestions, "recompute", recording)
+
+    async def two_workers():
+        async with open_repositories() as repos:
+            await repos.suggestions.mark_stale([1, 2])
+        counts = await asyncio.gather(
+            suggestions.refresh_stale(batch_size=1),
+            suggestions.refresh_stale(batch_size=1),
+        )
+        # marked again after its refresh: queued once more
+        async with open_repositories() as repos:
+            await repos.suggestions.mark_stale([2])
+        async with open_repositories() as repos:
+            return counts, await repos.suggestions.claim(10)
+
+    assert client.portal.call(two_workers) == ([1, 1], [2])
+    assert sorted(refreshed) == [[1], [2]]
+
+
+def test_a_batch_is_ranked_outside_any_transaction(
+    client: TestClient, monkeypatch
+) -> None:
+    import database
+    import suggestions
+    from repositories import open_repositories
+
+    _users(client, "alice", "bob")
+    locked = []
+
+    def failing(user_ids, *inputs):
+        locked.append(database.executor.writer_lock.locked())
+        raise RuntimeError("ranking failed")
+
+    monkeypatch.setattr(suggestions, "recompute", failing)
+
+    async def refresh():
+        async with open_repositories() as repos:
+            await repos.suggestions.mark_stale([1, 2])
+        with pytest.raises(RuntimeError):
+            await suggestions.refresh_stale()
+        async with open_repositories() as repos:
+            return await repos.suggestions.claim(10)
+
+    # the failed batch is back on the queue
+    assert client.portal.call(refresh) == [1, 2]
+    assert locked == [False]
@@ -0,0 +1,145 @@
+import json
+import sqlite3
+import sys
+import pytest
+from fastapi.testclient import TestClient
+from helpers import register_user, login_user, auth_header
+
+
+def _ndjson(*rows) -> bytes:
+    return b"\n".join(
+        row if isinstance(row, bytes) else json.dumps(row).encode() for row in rows
+    )
+
+
+def _import(client: TestClient, headers: dict, body: bytes):
+    return client.post(
+        "/auth/import-users",
+        content=body,
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+
+
+def _admin(client: TestClient) -> dict:
+    register_user(client, name="root", password="pass", role="admin")
+    return auth_header(login_user(client, name="root", password="pass"))
+
+
+def test_import_creates_users_and_reports_bad_rows(client: TestClient) -> None:
+    from passwords import hash_password
+
+    headers = _admin(client)
+    body = _ndjson(
+        {"name": "ana", "password": "secret"},
+        {"name": "bo", "password_hash": hash_password("hashed", cost=4)},
+        {"name": "ana", "password": "again"},
+        {"name": "root", "password": "taken"},
+        {"name": "cy"},
+        {"name": "di", "password_hash": "plain"},
+        {"name": "ed", "password": "x", "role": "admin"},
+        b"{not json",
+        b"",
+        {"name": "fay", "password": "pw", "role": "user"},
+    )
+
+    response = _import(client, headers, body)
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["created"] == 3
+    assert report["error_count"] == 6
+    errors = {error["line"]: error["error"] for error in report["errors"]}
+    assert errors == {
+        3: "Username repeated in this import",
+        4: "Username taken",
+        5: "Give exactly one of password, password_hash",
+        6: "Unsupported password_hash format",
+        7: "An admin user already exists",
+        8: errors[8],
+    }
+    assert "JSON" in errors[8]
+
+    assert login_user(client, name="ana", password="secret")
+    assert login_user(client, name="bo", password="hashed")
+    assert login_user(client, name="fay", password="pw")
+
+
+def test_import_reports_names_taken_after_its_check(
+    client: TestClient, monkeypatch
+) -> None:
+    from repositories.sqlite import SqliteUserRepository
+
+    headers = _admin(client)
+
+    # as if "root" had been registered between the check and the insert
+    async def nothing_taken(self, names):
+        return set()
+
+    monkeypatch.setattr(SqliteUserRepository, "existing_names", nothing_taken)
+    body = _ndjson({"name": "ana", "password": "a"}, {"name": "root", "password": "b"})
+
+    response = _import(client, headers, body)
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["created"] == 1
+    assert report["errors"] == [{"line": 2, "error": "Username taken"}]
+    assert login_user(client, name="ana", password="a")
+
+
+def test_import_is_for_admins_only(client: TestClient) -> None:
+    register_user(client)
+    headers = auth_header(login_user(client))
+
+    response = _import(client, headers, _ndjson({"name": "x", "password": "y"}))
+
+    assert response.status_code == 403
+
+
+def test_imported_users_are_placed_on_their_shard(tmp_path) -> None:
+    import database
+
+    db_path = str(tmp_path / "test.db")
+    database.configure(db_path, shards=3)
+
+    from main import app
+
+    with TestClient(app) as client:
+        headers = _admin(client)
+        rows = [{"name": f"user{i}", "password": "pw"} for i in range(5)]
+        assert _import(client, headers, _ndjson(*rows)).json()["created"] == 5
+    database.close()
+
+    conn = sqlite3.connect(db_path)
+    placed = conn.execute("SELECT id, shard FROM users ORDER BY id").fetchall()
+    conn.close()
+    assert placed == [(user_id, user_id % 3) for user_id in range(1, 7)]
+
+
+def test_cli_imports_in_batches(tmp_path, monkeypatch, capsys) -> None:
+    import user_import
+
+    source = tmp_path / "users.ndjson"
+    source.write_bytes(
+        _ndjson(
+            *({"name": f"user{i}", "password": "pw"} for i in range(7)),
+            {"name": "user0", "password": "pw"},
+        )
+    )
+    db_path = str(tmp_path / "import.db")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["user_import", str(source), "--db", db_path, "--batch-size", "3"],
+    )
+
+    with pytest.raises(SystemExit) as exit_info:
+        user_import.main()
+
+    assert exit_info.value.code == 1
+    out, err = capsys.readouterr()
+    assert "created 7 users, 1 errors" in out
+    assert "line 8: Username repeated in this import" in err
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone() == (7,)
+    conn.close()